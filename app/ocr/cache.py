@@ -0,0 +1,472 @@
+import os
+import sys
+import json
+import time
+import fcntl
+import shutil
+import hashlib
+import tempfile
+import numpy as np
+import redis
+
+# Add parent directory to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.logger import get_logger
+
+# Initialize logger
+logger = get_logger('ocr_cache')
+
+
+class DiskCacheBackend:
+    """
+    Stores cached values as files in a local directory.
+
+    Each entry's modification time is bumped when it is read, so evicting the
+    oldest files first gives least-recently-used eviction. Hit/miss counters
+    are kept in a stats file next to the entries, so they add up across jobs
+    and every process sharing the directory.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.stats_path = os.path.join(directory, '.stats.json')
+
+    def _path(self, key):
+        return os.path.join(self.directory, key)
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                value = f.read()
+        except FileNotFoundError:
+            return None
+        os.utime(path, None)
+        return value
+
+    def set(self, key, value):
+        os.makedirs(self.directory, exist_ok=True)
+        # Write to a temporary file first so readers never see a partial entry
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix='.tmp-')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(value)
+        os.replace(tmp_path, self._path(key))
+        self.evict()
+
+    def entries(self):
+        """
+        List cache entries, oldest access first
+
+        Returns:
+            List of (path, size, mtime) tuples
+        """
+        entries = []
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return entries
+        for name in names:
+            if name.startswith('.'):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                continue
+            entries.append((os.path.join(self.directory, name), stat.st_size, stat.st_mtime))
+        entries.sort(key=lambda entry: entry[2])
+        return entries
+
+    def size(self):
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self):
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for path, size, _ in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            logger.info(f"Evicted OCR cache entry {os.path.basename(path)}")
+
+    def read_counters(self, f):
+        try:
+            counters = json.loads(f.read() or '{}')
+        except ValueError:
+            counters = {}
+        return {'hits': int(counters.get('hits', 0)), 'misses': int(counters.get('misses', 0))}
+
+    def incr(self, counter):
+        os.makedirs(self.directory, exist_ok=True)
+        fd = os.open(self.stats_path, os.O_RDWR | os.O_CREAT, 0o644)
+        with os.fdopen(fd, 'r+') as f:
+            # Jobs in other processes update the same file
+            fcntl.flock(f, fcntl.LOCK_EX)
+            counters = self.read_counters(f)
+            counters[counter] += 1
+            f.seek(0)
+            f.truncate()
+            json.dump(counters, f)
+
+    def stats(self):
+        try:
+            with open(self.stats_path, 'r') as f:
+                fcntl.flock(f, fcntl.LOCK_SH)
+                counters = self.read_counters(f)
+        except FileNotFoundError:
+            counters = {'hits': 0, 'misses': 0}
+        return dict(counters, bytes=self.size())
+
+
+class RedisCacheBackend:
+    """
+    Stores cached values in Redis.
+
+    Access times are tracked in a sorted set and entry sizes in a hash, so the
+    least recently used entries can be dropped once the total size goes over
+    max_bytes. Hit/miss counters are shared by every worker using the cache.
+    """
+
+    def __init__(self, host, port, max_bytes, prefix='ocr-cache:'):
+        self.host = host
+        self.port = port
+        self.max_bytes = max_bytes
+        self.prefix = prefix
+        self._redis = None
+
+    def __getstate__(self):
+        # Connections can't be pickled; RQ pickles the processor holding us
+        state = self.__dict__.copy()
+        state['_redis'] = None
+        return state
+
+    @property
+    def redis(self):
+        if self._redis is None:
+            self._redis = redis.Redis(host=self.host, port=self.port)
+        return self._redis
+
+    def _key(self, name):
+        return self.prefix + name
+
+    def get(self, key):
+        value = self.redis.get(self._key(key))
+        if value is not None:
+            self.redis.zadd(self._key('lru'), {key: time.time()})
+        return value
+
+    def set(self, key, value):
+        pipe = self.redis.pipeline()
+        pipe.set(self._key(key), value)
+        pipe.zadd(self._key('lru'), {key: time.time()})
+        pipe.hset(self._key('sizes'), key, len(value))
+        pipe.execute()
+        self.evict()
+
+    def size(self):
+        return sum(int(size) for size in self.redis.hvals(self._key('sizes')))
+
+    def evict(self):
+        total = self.size()
+        while total > self.max_bytes:
+            oldest = self.redis.zrange(self._key('lru'), 0, 0)
+            if not oldest:
+                break
+            key = oldest[0].decode('utf-8')
+            size = int(self.redis.hget(self._key('sizes'), key) or 0)
+            pipe = self.redis.pipeline()
+            pipe.delete(self._key(key))
+            pipe.zrem(self._key('lru'), key)
+            pipe.hdel(self._key('sizes'), key)
+            pipe.execute()
+            total -= size
+            logger.info(f"Evicted OCR cache entry {key}")
+
+    def incr(self, counter):
+        self.redis.hincrby(self._key('stats'), counter, 1)
+
+    def stats(self):
+        counters = self.redis.hgetall(self._key('stats'))
+        return {
+            'hits': int(counters.get(b'hits', 0)),
+            'misses': int(counters.get(b'misses', 0)),
+            'bytes': self.size(),
+        }
+
+
+class OCRCache:
+    """
+    Content-addressed cache of OCR text.
+
+    Entries are keyed by a hash of the uploaded file's bytes together with the
+    OCR settings that produced the text, so a re-upload of the same receipt
+    skips Tesseract entirely while any change in settings misses. The per-page
+    metadata is stored with the text, so a hit restores it too.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def make_key(self, filepath, settings, data=None):
+        """
+        Build the cache key for a file
+
+        Args:
+            filepath: Path to the receipt file
+            settings: JSON-serializable OCR settings
+            data: Optional file contents, hashed instead of reading filepath
+
+        Returns:
+            Hex digest identifying the file contents and settings
+        """
+        digest = hashlib.sha256()
+        if data is not None:
+            digest.update(data)
+        else:
+            with open(filepath, 'rb') as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                    digest.update(chunk)
+        digest.update(json.dumps(settings, sort_keys=True).encode('utf-8'))
+        return digest.hexdigest()
+
+    def get(self, key):
+        entry = self.get_entry(key)
+        if entry is None:
+            return None
+        return entry[0]
+
+    def get_entry(self, key):
+        """
+        Get cached text together with the metadata saved with it
+
+        Args:
+            key: Key from make_key
+
+        Returns:
+            Tuple of text and metadata dictionary, or None on a miss
+        """
+        try:
+            value = self.backend.get(key)
+        except Exception as e:
+            logger.error(f"OCR cache read failed: {e}")
+            return None
+        entry = None
+        if value is not None:
+            try:
+                entry = json.loads(value.decode('utf-8'))
+            except ValueError:
+                pass
+            # Plain text entries from before metadata was cached are misses
+            if not isinstance(entry, dict) or 'text' not in entry:
+                entry = None
+        self.record('hits' if entry is not None else 'misses')
+        if entry is None:
+            return None
+        return entry['text'], entry.get('metadata') or {}
+
+    def set(self, key, text, metadata=None):
+        """
+        Cache text and the OCR metadata produced with it
+
+        Args:
+            key: Key from make_key
+            text: Extracted text
+            metadata: Optional JSON-serializable metadata, such as the page
+                details re-OCR needs
+        """
+        try:
+            value = json.dumps({'text': text, 'metadata': metadata or {}}, default=float)
+            self.backend.set(key, value.encode('utf-8'))
+        except Exception as e:
+            logger.error(f"OCR cache write failed: {e}")
+
+    def record(self, counter):
+        try:
+            self.backend.incr(counter)
+        except Exception as e:
+            logger.error(f"OCR cache counter update failed: {e}")
+
+    def stats(self):
+        return self.backend.stats()
+
+
+class ImageCache:
+    """
+    Local disk cache of preprocessed page images.
+
+    Each entry is a directory holding the grayscale and thresholded images as
+    .npy files, memory-mapped when read so a hit costs neither decoding nor
+    a copy, and the preprocessing metadata. Entries expire ttl seconds after
+    they were written; over max_bytes the least recently used go first.
+    """
+
+    def __init__(self, directory, max_bytes, ttl):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+
+    def _path(self, key):
+        return os.path.join(self.directory, key)
+
+    def get(self, key):
+        """
+        Look up a page's preprocessed images
+
+        Args:
+            key: Cache key
+
+        Returns:
+            Tuple of read-only grayscale image, binary image and metadata
+            dictionary, or None on a miss
+        """
+        path = self._path(key)
+        try:
+            if time.time() - os.stat(os.path.join(path, 'metadata.json')).st_mtime > self.ttl:
+                shutil.rmtree(path, ignore_errors=True)
+                return None
+            with open(os.path.join(path, 'metadata.json'), 'r') as f:
+                metadata = json.load(f)
+            gray = np.load(os.path.join(path, 'gray.npy'), mmap_mode='r')
+            binary = np.load(os.path.join(path, 'binary.npy'), mmap_mode='r')
+        except (OSError, ValueError) as e:
+            if not isinstance(e, FileNotFoundError):
+                logger.error(f"Image cache read failed: {e}")
+            return None
+        os.utime(path, None)
+        return gray, binary, metadata
+
+    def set(self, key, gray, binary, metadata):
+        """
+        Store a page's preprocessed images
+
+        Args:
+            key: Cache key
+            gray: Grayscale image
+            binary: Thresholded image
+            metadata: JSON-serializable preprocessing metadata
+        """
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            # Write to a temporary directory first so readers never see a partial entry
+            tmp_path = tempfile.mkdtemp(dir=self.directory, prefix='.tmp-')
+            np.save(os.path.join(tmp_path, 'gray.npy'), gray)
+            np.save(os.path.join(tmp_path, 'binary.npy'), binary)
+            with open(os.path.join(tmp_path, 'metadata.json'), 'w') as f:
+                json.dump(metadata, f, default=float)
+            try:
+                os.replace(tmp_path, self._path(key))
+            except OSError:
+                # Another worker stored the same page first
+                shutil.rmtree(tmp_path, ignore_errors=True)
+        except Exception as e:
+            logger.error(f"Image cache write failed: {e}")
+            return
+        self.evict()
+
+    def entries(self):
+        """
+        List cache entries, least recently used first
+
+        Returns:
+            List of (path, size, mtime, created) tuples
+        """
+        entries = []
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return entries
+        for name in names:
+            if name.startswith('.'):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                size = sum(entry.stat().st_size for entry in os.scandir(path))
+                created = os.stat(os.path.join(path, 'metadata.json')).st_mtime
+                entries.append((path, size, os.stat(path).st_mtime, created))
+            except OSError:
+                continue
+        entries.sort(key=lambda entry: entry[2])
+        return entries
+
+    def evict(self):
+        entries = self.entries()
+        total = sum(entry[1] for entry in entries)
+        now = time.time()
+        for path, size, _, created in entries:
+            if total <= self.max_bytes and now - created <= self.ttl:
+                continue
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+            logger.info(f"Evicted image cache entry {os.path.basename(path)}")
+
+
+def hash_file(filepath, data=None):
+    """
+    Hash a file's contents
+
+    Args:
+        filepath: Path to the file
+        data: Optional file contents, hashed instead of reading filepath
+
+    Returns:
+        Hex digest of the contents
+    """
+    digest = hashlib.sha256()
+    if data is not None:
+        digest.update(data)
+    else:
+        with open(filepath, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+def get_ocr_cache():
+    """
+    Build the OCR cache configured by the environment
+
+    OCR_CACHE_BACKEND selects 'disk' (default), 'redis' or 'none'.
+
+    Returns:
+        OCRCache instance, or None when caching is disabled
+    """
+    backend_name = os.environ.get('OCR_CACHE_BACKEND', 'disk').lower()
+    max_bytes = int(os.environ.get('OCR_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+
+    if backend_name == 'disk':
+        directory = os.environ.get('OCR_CACHE_DIR', '/uploads/.ocr_cache')
+        backend = DiskCacheBackend(directory, max_bytes)
+    elif backend_name == 'redis':
+        backend = RedisCacheBackend(
+            host=os.environ.get('REDIS_HOST', 'redis'),
+            port=int(os.environ.get('REDIS_PORT', 6379)),
+            max_bytes=max_bytes
+        )
+    else:
+        logger.info("OCR cache disabled")
+        return None
+
+    logger.info(f"OCR cache using {backend_name} backend")
+    return OCRCache(backend)
+
+
+def get_image_cache():
+    """
+    Build the preprocessed image cache configured by the environment
+
+    Returns:
+        ImageCache instance, or None when OCR_IMAGE_CACHE is disabled
+    """
+    if os.environ.get('OCR_IMAGE_CACHE', "True") != "True":
+        logger.info("Image cache disabled")
+        return None
+    return ImageCache(
+        directory=os.environ.get('OCR_IMAGE_CACHE_DIR', '/uploads/.image_cache'),
+        max_bytes=int(os.environ.get('OCR_IMAGE_CACHE_MAX_BYTES', 256 * 1024 * 1024)),
+        ttl=float(os.environ.get('OCR_IMAGE_CACHE_TTL', 24 * 60 * 60))
+    )
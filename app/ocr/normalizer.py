@@ -0,0 +1,144 @@
+import os
+import re
+import sys
+
+# Add parent directory to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.logger import get_logger
+
+# Initialize logger
+logger = get_logger('ocr_normalizer')
+
+
+# OCR fixes applied to every receipt line, in order, after stripping it.
+# A rule is one of:
+#   {"translate": {"€": "e"}}          single characters, replaced together
+#   {"replace": "old", "with": "new"}  a literal string
+#   {"pattern": r"...", "replacement": r"..."}
+#   {"group": [pattern rules]}         patterns tried in a single pass
+# Pattern rules and groups may set "contains" (the line must contain this
+# string) or "endswith" (the line must end in one of these characters), so
+# most lines skip the regex entirely. Patterns in a group must not be able
+# to match overlapping text.
+DEFAULT_LINE_RULES = [
+    {'translate': {'€': 'e', '«': '', '~': '-', '(': '', ')': '', '¥': 'Y'}},
+    {'replace': 'Wenber Savings', 'with': 'Member Savings'},
+    # A trailing S (for sale, Safeway and Albertsons) misread as §, 8 or $
+    {'group': [
+        {'pattern': r'\s[§8$]$', 'replacement': ' S'},
+        {'pattern': r'(\d\d)8$', 'replacement': r'\1 S'},
+    ], 'endswith': '§8$'},
+    # Commas instead of decimals in prices
+    {'pattern': r'(\d+)\,(\d{2})\s', 'replacement': r'\1.\2', 'contains': ','},
+    # Triple decimal points are usually numbers that were squished and need to be separated
+    {'pattern': r'(\d\.\d{2})(\d)', 'replacement': r'\1 \2', 'contains': '.'},
+    # The trailing S for sale misread as 5
+    {'pattern': r'\s5$', 'replacement': ' S', 'endswith': '5'},
+    {'pattern': r'\S{4}er S\Svings -', 'replacement': 'Member Savings -', 'contains': 'vings -'},
+    {'pattern': r'Coup\Sn', 'replacement': 'Coupon', 'contains': 'Coup'},
+    {'pattern': r'Stor\S', 'replacement': 'Store', 'contains': 'Stor'},
+]
+
+
+class LineNormalizer:
+    """
+    Applies a list of line rules with as little work per line as possible.
+
+    Neighbouring single-character replacements become one str.translate
+    table, each pattern is compiled once, grouped patterns share one regex
+    with the replacement picked by the alternative that matched, and rules
+    with a "contains" or "endswith" guard are skipped on lines that cannot
+    match.
+    """
+
+    def __init__(self, rules=None):
+        self.steps = []
+        for rule in DEFAULT_LINE_RULES if rules is None else rules:
+            try:
+                self.add_rule(rule)
+            except (KeyError, TypeError, ValueError, re.error) as e:
+                logger.error(f"Skipping invalid line rule {rule}: {e}")
+
+    def add_rule(self, rule):
+        """
+        Compile a rule and append it to the steps
+
+        Args:
+            rule: Rule dictionary, see DEFAULT_LINE_RULES
+        """
+        if 'translate' in rule:
+            table = str.maketrans(rule['translate'])
+            previous = self.steps[-1][1] if self.steps and self.steps[-1][0] == 'translate' else None
+            if previous is not None and self.can_merge(previous, table):
+                previous.update(table)
+            else:
+                self.steps.append(('translate', table))
+        elif 'replace' in rule:
+            self.steps.append(('replace', rule['replace'], rule['with']))
+        else:
+            alternatives = rule['group'] if 'group' in rule else [rule]
+            if not alternatives:
+                raise ValueError("empty group")
+            compiled = [(re.compile(alt['pattern']), alt['replacement']) for alt in alternatives]
+            contains = rule.get('contains')
+            endswith = tuple(rule['endswith']) if rule.get('endswith') else None
+            if len(compiled) == 1:
+                pattern, replacement = compiled[0]
+                self.steps.append(('sub', contains, endswith, pattern, replacement))
+            else:
+                combined = re.compile('|'.join(f'(?P<_{i}>{pattern.pattern})' for i, (pattern, _) in enumerate(compiled)))
+                self.steps.append(('sub', contains, endswith, combined, self.make_dispatch(compiled)))
+
+    def can_merge(self, first, second):
+        """
+        Check whether two translate tables applied one after the other give
+        the same result as one merged table
+
+        That holds when the tables share no characters and nothing the first
+        one outputs is replaced by the second.
+        """
+        outputs = set()
+        for value in first.values():
+            if isinstance(value, int):
+                outputs.add(value)
+            elif value:
+                outputs.update(map(ord, value))
+        return not (set(second) & (set(first) | outputs))
+
+    def make_dispatch(self, compiled):
+        """Build the replacement callback of a group of patterns"""
+        def dispatch(match):
+            # Re-match the winning alternative alone so its own group
+            # numbers apply to its replacement
+            pattern, replacement = compiled[int(match.lastgroup[1:])]
+            own = pattern.fullmatch(match.string, match.start(), match.end())
+            return own.expand(replacement)
+        return dispatch
+
+    def normalize(self, line):
+        """
+        Strip a line and apply every rule to it
+
+        Args:
+            line: Receipt line
+
+        Returns:
+            Normalized line
+        """
+        line = line.strip()
+        for step in self.steps:
+            kind = step[0]
+            if kind == 'translate':
+                line = line.translate(step[1])
+            elif kind == 'replace':
+                if step[1] in line:
+                    line = line.replace(step[1], step[2])
+            else:
+                _, contains, endswith, pattern, replacement = step
+                if contains is not None and contains not in line:
+                    continue
+                if endswith is not None and not line.endswith(endswith):
+                    continue
+                line = pattern.sub(replacement, line)
+        return line
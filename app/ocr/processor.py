@@ -7,25 +7,460 @@ import cv2
 import numpy as np
 import sys
 import json
+import hashlib
+import copy
+import io
+import queue
+import shlex
+import subprocess
+import threading
+import time
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import repeat
+from rq import Queue, get_current_job
+
+try:
+    import tesserocr
+except ImportError:
+    tesserocr = None
 
 # Add parent directory to path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from utils.logger import get_logger
+from ocr.cache import get_ocr_cache, get_image_cache, hash_file
+from ocr.registry import get_processor_registry
 
 # Initialize logger
 logger = get_logger('ocr_process')
+
+
+class PytesseractEngine:
+    """
+    OCR engine that runs the tesseract binary through pytesseract.
+
+    Every call starts a new tesseract process and loads the language model
+    again, but it needs nothing beyond the tesseract binary.
+    """
+    name = 'pytesseract'
+
+    def image_to_string(self, img, config):
+        return pytesseract.image_to_string(img, config=config)
+
+    def image_to_data(self, img, config):
+        return pytesseract.image_to_data(img, config=config, output_type=pytesseract.Output.DICT)
+
+    def image_to_osd(self, img):
+        osd = pytesseract.image_to_osd(img, output_type=pytesseract.Output.DICT)
+        return osd['rotate'], float(osd['orientation_conf'])
+
+
+class TesserocrEnginePool:
+    """
+    OCR engine that keeps warm tesseract instances in process.
+
+    Instances are created once per Tesseract config through the tesserocr
+    bindings and handed out to one caller at a time, so the language model is
+    loaded once per worker instead of once per page.
+    """
+    name = 'tesserocr'
+
+    def __init__(self, size=1, lang='eng'):
+        self.size = max(1, size)
+        self.lang = lang
+        self.pools = {}
+        self.lock = threading.Lock()
+        self.fallback = PytesseractEngine()
+
+    def parse_config(self, config):
+        """
+        Translate a pytesseract config string into tesserocr init arguments
+
+        Args:
+            config: Config string, e.g. '--psm 6 --user-words /config/ocr_dict.txt'
+
+        Returns:
+            Dictionary of keyword arguments for PyTessBaseAPI.InitFull, plus 'psm'
+        """
+        args = {'lang': self.lang, 'variables': {}}
+        tokens = shlex.split(config)
+        for i, token in enumerate(tokens[:-1]):
+            value = tokens[i + 1]
+            if token == '--psm':
+                args['psm'] = int(value)
+            elif token == '--oem':
+                args['oem'] = tesserocr.OEM(int(value))
+            elif token == '-l':
+                args['lang'] = value
+            elif token == '--tessdata-dir':
+                args['path'] = value
+            elif token == '--user-words':
+                args['variables']['user_words_file'] = value
+            elif token == '--user-patterns':
+                args['variables']['user_patterns_file'] = value
+            elif token == '-c' and '=' in value:
+                name, setting = value.split('=', 1)
+                args['variables'][name] = setting
+        return args
+
+    def create_api(self, config):
+        args = self.parse_config(config)
+        psm = args.pop('psm', None)
+        api = tesserocr.PyTessBaseAPI(init=False)
+        api.InitFull(**args)
+        if psm is not None:
+            api.SetPageSegMode(tesserocr.PSM(psm))
+        return api
+
+    def warm(self, config):
+        """
+        Create the pool of instances for a config, if it does not exist yet
+
+        A config whose instances fail to load is remembered, and served by
+        pytesseract from then on.
+
+        Args:
+            config: Tesseract config string
+
+        Returns:
+            Queue of idle instances for the config, or None if loading failed
+        """
+        with self.lock:
+            if config not in self.pools:
+                logger.info(f"Loading {self.size} tesseract instance(s) for config: {config}")
+                try:
+                    apis = queue.Queue()
+                    for _ in range(self.size):
+                        apis.put(self.create_api(config))
+                except Exception as e:
+                    logger.error(f"Failed to load tesseract instance, using pytesseract: {e}")
+                    apis = None
+                self.pools[config] = apis
+            return self.pools[config]
+
+    def image_to_string(self, img, config):
+        apis = self.warm(config)
+        if apis is None:
+            return self.fallback.image_to_string(img, config)
+        api = apis.get()
+        try:
+            api.SetImage(Image.fromarray(img))
+            return api.GetUTF8Text()
+        finally:
+            api.Clear()
+            apis.put(api)
+
+    def image_to_data(self, img, config):
+        """
+        Word-level OCR results, in the same layout as pytesseract's Output.DICT
+
+        Args:
+            img: OpenCV image
+            config: Tesseract config string
+
+        Returns:
+            Dictionary of column name to list of values, one per TSV row
+        """
+        apis = self.warm(config)
+        if apis is None:
+            return self.fallback.image_to_data(img, config)
+        api = apis.get()
+        try:
+            api.SetImage(Image.fromarray(img))
+            api.Recognize()
+            tsv = api.GetTSVText(0)
+        finally:
+            api.Clear()
+            apis.put(api)
+
+        columns = ['level', 'page_num', 'block_num', 'par_num', 'line_num', 'word_num',
+                   'left', 'top', 'width', 'height', 'conf', 'text']
+        data = {column: [] for column in columns}
+        for row in tsv.splitlines():
+            values = row.split('\t')
+            if len(values) < len(columns):
+                values.append('')
+            for column, value in zip(columns, values):
+                data[column].append(value if column == 'text' else float(value) if column == 'conf' else int(value))
+        return data
+
+    def image_to_osd(self, img):
+        """
+        Detect the page orientation with tesseract's OSD model
+
+        Args:
+            img: OpenCV image
+
+        Returns:
+            Tuple of the clockwise rotation that makes the text upright, in
+            degrees, and the orientation confidence
+        """
+        apis = self.warm('--psm 0')
+        if apis is None:
+            return self.fallback.image_to_osd(img)
+        api = apis.get()
+        try:
+            api.SetImage(Image.fromarray(img))
+            osd = api.DetectOrientationScript()
+        finally:
+            api.Clear()
+            apis.put(api)
+        if osd is None:
+            raise RuntimeError("Orientation detection failed")
+        # orient_deg is the counter-clockwise rotation of the text
+        return (360 - osd['orient_deg']) % 360, osd['orient_conf']
+
+
+_ocr_engine = None
+
+
+def get_ocr_engine():
+    """
+    Get the process-wide OCR engine
+
+    OCR_ENGINE selects 'tesserocr', 'pytesseract' or 'auto' (default), which
+    uses the warm tesserocr pool when the bindings are installed and falls
+    back to pytesseract otherwise.
+
+    Returns:
+        OCR engine instance
+    """
+    global _ocr_engine
+    if _ocr_engine is None:
+        engine_name = os.environ.get('OCR_ENGINE', 'auto').lower()
+        if engine_name in ('auto', 'tesserocr') and tesserocr is not None:
+            _ocr_engine = TesserocrEnginePool(
+                size=int(os.environ.get('OCR_ENGINE_POOL_SIZE', 1)),
+                lang=os.environ.get('OCR_LANGUAGE', 'eng')
+            )
+        else:
+            if engine_name == 'tesserocr':
+                logger.warning("tesserocr is not installed, falling back to pytesseract")
+            _ocr_engine = PytesseractEngine()
+        logger.info(f"Using OCR engine: {_ocr_engine.name}")
+    return _ocr_engine
+
+
+def init_ocr_engine(config=None):
+    """
+    Load the OCR engine ahead of the first job
+
+    Called once at worker start so the warm instances are shared by every job
+    the worker runs. RQ runs each job in a forked child, so instances a job
+    loads itself are thrown away with it; every config a job can use is
+    loaded here instead.
+
+    Args:
+        config: Tesseract config to warm, defaults to every config from
+            ReceiptProcessor.get_warm_configs
+
+    Returns:
+        OCR engine instance
+    """
+    engine = get_ocr_engine()
+    if isinstance(engine, TesserocrEnginePool):
+        for warm_config in [config] if config else ReceiptProcessor().get_warm_configs():
+            engine.warm(warm_config)
+    return engine
+
+
+# Preprocessing stages by name: the ReceiptProcessor method implementing the
+# stage, and whether its output is binarized. Stages before the first
+# binarizing stage produce the grayscale image low-confidence lines are
+# re-OCR'd from.
+PREPROCESSING_STAGES = {
+    'grayscale': ('to_grayscale', False),
+    'crop': ('crop_to_receipt', False),
+    'orient': ('orient_image', False),
+    'deskew': ('deskew_image', False),
+    'normalize': ('normalize_resolution', False),
+    'median_blur': ('median_blur', False),
+    'threshold': ('binarize', True),
+    'adaptive_threshold': ('adaptive_binarize', True),
+    'open': ('morphology_open', True),
+}
+
+
+# Speed profiles. Each may set the Tesseract engine mode (oem), the model
+# variant ('fast' or 'best' tessdata, found through OCR_TESSDATA_FAST_DIR or
+# OCR_TESSDATA_BEST_DIR), the page segmentation mode (psm), the PDF DPI, the
+# preprocessing stages and the re-OCR confidence; anything left out keeps the
+# processor's own setting.
+OCR_PROFILES = {
+    'fast': {
+        'oem': 1,
+        'model': 'fast',
+        'dpi': 150,
+        'preprocessing': ['grayscale', 'normalize', 'threshold'],
+        'reocr_confidence': 0,
+    },
+    'balanced': {},
+    'accurate': {
+        'oem': 1,
+        'model': 'best',
+        'dpi': 300,
+        'reocr_confidence': 75,
+    },
+}
+
+
+# Adaptive OCR passes, cheapest first. Each pass starts from the receipt's
+# own profile and may change the page segmentation mode (psm), replace the
+# thresholding stage, or switch to another speed profile.
+OCR_LADDER = [
+    {},
+    {'psm': 4},
+    {'threshold': 'adaptive_threshold'},
+    {'profile': 'accurate'},
+]
+
+# Grayscale decode flags for JPEGs decoded at 1/2, 1/4 and 1/8 size
+REDUCED_GRAYSCALE_FLAGS = {
+    2: cv2.IMREAD_REDUCED_GRAYSCALE_2,
+    4: cv2.IMREAD_REDUCED_GRAYSCALE_4,
+    8: cv2.IMREAD_REDUCED_GRAYSCALE_8,
+}
+
+# cv2.rotate codes by the clockwise rotation that makes the text upright
+ORIENTATION_ROTATIONS = {
+    90: cv2.ROTATE_90_CLOCKWISE,
+    180: cv2.ROTATE_180,
+    270: cv2.ROTATE_90_COUNTERCLOCKWISE,
+}
+
+# Receipt total lines, e.g. "SUBTOTAL 21.50", "**** BALANCE $23.45"
+TOTAL_PATTERN = re.compile(
+    r'^\W*(?:SUB\s*TOTAL|TOTAL|BALANCE(?:\s+DUE)?)\W*\$?\s*(?P<amount>\d+[.,]\d{2})\b',
+    re.IGNORECASE
+)
+
+
 class ReceiptProcessor:
     
-    def __init__(self):
+    def __init__(self, page_workers=None, dpi=None, page_window=None, ocr_cache=False, auto_crop=None, orientation=None, deskew=None, text_height=None, ocr_mode=None, line_workers=None, reocr_confidence=None, preprocessing=None, text_layer=None, profile=None, adaptive=None, tile_height=None, tile_overlap=None, split_receipts=None, image_cache=False):
         """
         Initialize the ReceiptProcessor class.
+
+        Args:
+            page_workers: Number of processes used to OCR the pages of a PDF
+                concurrently. Defaults to the OCR_PAGE_WORKERS environment
+                variable; 1 keeps the serial path.
+            dpi: Resolution PDF pages are rasterized at. Defaults to OCR_DPI.
+            page_window: Number of PDF pages rasterized at a time. Defaults
+                to OCR_PDF_PAGE_WINDOW.
+            ocr_cache: OCRCache for extracted text, None to disable caching.
+                Defaults to the cache configured by OCR_CACHE_BACKEND.
+            auto_crop: Crop photos to the receipt paper before OCR. Defaults
+                to OCR_AUTO_CROP.
+            orientation: Turn sideways and upside-down receipts upright
+                before OCR, at the cost of an orientation detection pass
+                per page. Defaults to OCR_ORIENTATION, off.
+            deskew: Straighten rotated receipts before OCR. Defaults to
+                OCR_DESKEW.
+            text_height: Glyph height in pixels images are resampled to
+                before OCR, 0 to keep the native size. Defaults to
+                OCR_TEXT_HEIGHT.
+            ocr_mode: 'page' to OCR each page as one block, or 'lines' to
+                split it into line strips OCR'd in parallel. Defaults to
+                OCR_MODE.
+            line_workers: Number of threads OCRing line strips. Defaults to
+                OCR_LINE_WORKERS, or the CPU count.
+            reocr_confidence: Lines OCR'd with a lower mean word confidence
+                are re-OCR'd with alternative preprocessing, 0 to disable.
+                Defaults to OCR_REOCR_CONFIDENCE.
+            preprocessing: Default list of preprocessing stages, see
+                PREPROCESSING_STAGES. Defaults to OCR_PREPROCESSING, or a
+                pipeline built from auto_crop, deskew and text_height.
+            text_layer: Use the embedded text of digital PDFs instead of
+                OCR, for pages that have any. Defaults to OCR_PDF_TEXT_LAYER.
+            profile: Default speed profile, see OCR_PROFILES. Defaults to
+                OCR_PROFILE, or 'balanced'.
+            adaptive: Retry OCR with the passes in OCR_LADDER until the
+                parsed products add up to the receipt total. Defaults to
+                OCR_ADAPTIVE.
+            tile_height: Preprocessed pages taller than this many pixels are
+                OCR'd as overlapping horizontal tiles in parallel, 0 to
+                disable. Defaults to OCR_TILE_HEIGHT.
+            tile_overlap: Rows shared by neighbouring tiles; must exceed the
+                height of a text line. Defaults to OCR_TILE_OVERLAP.
+            split_receipts: Split scans holding several receipts into one
+                receipt per paper region. Defaults to OCR_SPLIT_RECEIPTS.
+            image_cache: ImageCache for preprocessed pages, None to disable.
+                Defaults to the cache configured by OCR_IMAGE_CACHE.
         """
         self.logger = get_logger('ocr_process')
         self.logger.info("ReceiptProcessor initialized")
         self.store = None
         self.products = []
+        if page_workers is None:
+            page_workers = int(os.environ.get('OCR_PAGE_WORKERS', 1))
+        self.page_workers = max(1, page_workers)
+        if dpi is None:
+            dpi = int(os.environ.get('OCR_DPI', 200))
+        self.dpi = dpi
+        if page_window is None:
+            page_window = int(os.environ.get('OCR_PDF_PAGE_WINDOW', 1))
+        self.page_window = max(1, page_window)
+        if ocr_cache is False:
+            ocr_cache = get_ocr_cache()
+        self.ocr_cache = ocr_cache
+        if auto_crop is None:
+            auto_crop = os.environ.get('OCR_AUTO_CROP', "True") == "True"
+        self.auto_crop = auto_crop
+        if orientation is None:
+            orientation = os.environ.get('OCR_ORIENTATION', "False") == "True"
+        self.orientation = orientation
+        if deskew is None:
+            deskew = os.environ.get('OCR_DESKEW', "True") == "True"
+        self.deskew = deskew
+        self.deskew_budget_ms = float(os.environ.get('OCR_DESKEW_BUDGET_MS', 20))
+        if text_height is None:
+            text_height = int(os.environ.get('OCR_TEXT_HEIGHT', 30))
+        self.text_height = text_height
+        if ocr_mode is None:
+            ocr_mode = os.environ.get('OCR_MODE', 'page')
+        self.ocr_mode = ocr_mode
+        if line_workers is None:
+            line_workers = int(os.environ.get('OCR_LINE_WORKERS', os.cpu_count() or 1))
+        self.line_workers = max(1, line_workers)
+        if reocr_confidence is None:
+            reocr_confidence = float(os.environ.get('OCR_REOCR_CONFIDENCE', 60))
+        self.reocr_confidence = reocr_confidence
+        if preprocessing is None:
+            preprocessing = self.get_default_preprocessing()
+        self.default_preprocessing = preprocessing
+        self.preprocessing = preprocessing
+        if text_layer is None:
+            text_layer = os.environ.get('OCR_PDF_TEXT_LAYER', "True") == "True"
+        self.text_layer = text_layer
+        self.default_dpi = self.dpi
+        self.default_reocr_confidence = self.reocr_confidence
+        if profile is None:
+            profile = os.environ.get('OCR_PROFILE', 'balanced')
+        self.default_profile = profile
+        self.use_profile(profile)
+        if adaptive is None:
+            adaptive = os.environ.get('OCR_ADAPTIVE', "False") == "True"
+        self.adaptive = adaptive
+        if tile_height is None:
+            tile_height = int(os.environ.get('OCR_TILE_HEIGHT', 4000))
+        self.tile_height = tile_height
+        if tile_overlap is None:
+            tile_overlap = int(os.environ.get('OCR_TILE_OVERLAP', 200))
+        if self.tile_height and tile_overlap >= self.tile_height:
+            # Tiles would advance a single row at a time
+            self.logger.warning(f"OCR tile overlap {tile_overlap} must be below the tile height {self.tile_height}, using {self.tile_height // 2}")
+            tile_overlap = self.tile_height // 2
+        self.tile_overlap = max(0, tile_overlap)
+        if split_receipts is None:
+            split_receipts = os.environ.get('OCR_SPLIT_RECEIPTS', "False") == "True"
+        self.split_receipts = split_receipts
+        if image_cache is False:
+            image_cache = get_image_cache()
+        self.image_cache = image_cache
+        self.source_hash = None
+        self.ocr_metadata = {}
 
     def get_store(self):
         return self.store
@@ -33,42 +468,52 @@ class ReceiptProcessor:
     def detect_store(self, text, receipt_processors):
         """
         Detect the store from receipt text
+
+        Every store's search string (or name) is looked for at once, in the
+        receipt header first. When several stores match, the one named
+        earliest on the receipt wins.
         
         Args:
             text: Receipt text
+            receipt_processors: List of store configurations
             
         Returns:
-            Store configuration
+            Store configuration, or None when no store matches
+        """
+        candidates = self.find_store_candidates(text, receipt_processors)
+        if not candidates:
+            return None
+        if len(candidates) > 1:
+            logger.info(
+                "Store candidates: " + ", ".join(
+                    f"{candidate['store'].get('name')} ({candidate['score']})" for candidate in candidates
+                )
+            )
+        self.store = candidates[0]['store']
+        return self.store
+
+    def find_store_candidates(self, text, receipt_processors):
+        """
+        Score every store whose search string occurs in the receipt
+
+        Args:
+            text: Receipt text
+            receipt_processors: List of store configurations
+
+        Returns:
+            List of candidate dictionaries with 'store', 'position' and
+            'score', best first
         """
-        for store in receipt_processors:
-            search_text = store.get('search_string',None)
-            if search_text is None:
-                search_text = store.get('name', "")
-            store_matches = self.search_text_for_string(text, search_text)
-            if store_matches:
-                self.store = store
-                return store        
+        return get_processor_registry().store_matcher(receipt_processors).candidates(text)
 
     def search_text_for_string(self, text, search_string):
         return search_string.lower() in text.lower()
 
     def get_custom_receipt_processors(self):
-        receipt_processors = []
-        try:
-            with open('/config/receipt_processors.json', 'r') as f:
-                receipt_processors = json.load(f)
-        except FileNotFoundError:
-            logger.info(f"No custom receipt processors loaded.")
-        return receipt_processors
+        return get_processor_registry().custom_processors()
 
     def get_default_receipt_processors(self):
-        receipt_processors = []
-        try:
-            with open('/config/receipt_processors_default.json', 'r') as f:
-                receipt_processors = json.load(f)
-        except FileNotFoundError:
-            logger.info(f"No custom receipt processors loaded.")
-        return receipt_processors
+        return get_processor_registry().default_processors()
 
     def parse_receipt(self, text):
         """
@@ -104,156 +549,158 @@ class ReceiptProcessor:
         return products
 
     def cycle_processors_get_products(self, text, store):
-        for processor in store.get('processors',[]):
-            compiled_pattern = re.compile(processor)
-            categories = self.get_category_mappings_for_store(store)
-            if len(categories) > 0:
-                products = self.generic_category_receipt(text, compiled_pattern, categories)
-            else:
-                products = self.generic_no_category_receipt(text, compiled_pattern)
-            if len(products) > 0:
-                break
-        return products
+        """
+        Parse a receipt with the best of a store's processors
+
+        Every processor is tried on each line in a single pass, then the one
+        whose products add up to the receipt total wins, otherwise the one
+        that found the most products, the first listed on a tie.
+
+        Args:
+            text: Receipt text
+            store: Store configuration
+
+        Returns:
+            List of dictionaries containing product information
+        """
+        processors = store.get('processors',[])
+        if not processors:
+            return []
+        registry = get_processor_registry()
+        categories = self.get_category_mappings_for_store(store)
+        patterns = [registry.compile(processor) for processor in processors]
+        results = self.match_products(text, patterns, categories)
+        if len(results) == 1:
+            return results[0]
+
+        totals = self.find_receipt_totals(text)
+        scores = [
+            (self.products_reconcile(products, text, totals=totals), len(products), -number)
+            for number, products in enumerate(results)
+        ]
+        best = max(range(len(results)), key=lambda number: scores[number])
+        logger.info(
+            f"Processor scores for {store.get('name')} (reconciled, products): "
+            f"{[score[:2] for score in scores]}, using processor {best}"
+        )
+        return results[best]
 
     def get_category_mappings_for_store(self, store):
-        with open('/config/category_mappings.json', 'r') as f:
-            category_mappings = json.load(f)
-        return category_mappings.get(store.get('name'), {})
+        return get_processor_registry().category_mappings(store.get('name'))
 
-    def generic_category_receipt(self, text, pattern, categories):
+    def match_products(self, text, patterns, categories=None):
         """
-        Parse generic receipt format
-        
+        Parse receipt lines with several product patterns in one pass
+
+        Each line is cleaned once and tried against every pattern. With
+        category mappings, lines naming a category are category headers for
+        the products below them, and are not matched against the patterns;
+        without, lines of three characters or less are skipped.
+
         Args:
             text: Receipt text
-            
+            patterns: List of compiled product patterns
+            categories: Optional mapping of category header to category
+
         Returns:
-            List of dictionaries containing product information
+            List with the products each pattern found, in pattern order
         """
-        products = []
-        
-        text = self.remove_header_footer(text, False, False)
+        if categories:
+            text = self.remove_header_footer(text, False, False)
         # Split text into lines
         lines = text.split('\n')
-        logger.info(f"Processing {len(lines)} lines")
+        logger.info(f"Processing {len(lines)} lines with {len(patterns)} processors")
+        if categories:
+            logger.info(f"Categories: {categories}")
 
-        current_category = ""
+        registry = get_processor_registry()
+        normalizer = registry.normalizer()
+        category_index = registry.category_index(categories) if categories else None
+        current_category = "" if categories else None
+        results = [[] for _ in patterns]
 
-        logger.info(f"Categories: {categories}")
-        
         for i, line in enumerate(lines):
             # Look for lines with price patterns
-            line = self.clean_line(line)
+            line = self.clean_line(line, normalizer)
 
             logger.info(f"Line {i}: {line}")
 
             if len(line) > 3:
-                category_set = False
-                if categories.get(line) is not None:
-                    current_category = categories.get(line)
-                    logger.info(f"Found category: {current_category}")
-                    category_set = True
-                else:
-                    for key, value in categories.items():
-                        # logger.info(f"Checking category: {key} {value} {line}")
-                        if line.startswith(key) == True:
-                            current_category = value
-                            logger.info(f"Found category: {current_category}")
-                            category_set = True
-                            break
-                if(category_set == True):
-                    continue
+                if category_index is not None:
+                    category_set, category = category_index.match(line)
+                    if(category_set == True):
+                        current_category = category
+                        logger.info(f"Found category: {current_category}")
+                        continue
+            elif category_index is None:
+                continue
 
-            product_match = re.search(pattern, line)
-            if product_match:
-                groupdict = product_match.groupdict()
-                # Extract price
-                price_str = groupdict.get('price','')
-                try:
-                    price = float(price_str)
-                except ValueError:
-                    logger.info(f"Invalid price: {price_str}")
-                    continue
-                
-                # Extract product name (text before the price)
-                product_name = groupdict.get('title','')
-                
-                # Skip if product name is too short or empty
-                if len(product_name) < 3:
-                    continue
-                
-                # Look for barcode in adjacent lines
-                barcode = groupdict.get('barcode','') or product_name
-                
-                logger.info({
-                    'name': product_name,
-                    'price': price,
-                    'barcode': barcode,
-                    'category': current_category,
-                    'store': 'Safeway',
-                })
+            for pattern, products in zip(patterns, results):
+                product = self.match_product(line, pattern, current_category)
+                if product is not None:
+                    products.append(product)
 
-                products.append({
-                    'name': product_name,
-                    'price': price,
-                    'barcode': barcode,
-                    'category': current_category,
-                    'store': 'Safeway',
-                })
-        
-        return products
+        return results
 
-    def generic_no_category_receipt(self, text, regexp):
-        products = []
-        lines = text.split('\n')
-        logger.info(f"Processing {len(lines)} lines")
-        for i, line in enumerate(lines):
-            # Look for lines with price patterns
-            line = self.clean_line(line)
+    def match_product(self, line, pattern, category=None):
+        """
+        Build a product from a receipt line matching a product pattern
 
-            logger.info(f"Line {i}: {line}")
+        Args:
+            line: Cleaned receipt line
+            pattern: Product pattern with 'title' and 'price' groups, and
+                optionally 'barcode'
+            category: Category of the receipt section the line is in
 
-            if len(line) > 3:
-                    
-                product_match = re.search(regexp, line)
-
-                if product_match:
-                    groupdict = product_match.groupdict()
-                    # Extract price
-                    price_str = groupdict.get('price','')
-                    try:
-                        price = float(price_str)
-                    except ValueError:
-                        logger.info(f"Invalid price: {price_str}")
-                        continue
-                    
-                    # Extract product name (text before the price)
-                    product_name = groupdict.get('title','')
-                    
-                    # Skip if product name is too short or empty
-                    if len(product_name) < 3:
-                        continue
-                    
-                    # Look for barcode in adjacent lines
-                    barcode = groupdict.get('barcode','') or product_name
-                    
-                    logger.info({
-                        'name': product_name,
-                        'price': price,
-                        'barcode': barcode,
-                        'category': None,
-                        'store': 'Safeway',
-                    })
-
-                    products.append({
-                        'name': product_name,
-                        'price': price,
-                        'barcode': barcode,
-                        'category': None,
-                        'store': 'Safeway',
-                    })
+        Returns:
+            Product dictionary, or None when the line is not a product
+        """
+        product_match = re.search(pattern, line)
+        if not product_match:
+            return None
+        groupdict = product_match.groupdict()
+        # Extract price
+        price_str = groupdict.get('price','')
+        try:
+            price = float(price_str)
+        except ValueError:
+            logger.info(f"Invalid price: {price_str}")
+            return None
         
-        return products
+        # Extract product name (text before the price)
+        product_name = groupdict.get('title','')
+        
+        # Skip if product name is too short or empty
+        if len(product_name) < 3:
+            return None
+        
+        # Look for barcode in adjacent lines
+        barcode = groupdict.get('barcode','') or product_name
+        
+        product = {
+            'name': product_name,
+            'price': price,
+            'barcode': barcode,
+            'category': category,
+            'store': 'Safeway',
+        }
+        logger.info(product)
+        return product
+
+    def generic_category_receipt(self, text, pattern, categories):
+        """
+        Parse generic receipt format
+        
+        Args:
+            text: Receipt text
+            
+        Returns:
+            List of dictionaries containing product information
+        """
+        return self.match_products(text, [pattern], categories)[0]
+
+    def generic_no_category_receipt(self, text, regexp):
+        return self.match_products(text, [regexp])[0]
 
     def parse_generic_receipt(self, text):
         """
@@ -342,30 +789,24 @@ class ReceiptProcessor:
 
         return result
 
-    def clean_line(self, line):
-        original_line = line
-        line = line.strip()
-        line = line.replace("€", "e")
-        line = line.replace("«", "")
-        line = line.replace("~", "-")
-        line = line.replace("(", "")
-        line = line.replace(")", "")
-        line = line.replace("¥", "Y")
-        line = line.replace("Wenber Savings", "Member Savings")
-        line = re.sub(r'\s§$', ' S', line)
-        line = re.sub(r'\s8$', ' S', line)
-        line = re.sub(r'\s\$$', r' S', line)
-        line = re.sub(r'(\d\d)8$', r'\1 S', line)
-        line = re.sub(r'(\d+)\,(\d{2})\s', r'\1.\2', line) # commas instead of decimals in prices
-        line = re.sub(r'(\d\.\d{2})(\d)', r'\1 \2', line) # triple decimal points are usually numbers that were squished and need to be separated
-        line = re.sub(r'\s5$', ' S', line) # the 5 at the end of the line is an S for sale (Safeway, Albertsons)
-        line = re.sub(r'\S{4}er S\Svings -', 'Member Savings -', line) # the 5 at the end of the line is an S for sale (Safeway, Albertsons)
-        line = re.sub(r'Coup\Sn', 'Coupon', line) # the 5 at the end of the line is an S for sale (Safeway, Albertsons)
-        line = re.sub(r'Stor\S', 'Store', line) # the 5 at the end of the line is an S for sale (Safeway, Albertsons)
-
-        if line != original_line:
-            logger.info(f"Cleaned line: {original_line} : {line}")
-        return line
+    def clean_line(self, line, normalizer=None):
+        """
+        Fix common OCR misreads in a receipt line
+
+        Args:
+            line: Receipt line
+            normalizer: Optional LineNormalizer, saves looking it up when
+                cleaning many lines
+
+        Returns:
+            Cleaned line
+        """
+        if normalizer is None:
+            normalizer = get_processor_registry().normalizer()
+        cleaned = normalizer.normalize(line)
+        if cleaned != line:
+            logger.debug(f"Cleaned line: {line} : {cleaned}")
+        return cleaned
 
     def pre_filter_text(self, text):
         """
@@ -373,46 +814,157 @@ class ReceiptProcessor:
         """
         logger.info("Pre-filtering text")
         logger.info(text)
-        lines = text.split('\n')
-        filtered_lines = []
-        for line in lines:
-            line = self.clean_line(line)
-            filtered_lines.append(line)
-        return '\n'.join(filtered_lines)
+        normalizer = get_processor_registry().normalizer()
+        return '\n'.join(self.clean_line(line, normalizer) for line in text.split('\n'))
     
             
-    def process_receipt(self, filepath, output_txt_path=None):
+    def process_receipt(self, filepath, output_txt_path=None, store=None, data=None, profile=None, split=None):
         """
         Process a receipt image or PDF and save OCR text to a file.
 
         Args:
             filepath: Path to the receipt file.
             output_txt_path: Optional path to save OCR text.
+            store: Optional store name, selecting the store's speed profile
+                and preprocessing pipeline from receipt_processors.json.
+            data: Optional contents of the receipt file, already in memory.
+                The file at filepath is then never read, so it may still be
+                being written.
+            profile: Optional speed profile, overriding the store's and the
+                default profile.
+            split: Look for several receipts on the scan and process each
+                one on its own. Defaults to self.split_receipts.
 
         Returns:
-            Path to saved OCR text file.
+            Path to saved OCR text file, or for a scan holding several
+            receipts the list from process_receipt_regions.
         """
         logger.info(f"Processing receipt image: {filepath}")
 
-        if not os.path.exists(filepath):
+        if data is None and not os.path.exists(filepath):
             logger.error(f"File not found: {filepath}")
             return None
 
+        if split is None:
+            split = self.split_receipts
+        if split:
+            regions = self.split_receipt_regions(filepath, data)
+            if regions:
+                return self.process_receipt_regions(regions, store, profile)
+
         if output_txt_path is None:
             output_txt_path = os.path.splitext(filepath)[0] + ".txt"
         logger.info(f"OCR text will be saved to: {output_txt_path}")
         # try:
         logger.info("Extracting text from receipt")
-        text = self.extract_text(filepath)
+        store_entry = self.get_store_entry(store)
+        profile = profile or store_entry.get('profile') or self.default_profile
+        store_preprocessing = store_entry.get('preprocessing')
+        self.use_profile(profile)
+        if store_preprocessing:
+            self.preprocessing = store_preprocessing
+        self.ocr_metadata = {'profile': self.profile, 'preprocessing': self.preprocessing, 'psm': self.psm}
+        if self.adaptive:
+            text = self.extract_text_adaptive(filepath, data, profile, store_preprocessing)
+        else:
+            text = self.extract_text_cached(filepath, data)
         text = self.pre_filter_text(text)
         logger.info(f"Extracted text: {text}")
         Path(output_txt_path).write_text(text, encoding='utf-8')
         logger.info(f"OCR text saved to {output_txt_path}")
+        self.save_job_metadata(self.ocr_metadata)
         return output_txt_path
         # except Exception as e:
         #     logger.error(f"Failed to extract OCR text: {e}")
         #     return None
 
+    def split_receipt_regions(self, filepath, data=None):
+        """
+        Cut a scan holding several receipts into one image per receipt
+
+        Only images and single-page PDFs are split; each receipt is saved
+        next to the upload as <name>_receipt<n>.png.
+
+        Args:
+            filepath: Path to the receipt file
+            data: Optional file contents, read instead of filepath
+
+        Returns:
+            List of dictionaries with each receipt's 'filepath' and 'box' on
+            the scan, empty when the scan holds a single receipt
+        """
+        start = time.perf_counter()
+        if os.path.splitext(filepath)[1].lower() == '.pdf' and self.get_pdf_page_count(filepath, data) > 1:
+            return []
+        gray = self.get_page_loader(filepath, 1, data)({})
+        if gray is None:
+            return []
+        boxes = self.find_receipt_regions(gray)
+        if len(boxes) < 2:
+            return []
+
+        base = os.path.splitext(filepath)[0]
+        regions = []
+        for number, (x, y, w, h) in enumerate(boxes, start=1):
+            region_path = f"{base}_receipt{number}.png"
+            cv2.imwrite(region_path, gray[y:y + h, x:x + w])
+            regions.append({'filepath': region_path, 'box': [x, y, w, h]})
+        logger.info(f"Split {filepath} into {len(regions)} receipts in {(time.perf_counter() - start) * 1000:.1f} ms")
+        return regions
+
+    def process_receipt_regions(self, regions, store=None, profile=None):
+        """
+        Process the receipts cut from one scan concurrently
+
+        Inside an RQ job each receipt is queued as its own job, so workers
+        pick them up in parallel and each gets its own OCR, review and
+        purchase pages; the job ids are saved in the parent job's metadata
+        as 'receipts'. Otherwise the receipts are OCR'd on threads and
+        parsed, each with its own store detection.
+
+        Args:
+            regions: Receipts from split_receipt_regions
+            store: Optional store name, passed on to every receipt
+            profile: Optional speed profile, passed on to every receipt
+
+        Returns:
+            The regions, with each receipt's 'job_id', or its 'txt_path',
+            detected 'store' and 'products'
+        """
+        job = get_current_job()
+        if job is not None:
+            job_queue = Queue(job.origin, connection=job.connection)
+            for region in regions:
+                sub_job = job_queue.enqueue(self.process_receipt, region['filepath'], store=store, profile=profile, split=False)
+                region['job_id'] = sub_job.id
+            self.save_job_metadata({'receipts': regions})
+            return regions
+
+        def process_region(region):
+            # Each receipt gets its own processor state
+            processor = copy.copy(self)
+            txt_path = processor.process_receipt(region['filepath'], store=store, profile=profile, split=False)
+            products = processor.extract_products_from_ocr_file(txt_path)
+            detected = processor.get_store()
+            return dict(region, txt_path=txt_path, store=detected.get('name') if detected else None, products=products)
+
+        with ThreadPoolExecutor(max_workers=len(regions)) as executor:
+            return list(executor.map(process_region, regions))
+
+    def save_job_metadata(self, metadata):
+        """
+        Attach OCR metadata to the RQ job running this receipt, if any
+
+        Args:
+            metadata: Dictionary merged into job.meta
+        """
+        logger.info(f"OCR metadata: {metadata}")
+        job = get_current_job()
+        if job is None:
+            return
+        job.meta.update(metadata)
+        job.save_meta()
+
     def extract_products_from_ocr_file(self, txt_path):
         """
         Parse saved OCR text and extract product information.
@@ -441,65 +993,1656 @@ class ReceiptProcessor:
         #     logger.error(f"Failed to parse products: {e}")
         #     return []    
 
-    def extract_text(self, filepath):
+    def get_tesseract_config(self):
+        custom_words_path = "/config/ocr_dict.txt"  # one word per line
+        config = f'--psm {self.psm} --user-words {custom_words_path}'
+        if self.oem is not None:
+            config = f'--oem {self.oem} {config}'
+        if self.tessdata_dir:
+            config += f' --tessdata-dir {self.tessdata_dir}'
+        return config
+
+    def get_warm_configs(self):
         """
-        Extract text from an image or PDF using OCR
-        
+        List the Tesseract configs a job can OCR with
+
+        Covers every speed profile's page config and its single-line config
+        (line mode and re-OCR), the adaptive passes' page segmentation modes
+        when adaptive OCR is on, and orientation detection when it is on.
+
+        Returns:
+            List of Tesseract config strings, without duplicates
+        """
+        psms = [step['psm'] for step in OCR_LADDER if 'psm' in step] if self.adaptive else []
+        configs = []
+        for name in OCR_PROFILES:
+            self.use_profile(name)
+            for psm in [self.psm] + psms:
+                self.psm = psm
+                config = self.get_tesseract_config()
+                configs += [config, self.get_line_config(config)]
+        self.use_profile(self.default_profile)
+        if self.orientation:
+            configs.append('--psm 0')
+        return list(dict.fromkeys(configs))
+
+    def use_profile(self, name):
+        """
+        Switch to a speed profile from OCR_PROFILES
+
+        Settings the profile leaves out go back to the processor's defaults,
+        so switching profiles between receipts does not leak settings.
+
+        Args:
+            name: Profile name; unknown names fall back to 'balanced'
+        """
+        if name not in OCR_PROFILES:
+            logger.warning(f"Unknown OCR profile {name}, using balanced")
+            name = 'balanced'
+        profile = OCR_PROFILES[name]
+        self.profile = name
+        self.oem = profile.get('oem')
+        self.psm = profile.get('psm', 6)
+        self.tessdata_dir = None
+        if profile.get('model'):
+            self.tessdata_dir = os.environ.get(f"OCR_TESSDATA_{profile['model'].upper()}_DIR")
+        self.dpi = profile.get('dpi', self.default_dpi)
+        self.preprocessing = profile.get('preprocessing', self.default_preprocessing)
+        self.reocr_confidence = profile.get('reocr_confidence', self.default_reocr_confidence)
+
+    def get_default_preprocessing(self):
+        """
+        Build the preprocessing pipeline used when a store does not set one
+
+        Returns:
+            List of stage names
+        """
+        stages = os.environ.get('OCR_PREPROCESSING')
+        if stages:
+            return [stage.strip() for stage in stages.split(',') if stage.strip()]
+
+        stages = ['grayscale']
+        if self.auto_crop:
+            stages.append('crop')
+        if self.orientation:
+            stages.append('orient')
+        if self.deskew:
+            stages.append('deskew')
+        if self.text_height:
+            stages.append('normalize')
+        stages.append('threshold')
+        return stages
+
+    def get_store_entry(self, store_name):
+        """
+        Find a store's entry in receipt_processors.json
+
+        Stores can set a "profile" and a "preprocessing" list there; custom
+        processors take precedence over the defaults.
+
+        Args:
+            store_name: Name of the store, or None
+
+        Returns:
+            Store dictionary, empty when the store is not found
+        """
+        if store_name:
+            for store in self.get_custom_receipt_processors() + self.get_default_receipt_processors():
+                if store.get('name') == store_name:
+                    return store
+        return {}
+
+    def get_ocr_settings(self):
+        """
+        Describe every setting that affects the extracted text
+
+        Used as part of the OCR cache key, so any change here invalidates
+        previously cached text.
+
+        Returns:
+            JSON-serializable dictionary of settings
+        """
+        settings = {
+            'profile': self.profile,
+            'tesseract_config': self.get_tesseract_config(),
+            'ocr_mode': self.ocr_mode,
+            'reocr_confidence': self.reocr_confidence,
+            'dpi': self.dpi,
+            'preprocessing': self.preprocessing,
+            'text_height': self.text_height,
+            'text_layer': self.text_layer,
+            'tile_height': self.tile_height,
+            'tile_overlap': self.tile_overlap,
+        }
+        # The user words file is referenced by path, so hash its contents too
+        try:
+            settings['user_words'] = hashlib.sha256(Path("/config/ocr_dict.txt").read_bytes()).hexdigest()
+        except FileNotFoundError:
+            settings['user_words'] = None
+        return settings
+
+    def extract_text_cached(self, filepath, data=None):
+        """
+        Extract text from an image or PDF, reusing cached OCR results
+
+        A cache hit also restores the metadata extract_text recorded, such as
+        the per-page line positions re-OCR needs.
+
         Args:
             filepath: Path to the image or PDF file
-            
+            data: Optional file contents, read instead of filepath
+
         Returns:
             Extracted text as string
         """
-        file_ext = os.path.splitext(filepath)[1].lower()
-        custom_words_path = "/config/ocr_dict.txt"  # one word per line
-        custom_config = f'--psm 6 --user-words {custom_words_path}'
-        
-        if file_ext == '.pdf':
-            # Convert PDF to images
-            images = pdf2image.convert_from_path(filepath)
-            text = ""
-            # Process each page
-            for img in images:
-                # Convert PIL image to OpenCV format
-                img_cv = cv2.cvtColor(np.array(img), cv2.COLOR_RGB2BGR)
-                
-                # Preprocess image
-                img_processed = self.preprocess_image(img_cv)
-                
-                # Extract text from processed image
-                page_text = pytesseract.image_to_string(img_processed, config=custom_config)
-                text += page_text + "\n\n"
-        else:
-            # Load image
-            img = cv2.imread(filepath)
-            
-            # Preprocess image
-            img_processed = self.preprocess_image(img)
-            
-            # Extract text
-            text = pytesseract.image_to_string(img_processed, config=custom_config)
-        
+        if self.ocr_cache is None:
+            return self.extract_text(filepath, data)
+
+        key = self.ocr_cache.make_key(filepath, self.get_ocr_settings(), data)
+        entry = self.ocr_cache.get_entry(key)
+        if entry is not None:
+            text, metadata = entry
+            self.ocr_metadata.update(metadata)
+            self.ocr_metadata['ocr_cache'] = 'hit'
+            logger.info(f"OCR cache hit for {filepath}: {self.ocr_cache.stats()}")
+            return text
+
+        self.ocr_metadata['ocr_cache'] = 'miss'
+        before = dict(self.ocr_metadata)
+        text = self.extract_text(filepath, data)
+        # Keep what extract_text recorded (pages, text source) with the text
+        metadata = {
+            name: value for name, value in self.ocr_metadata.items()
+            if name not in before or before[name] is not value
+        }
+        self.ocr_cache.set(key, text, metadata)
+        logger.info(f"OCR cache miss for {filepath}: {self.ocr_cache.stats()}")
         return text
 
-    def preprocess_image(self, img):
+    def extract_text_adaptive(self, filepath, data=None, profile=None, store_preprocessing=None):
         """
-        Preprocess image for better OCR results
-        
+        OCR with increasingly expensive passes until the receipt parses
+
+        Runs the passes in OCR_LADDER in order and stops at the first one
+        whose products add up to the receipt's total line. If none does, the
+        pass that found the most products wins, the cheapest on a tie. Each
+        pass goes through the OCR cache on its own settings.
+
         Args:
-            img: OpenCV image
-            
+            filepath: Path to the image or PDF file
+            data: Optional file contents, read instead of filepath
+            profile: Speed profile passes start from
+            store_preprocessing: Store preprocessing stages passes start from
+
         Returns:
-            Processed image
+            Extracted text of the chosen pass
+        """
+        base_metadata = self.ocr_metadata
+        passes = []
+        seen = set()
+        best = None
+        for number, step in enumerate(OCR_LADDER):
+            self.use_profile(step.get('profile', profile or self.default_profile))
+            if store_preprocessing and 'profile' not in step:
+                self.preprocessing = store_preprocessing
+            if 'psm' in step:
+                self.psm = step['psm']
+            if 'threshold' in step:
+                self.preprocessing = self.split_preprocessing(self.preprocessing)[0] + [step['threshold']]
+
+            # Profiles can make a later pass identical to an earlier one
+            settings = json.dumps(self.get_ocr_settings(), sort_keys=True)
+            if settings in seen:
+                continue
+            seen.add(settings)
+
+            start = time.perf_counter()
+            # Record the settings this pass ran with, so the winning pass's
+            # profile and pipeline are the ones saved with the job
+            self.ocr_metadata = dict(base_metadata, profile=self.profile, preprocessing=self.preprocessing, psm=self.psm)
+            text = self.extract_text_cached(filepath, data)
+            products = self.parse_receipt(self.pre_filter_text(text))
+            reconciled = self.products_reconcile(products, text)
+            passes.append({
+                'pass': number,
+                'settings': step,
+                'products': len(products),
+                'reconciled': reconciled,
+                'ms': round((time.perf_counter() - start) * 1000, 1),
+            })
+            logger.info(f"Adaptive OCR pass {number} {step}: {len(products)} products, reconciled: {reconciled}")
+
+            if reconciled or best is None or len(products) > best[1]:
+                best = (text, len(products), number, self.ocr_metadata)
+            if reconciled:
+                break
+
+        text, _, number, self.ocr_metadata = best
+        self.ocr_metadata['ocr_passes'] = passes
+        self.ocr_metadata['ocr_pass'] = number
+        return text
+
+    def find_receipt_totals(self, text):
+        """
+        Find the amounts on a receipt's subtotal, total and balance lines
+
+        Args:
+            text: Receipt text
+
+        Returns:
+            List of amounts, in the order they appear
+        """
+        totals = []
+        for line in text.split('\n'):
+            match = TOTAL_PATTERN.match(self.clean_line(line))
+            if match:
+                totals.append(float(match.group('amount').replace(',', '.')))
+        return totals
+
+    def products_reconcile(self, products, text, tolerance=0.01, totals=None):
+        """
+        Check whether parsed product prices add up to a total on the receipt
+
+        Args:
+            products: Products from parse_receipt
+            text: Receipt text the products were parsed from
+            tolerance: Allowed rounding difference
+            totals: Optional totals from find_receipt_totals, saves finding
+                them again when checking several product lists
+
+        Returns:
+            True if the product prices sum to any subtotal, total or balance
+        """
+        # Loose processor patterns also match the total lines themselves
+        products = [
+            product for product in products
+            if not TOTAL_PATTERN.match(f"{product.get('name', '')} {product['price']:.2f}")
+        ]
+        if not products:
+            return False
+        product_sum = sum(product['price'] for product in products)
+        if totals is None:
+            totals = self.find_receipt_totals(text)
+        return any(abs(product_sum - total) <= tolerance + 1e-9 for total in totals)
+
+    def extract_text(self, filepath, data=None):
+        """
+        Extract text from an image or PDF using OCR
+
+        Per-page preprocessing details are left in self.ocr_metadata['pages'].
+        
+        Args:
+            filepath: Path to the image or PDF file
+            data: Optional file contents, decoded from memory instead of
+                reading filepath; its extension still selects the format
+            
+        Returns:
+            Extracted text as string
         """
-        # Convert to grayscale
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        file_ext = os.path.splitext(filepath)[1].lower()
+        custom_config = self.get_tesseract_config()
+        pages = []
+        self.source_hash = hash_file(filepath, data) if self.image_cache is not None else None
         
-        # Apply thresholding
-        _, thresh = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+        if file_ext == '.pdf':
+            text = ""
+            text_pages = self.extract_pdf_text_layer(filepath, data) if self.text_layer else None
+            if text_pages is None:
+                # Rasterize and OCR the PDF a page at a time
+                for page_text, page_metadata in self.ocr_pdf_pages(filepath, custom_config, data):
+                    page_metadata['source'] = 'ocr'
+                    text += page_text + "\n\n"
+                    pages.append(page_metadata)
+            else:
+                # Only pages without embedded text are rasterized and OCR'd
+                missing = [number for number, page_text in enumerate(text_pages, start=1) if page_text is None]
+                ocr_results = self.ocr_pdf_pages(filepath, custom_config, data, missing) if missing else []
+                ocr_results = dict(zip(missing, ocr_results))
+                for number, page_text in enumerate(text_pages, start=1):
+                    if page_text is None:
+                        page_text, page_metadata = ocr_results[number]
+                        page_metadata['source'] = 'ocr'
+                    else:
+                        page_metadata = {'source': 'text_layer'}
+                    text += page_text + "\n\n"
+                    pages.append(page_metadata)
+
+            sources = {page['source'] for page in pages}
+            self.ocr_metadata['text_source'] = sources.pop() if len(sources) == 1 else 'mixed'
+            logger.info(f"Extracted PDF text from {self.ocr_metadata['text_source']}")
+        else:
+            # Load, preprocess and extract text, unless the preprocessed
+            # image is cached
+            text, page_metadata = self.ocr_cached_page(self.get_page_loader(filepath, 1, data), custom_config)
+            pages.append(page_metadata)
         
-        # Noise removal
-        kernel = np.ones((1, 1), np.uint8)
-        opening = cv2.morphologyEx(thresh, cv2.MORPH_OPEN, kernel)
+        self.ocr_metadata['pages'] = pages
+        return text
+
+    def extract_pdf_text_layer(self, filepath, data=None, min_chars=20):
+        """
+        Read the embedded text of a digital PDF with poppler's pdftotext
+
+        Layout is preserved, so product lines keep their columns the way OCR
+        of the rendered page would.
+
+        Args:
+            filepath: Path to the PDF file
+            data: Optional PDF contents, piped to pdftotext instead
+            min_chars: Pages with fewer non-blank characters count as having
+                no text layer, e.g. scans with only a page number
+
+        Returns:
+            List with each page's text, or None for pages that need OCR.
+            None when pdftotext is unavailable or fails.
+        """
+        start = time.perf_counter()
+        source = '-' if data is not None else filepath
+        try:
+            result = subprocess.run(
+                ['pdftotext', '-layout', '-enc', 'UTF-8', source, '-'],
+                input=data,
+                capture_output=True,
+                timeout=30,
+                check=True
+            )
+        except (OSError, subprocess.SubprocessError) as e:
+            logger.warning(f"Could not read PDF text layer, using OCR: {e}")
+            return None
+
+        # pdftotext ends every page with a form feed
+        text_pages = result.stdout.decode('utf-8', errors='replace').split('\f')
+        if text_pages and not text_pages[-1].strip():
+            text_pages.pop()
+        text_pages = [
+            page_text.strip('\n') if len(re.sub(r'\s', '', page_text)) >= min_chars else None
+            for page_text in text_pages
+        ]
+        self.ocr_metadata['text_layer_ms'] = round((time.perf_counter() - start) * 1000, 1)
+        return text_pages
+
+    def decode_image(self, filepath, data=None, flags=cv2.IMREAD_GRAYSCALE):
+        """Decode an image file, or its contents already in memory"""
+        if data is None:
+            return cv2.imread(filepath, flags)
+        return cv2.imdecode(np.frombuffer(data, dtype=np.uint8), flags)
+
+    def load_image(self, filepath, data=None, metadata=None):
+        """
+        Decode an image straight to grayscale, at reduced size when possible
+
+        Every preprocessing stage works on grayscale, so the color image is
+        never materialized. Large JPEGs whose text normalization would shrink
+        anyway are decoded at 1/2, 1/4 or 1/8 size by libjpeg, which skips
+        most of the decoding work and the full-size allocation.
+
+        Args:
+            filepath: Path to the image file
+            data: Optional file contents, decoded instead of reading filepath
+            metadata: Optional dictionary the decode scale and time are added to
+
+        Returns:
+            Grayscale OpenCV image
+        """
+        start = time.perf_counter()
+        img, factor = None, 1
+        if os.path.splitext(filepath)[1].lower() in ('.jpg', '.jpeg'):
+            img, factor = self.decode_reduced(filepath, data)
+        if img is None:
+            img, factor = self.decode_image(filepath, data), 1
+        if img is None:
+            raise ValueError(f"Could not decode image: {filepath}")
+        if metadata is not None:
+            metadata['decode_factor'] = factor
+            metadata['decode_ms'] = round((time.perf_counter() - start) * 1000, 1)
+        return img
+
+    def get_normalize_target(self):
+        """
+        Glyph height the preprocessing pipeline normalizes to
+
+        Returns:
+            Target height in pixels, or None when the pipeline does not
+            normalize
+        """
+        for stage in self.preprocessing:
+            if stage == 'normalize':
+                return self.text_height or None
+            if isinstance(stage, dict) and stage.get('name') == 'normalize':
+                return stage.get('text_height') or self.text_height or None
+        return None
+
+    def decode_reduced(self, filepath, data=None, probe_size=1000):
+        """
+        Decode a JPEG at the smallest size that still leaves its glyphs at
+        least as tall as the normalization target
+
+        The glyph height is estimated on a cheap reduced decode about
+        probe_size pixels across, which is reused when it is already the
+        right size.
+
+        Args:
+            filepath: Path to the JPEG file
+            data: Optional file contents, decoded instead of reading filepath
+            probe_size: Longest side of the image the text height is
+                estimated on
+
+        Returns:
+            Tuple of the grayscale image and its reduction factor, or
+            (None, 1) when the image should be decoded at full size
+        """
+        target_height = self.get_normalize_target()
+        if not target_height:
+            return None, 1
+        try:
+            # Only the header is read to get the size
+            with Image.open(io.BytesIO(data) if data is not None else filepath) as header:
+                longest = max(header.size)
+        except OSError:
+            return None, 1
+
+        probe_factor = next((f for f in (8, 4, 2) if longest / f >= probe_size), 1)
+        if probe_factor == 1:
+            return None, 1
+        probe = self.decode_image(filepath, data, REDUCED_GRAYSCALE_FLAGS[probe_factor])
+        glyph_height = self.estimate_text_height(probe) if probe is not None else None
+        if glyph_height is None:
+            return None, 1
+
+        glyph_height *= probe_factor
+        factor = next((f for f in (8, 4, 2) if glyph_height / f >= target_height), 1)
+        if factor == 1:
+            return None, 1
+        if factor == probe_factor:
+            return probe, factor
+        del probe
+        return self.decode_image(filepath, data, REDUCED_GRAYSCALE_FLAGS[factor]), factor
+
+    def get_pdf_page_count(self, filepath, data=None):
+        if data is not None:
+            return pdf2image.pdfinfo_from_bytes(data)['Pages']
+        return pdf2image.pdfinfo_from_path(filepath)['Pages']
+
+    def iter_pdf_pages(self, filepath, first_page=1, last_page=None, data=None):
+        """
+        Rasterize a PDF lazily, one window of pages at a time
+
+        Pages are rendered straight to grayscale at the configured DPI, and
+        each window is released once the caller moves past it, so memory use
+        does not grow with the number of pages.
+
+        Args:
+            filepath: Path to the PDF file
+            first_page: First page to rasterize (1-based)
+            last_page: Last page to rasterize, defaults to the last page
+            data: Optional PDF contents, rasterized instead of filepath
+
+        Yields:
+            Grayscale images, in page order
+        """
+        if last_page is None:
+            last_page = self.get_pdf_page_count(filepath, data)
+        for window_start in range(first_page, last_page + 1, self.page_window):
+            window_end = min(window_start + self.page_window - 1, last_page)
+            if data is not None:
+                images = pdf2image.convert_from_bytes(
+                    data,
+                    dpi=self.dpi,
+                    first_page=window_start,
+                    last_page=window_end,
+                    grayscale=True
+                )
+            else:
+                images = pdf2image.convert_from_path(
+                    filepath,
+                    dpi=self.dpi,
+                    first_page=window_start,
+                    last_page=window_end,
+                    grayscale=True
+                )
+            while images:
+                # Hand over the pixels so the PIL copy is freed before OCR
+                yield np.asarray(images.pop(0))
+
+    def ocr_pdf_pages(self, filepath, custom_config, data=None, page_numbers=None):
+        """
+        OCR every page of a PDF, in page order
+
+        Pages are handed to a process pool when more than one worker is
+        configured. Each worker rasterizes only the page it was given, and
+        results are collected in submission order so the joined text is
+        identical to the serial path.
+
+        Args:
+            filepath: Path to the PDF file
+            custom_config: Tesseract config string
+            data: Optional PDF contents, rasterized instead of filepath
+            page_numbers: Pages to OCR (1-based), defaults to every page
+
+        Returns:
+            Iterable of (page text, page metadata) tuples
+        """
+        if page_numbers is None:
+            page_numbers = range(1, self.get_pdf_page_count(filepath, data) + 1)
+
+        workers = min(self.page_workers, len(page_numbers))
+        if workers <= 1:
+            return self.ocr_pdf_pages_windowed(filepath, custom_config, data, list(page_numbers))
+
+        logger.info(f"OCR of {len(page_numbers)} pages using {workers} processes")
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(
+                self.ocr_pdf_page,
+                repeat(filepath),
+                page_numbers,
+                repeat(custom_config),
+                repeat(data)
+            ))
+
+    def ocr_pdf_pages_windowed(self, filepath, custom_config, data, page_numbers):
+        """
+        OCR PDF pages one after another, rasterizing them a window at a time
+
+        Pages found in the image cache are not rasterized. A page that is not
+        is rendered together with the consecutive pages after it, up to
+        page_window pages, and each image is released once it is OCR'd, so
+        at most one window of pages is held whether or not the image cache
+        is enabled.
+
+        Args:
+            filepath: Path to the PDF file
+            custom_config: Tesseract config string
+            data: Optional PDF contents, rasterized instead of filepath
+            page_numbers: List of pages to OCR (1-based), in order
+
+        Yields:
+            Tuples of page text and page metadata
+        """
+        rendered = {}
+
+        def render_window(index):
+            last = page_numbers[index]
+            for following in page_numbers[index + 1:index + self.page_window]:
+                if following != last + 1:
+                    break
+                last = following
+            # Drop leftovers of the previous window before rendering the next
+            rendered.clear()
+            rendered.update(zip(range(page_numbers[index], last + 1), self.iter_pdf_pages(filepath, page_numbers[index], last, data)))
+
+        for index, number in enumerate(page_numbers):
+            def load(metadata, index=index, number=number):
+                if number not in rendered:
+                    render_window(index)
+                return rendered.pop(number, None)
+            yield self.ocr_cached_page(load, custom_config, number)
+        rendered.clear()
+
+    def ocr_pdf_page(self, filepath, page_number, custom_config, data=None):
+        """
+        Rasterize and OCR a single PDF page
+
+        Args:
+            filepath: Path to the PDF file
+            page_number: Page to OCR (1-based)
+            custom_config: Tesseract config string
+            data: Optional PDF contents, rasterized instead of filepath
+
+        Returns:
+            Tuple of page text and page metadata
+        """
+        return self.ocr_cached_page(self.get_page_loader(filepath, page_number, data), custom_config, page_number)
+
+    def get_page_loader(self, filepath, page_number=1, data=None):
+        """
+        Build a callable that decodes or rasterizes one page of a receipt
+
+        Args:
+            filepath: Path to the image or PDF file
+            page_number: Page to load (1-based), always 1 for images
+            data: Optional file contents, read instead of filepath
+
+        Returns:
+            Callable taking a metadata dictionary and returning the page
+            image, or None when the page does not exist
+        """
+        if os.path.splitext(filepath)[1].lower() != '.pdf':
+            return lambda metadata: self.load_image(filepath, data, metadata)
+
+        def load(metadata):
+            for img in self.iter_pdf_pages(filepath, page_number, page_number, data):
+                return img
+            return None
+        return load
+
+    def get_image_cache_key(self, page_number):
+        """
+        Build the image cache key of a page of the current source file
+
+        Args:
+            page_number: Page number (1-based)
+
+        Returns:
+            Hex digest identifying the source and preprocessing settings, or
+            None when the image cache is disabled
+        """
+        if self.image_cache is None or self.source_hash is None:
+            return None
+        settings = {
+            'source': self.source_hash,
+            'page': page_number,
+            'dpi': self.dpi,
+            'preprocessing': self.preprocessing,
+            'text_height': self.text_height,
+        }
+        return hashlib.sha256(json.dumps(settings, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def ocr_cached_page(self, load, custom_config, page_number=1):
+        """
+        Preprocess and OCR a page, reusing its preprocessed images if cached
+
+        Repeated OCR of the same receipt with other Tesseract settings (psm,
+        user words, a region re-OCR) skips decoding and preprocessing.
+
+        Args:
+            load: Callable taking a metadata dictionary and returning the
+                page image; only called on a cache miss
+            custom_config: Tesseract config string
+            page_number: Page number (1-based)
+
+        Returns:
+            Tuple of page text and page metadata
+        """
+        gray, binary, metadata = self.preprocess_cached_page(load, page_number)
+        if gray is None:
+            return "", {}
+        return self.ocr_preprocessed(gray, binary, custom_config, metadata)
+
+    def preprocess_cached_page(self, load, page_number=1):
+        """
+        Preprocess a page, reusing its preprocessed images if cached
+
+        Args:
+            load: Callable taking a metadata dictionary and returning the
+                page image; only called on a cache miss
+            page_number: Page number (1-based)
+
+        Returns:
+            Tuple of grayscale image, thresholded image and page metadata;
+            the images are None when the page does not exist
+        """
+        key = self.get_image_cache_key(page_number)
+        cached = self.image_cache.get(key) if key else None
+        if cached is not None:
+            gray, binary, metadata = cached
+            metadata['image_cache'] = 'hit'
+            return gray, binary, metadata
+
+        metadata = {}
+        img = load(metadata)
+        if img is None:
+            return None, None, metadata
+        gray, binary = self.preprocess_page(img, metadata)
+        if key:
+            self.image_cache.set(key, gray, binary, metadata)
+            metadata['image_cache'] = 'miss'
+        return gray, binary, metadata
+
+    def ocr_page(self, img, custom_config):
+        """
+        Preprocess and OCR a single image or PDF page
+
+        Args:
+            img: OpenCV image, or grayscale image of a PDF page
+            custom_config: Tesseract config string
+
+        Returns:
+            Tuple of page text and page metadata
+        """
+        metadata = {}
+        gray, binary = self.preprocess_page(img, metadata)
+        return self.ocr_preprocessed(gray, binary, custom_config, metadata)
+
+    def preprocess_page(self, img, metadata=None):
+        """
+        Run a page through the preprocessing pipeline
+
+        Args:
+            img: OpenCV image, or grayscale image of a PDF page
+            metadata: Optional dictionary preprocessing details are added to
+
+        Returns:
+            Tuple of the last grayscale image, kept for re-OCR, and the
+            thresholded image
+        """
+        # PIL grayscale images map directly onto a 2D OpenCV image
+        img_cv = np.asarray(img)
+        grayscale_stages, binary_stages = self.split_preprocessing(self.preprocessing)
+        gray = self.run_preprocessing(img_cv, grayscale_stages, metadata)
+        return gray, self.run_preprocessing(gray, binary_stages, metadata)
+
+    def ocr_preprocessed(self, gray, img_processed, custom_config, metadata):
+        """
+        OCR a preprocessed page
+
+        Args:
+            gray: Grayscale page, used to re-OCR low-confidence lines
+            img_processed: Thresholded page
+            custom_config: Tesseract config string
+            metadata: Page metadata dictionary OCR details are added to
+
+        Returns:
+            Tuple of page text and page metadata
+        """
+        # Extract text, line by line, from processed image
+        start = time.perf_counter()
+        if self.ocr_mode == 'lines':
+            lines = self.ocr_line_strips(img_processed, custom_config)
+        elif self.tile_height and img_processed.shape[0] > self.tile_height:
+            lines = self.ocr_tiles(img_processed, custom_config, metadata)
+        else:
+            lines = self.data_to_lines(get_ocr_engine().image_to_data(img_processed, custom_config))
+        metadata['ocr_ms'] = round((time.perf_counter() - start) * 1000, 1)
+
+        if self.reocr_confidence:
+            self.reocr_low_confidence_lines(gray, lines, custom_config, metadata)
+
+        metadata['lines'] = lines
+        text = self.lines_to_text(lines)
+
+        if 'crop_box' in metadata and metadata['pixels_after']:
+            # Tesseract time grows roughly with pixel count
+            scale = metadata['pixels_before'] / metadata['pixels_after']
+            metadata['estimated_ocr_ms_saved'] = round(metadata['ocr_ms'] * (scale - 1), 1)
+            logger.info(
+                f"Receipt crop removed {metadata['pixel_reduction']:.0%} of pixels, "
+                f"saving an estimated {metadata['estimated_ocr_ms_saved']} ms of OCR"
+            )
+        return text, metadata
+
+    def find_line_strips(self, binary, min_height=4):
+        """
+        Split a binarized receipt into horizontal strips, one per text line
+
+        Rows containing ink are found with a row-sum projection; each run of
+        inked rows is a line, padded so ascenders and descenders are kept.
+
+        Args:
+            binary: Thresholded image, black text on white
+            min_height: Runs shorter than this many rows are treated as noise
+
+        Returns:
+            List of (top, bottom) row ranges, top to bottom
+        """
+        height, width = binary.shape[:2]
+        ink_per_row = np.count_nonzero(binary < 128, axis=1)
+        inked = ink_per_row > max(1, width // 500)
+
+        # Edges of the runs of inked rows
+        edges = np.flatnonzero(np.diff(np.concatenate(([0], inked.astype(np.int8), [0]))))
+        runs = [(top, bottom) for top, bottom in zip(edges[::2], edges[1::2]) if bottom - top >= min_height]
+
+        strips = []
+        for i, (top, bottom) in enumerate(runs):
+            padding = max(2, (bottom - top) // 4)
+            # Never pad past the midpoint of the gap to a neighbouring line
+            upper_limit = (runs[i - 1][1] + top) // 2 if i > 0 else 0
+            lower_limit = (bottom + runs[i + 1][0]) // 2 if i + 1 < len(runs) else height
+            strips.append((int(max(upper_limit, top - padding)), int(min(lower_limit, bottom + padding))))
+        return strips
+
+    def get_line_config(self, custom_config):
+        """Switch a Tesseract config to single-line page segmentation"""
+        if re.search(r'--psm\s+\d+', custom_config):
+            return re.sub(r'--psm\s+\d+', '--psm 7', custom_config)
+        return f'--psm 7 {custom_config}'
+
+    def ocr_line_strips(self, binary, custom_config):
+        """
+        OCR a receipt one line strip at a time, in parallel
+
+        Args:
+            binary: Thresholded image, black text on white
+            custom_config: Tesseract config string; its page segmentation mode
+                is replaced with single-line mode
+
+        Returns:
+            List of {'box': [x, y, w, h], 'text': str} dictionaries, top to bottom
+        """
+        line_config = self.get_line_config(custom_config)
+        strips = self.find_line_strips(binary)
+        engine = get_ocr_engine()
+
+        def ocr_strip(strip):
+            top, bottom = strip
+            return self.data_to_lines(engine.image_to_data(binary[top:bottom], line_config))
+
+        workers = min(self.line_workers, max(1, len(strips)))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(ocr_strip, strips))
+
+        width = binary.shape[1]
+        lines = []
+        for (top, bottom), strip_lines in zip(strips, results):
+            words = [line['text'] for line in strip_lines]
+            confs = [line['conf'] for line in strip_lines]
+            lines.append({
+                'box': [0, int(top), int(width), int(bottom - top)],
+                'text': " ".join(words),
+                'conf': round(sum(confs) / len(confs), 1) if confs else 0.0,
+                'paragraph': [0],
+            })
+        return lines
+
+    def find_tiles(self, height):
+        """
+        Split a page into overlapping horizontal tiles
+
+        Every row belongs to exactly one tile's own range; tiles extend half
+        the overlap past it on each side, so a line cut by one tile's edge is
+        whole in its neighbour.
+
+        Args:
+            height: Page height in pixels
+
+        Returns:
+            List of (top, bottom, own_top, own_bottom) row ranges, top to bottom
+        """
+        step = max(1, self.tile_height - self.tile_overlap)
+        margin = self.tile_overlap // 2
+        tiles = []
+        for own_top in range(0, height, step):
+            own_bottom = min(own_top + step, height)
+            tiles.append((max(0, own_top - margin), min(height, own_bottom + margin), own_top, own_bottom))
+        # Fold a sliver at the bottom into the previous tile
+        if len(tiles) > 1 and tiles[-1][3] - tiles[-1][2] < margin:
+            top, _, own_top, _ = tiles[-2]
+            tiles[-2:] = [(top, height, own_top, height)]
+        return tiles
+
+    def ocr_tiles(self, binary, custom_config, metadata=None):
+        """
+        OCR a tall page as overlapping horizontal tiles, in parallel
+
+        Tesseract time and memory grow faster than linearly on very tall
+        images, and single-block segmentation can drop whole sections of
+        them. Each line is kept from the tile whose own range contains the
+        line's centre, so lines in an overlap are not repeated, and results
+        are merged in tile order, so the output does not depend on which
+        tile finishes first.
+
+        Args:
+            binary: Thresholded image, black text on white
+            custom_config: Tesseract config string
+            metadata: Optional dictionary tiling details are added to
+
+        Returns:
+            List of line dictionaries, as data_to_lines, in page coordinates
+        """
+        tiles = self.find_tiles(binary.shape[0])
+        engine = get_ocr_engine()
+
+        def ocr_tile(tile):
+            top, bottom = tile[:2]
+            return self.data_to_lines(engine.image_to_data(binary[top:bottom], custom_config))
+
+        workers = min(self.line_workers, len(tiles))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(ocr_tile, tiles))
+
+        lines = []
+        for index, ((top, bottom, own_top, own_bottom), tile_lines) in enumerate(zip(tiles, results)):
+            for line in tile_lines:
+                left, line_top, width, height = line['box']
+                centre = top + line_top + height / 2
+                if not own_top <= centre < own_bottom:
+                    continue
+                box = [left, top + line_top, width, height]
+                # The same line read from both sides of a tile edge
+                if lines and lines[-1]['text'] == line['text'] and abs(lines[-1]['box'][1] - box[1]) < height:
+                    continue
+                lines.append(dict(line, box=box, paragraph=[index] + line['paragraph']))
+
+        if metadata is not None:
+            metadata['tiles'] = [list(map(int, tile[:2])) for tile in tiles]
+        return lines
+
+    def data_to_lines(self, data):
+        """
+        Group word-level OCR results into lines
+
+        Args:
+            data: pytesseract Output.DICT style dictionary from image_to_data
+
+        Returns:
+            List of {'box': [x, y, w, h], 'text': str, 'conf': float,
+            'paragraph': [page, block, paragraph]} dictionaries, in reading order
+        """
+        lines = {}
+        for i, word in enumerate(data['text']):
+            word = str(word).strip()
+            conf = float(data['conf'][i])
+            if conf < 0 or not word:
+                continue
+            key = (data['page_num'][i], data['block_num'][i], data['par_num'][i], data['line_num'][i])
+            left, top = int(data['left'][i]), int(data['top'][i])
+            right, bottom = left + int(data['width'][i]), top + int(data['height'][i])
+            line = lines.get(key)
+            if line is None:
+                lines[key] = line = {'words': [], 'confs': [], 'bounds': [left, top, right, bottom]}
+            line['words'].append(word)
+            line['confs'].append(conf)
+            bounds = line['bounds']
+            line['bounds'] = [min(bounds[0], left), min(bounds[1], top), max(bounds[2], right), max(bounds[3], bottom)]
+
+        result = []
+        for key, line in lines.items():
+            left, top, right, bottom = line['bounds']
+            result.append({
+                'box': [left, top, right - left, bottom - top],
+                'text': " ".join(line['words']),
+                'conf': round(sum(line['confs']) / len(line['confs']), 1),
+                'paragraph': list(key[:3]),
+            })
+        return result
+
+    def lines_to_text(self, lines):
+        """
+        Join OCR lines into text, with a blank line between paragraphs
+
+        Args:
+            lines: Lines from data_to_lines or ocr_line_strips
+
+        Returns:
+            Text as Tesseract would have printed it
+        """
+        text_lines = []
+        paragraph = None
+        for line in lines:
+            if not line['text']:
+                continue
+            if paragraph is not None and line['paragraph'] != paragraph:
+                text_lines.append("")
+            paragraph = line['paragraph']
+            text_lines.append(line['text'])
+        return "\n".join(text_lines)
+
+    def get_reocr_variants(self, gray):
+        """
+        Alternative preprocessing tried on lines Tesseract was unsure about
+
+        Args:
+            gray: Grayscale crop of a single line
+
+        Returns:
+            List of (name, binarized image) tuples, cheapest first
+        """
+        upscaled = cv2.resize(gray, None, fx=2, fy=2, interpolation=cv2.INTER_CUBIC)
+        _, otsu = cv2.threshold(upscaled, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+        block_size = max(3, (upscaled.shape[0] // 2) | 1)
+        adaptive = cv2.adaptiveThreshold(upscaled, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, block_size, 10)
+        return [('upscale_otsu', otsu), ('upscale_adaptive', adaptive)]
+
+    def reocr_low_confidence_lines(self, gray, lines, custom_config, metadata=None):
+        """
+        Re-OCR the lines whose confidence is below self.reocr_confidence
+
+        Each low-confidence line is cropped from the grayscale page and run
+        through the alternatives from get_reocr_variants in single-line mode.
+        The most confident reading replaces the line when it beats the
+        original. Lines are updated in place.
+
+        Args:
+            gray: Grayscale page the lines were read from, before thresholding
+            lines: Lines from data_to_lines or ocr_line_strips
+            custom_config: Tesseract config string
+            metadata: Optional dictionary re-OCR counts and timing are added to
+        """
+        start = time.perf_counter()
+        line_config = self.get_line_config(custom_config)
+        engine = get_ocr_engine()
+        low_confidence = [line for line in lines if line['conf'] < self.reocr_confidence]
+        improved = 0
+
+        height, width = gray.shape[:2]
+        for line in low_confidence:
+            x, y, w, h = line['box']
+            padding = max(2, h // 4)
+            crop = gray[max(0, y - padding):min(height, y + h + padding), max(0, x - padding):min(width, x + w + padding)]
+            if crop.size == 0:
+                continue
+            for variant, binary in self.get_reocr_variants(crop):
+                candidates = self.data_to_lines(engine.image_to_data(binary, line_config))
+                if not candidates:
+                    continue
+                conf = sum(candidate['conf'] for candidate in candidates) / len(candidates)
+                if conf > line['conf']:
+                    logger.info(f"Re-OCR ({variant}) improved line from {line['conf']} to {conf:.1f}: {line['text']}")
+                    line['text'] = " ".join(candidate['text'] for candidate in candidates)
+                    line['conf'] = round(conf, 1)
+                    line['reocr'] = variant
+                if line['conf'] >= self.reocr_confidence:
+                    break
+            if line.get('reocr'):
+                improved += 1
+
+        if metadata is not None:
+            metadata['low_confidence_lines'] = len(low_confidence)
+            metadata['reocr_improved_lines'] = improved
+            metadata['reocr_ms'] = round((time.perf_counter() - start) * 1000, 1)
+
+    def ocr_region(self, gray, box, custom_config):
+        """
+        OCR a rectangle of a page with each re-OCR variant
+
+        Args:
+            gray: Grayscale page
+            box: [x, y, w, h] rectangle in page coordinates
+            custom_config: Tesseract config string
+
+        Returns:
+            Lines of the most confident reading, with boxes in page
+            coordinates, top to bottom
+        """
+        engine = get_ocr_engine()
+        height, width = gray.shape[:2]
+        x, y, w, h = [int(value) for value in box]
+        padding = max(2, min(h, 40) // 4)
+        left, top = max(0, x - padding), max(0, y - padding)
+        crop = gray[top:min(height, y + h + padding), left:min(width, x + w + padding)]
+        if crop.size == 0:
+            return []
+
+        best = None
+        for variant, binary in self.get_reocr_variants(crop):
+            lines = self.data_to_lines(engine.image_to_data(binary, custom_config))
+            if not lines:
+                continue
+            conf = sum(line['conf'] for line in lines) / len(lines)
+            if best is None or conf > best[0]:
+                best = (conf, variant, lines)
+        if best is None:
+            return []
+
+        # Variants are upscaled 2x
+        _, variant, lines = best
+        for line in lines:
+            line_x, line_y, line_w, line_h = line['box']
+            line['box'] = [left + line_x // 2, top + line_y // 2, line_w // 2, line_h // 2]
+            line['reocr'] = variant
+        return lines
+
+    def map_text_lines(self, text_lines, pages):
+        """
+        Match the lines of a receipt's OCR text file to the OCR lines they came from
+
+        OCR lines are matched in order to the next text line with the same
+        cleaned text, so blank lines, text-layer pages and lines edited by
+        hand are skipped over.
+
+        Args:
+            text_lines: Lines of the OCR text file
+            pages: Page metadata the receipt was processed with
+
+        Returns:
+            Dictionary of text line index to (page index, OCR line index)
+        """
+        mapping = {}
+        position = 0
+        for page_index, page in enumerate(pages):
+            for line_index, line in enumerate(page.get('lines', [])):
+                cleaned = self.clean_line(line['text'])
+                if not cleaned:
+                    continue
+                for i in range(position, len(text_lines)):
+                    if text_lines[i] == cleaned:
+                        mapping[i] = (page_index, line_index)
+                        position = i + 1
+                        break
+        return mapping
+
+    def reocr_region(self, filepath, txt_path, metadata, first_line=None, last_line=None, page_number=1, box=None, profile='accurate'):
+        """
+        Re-OCR part of a processed receipt and patch its text file in place
+
+        The region is either a range of lines of the text file, each re-OCR'd
+        in single-line mode from its stored box, or a rectangle on a page,
+        whose text replaces the lines inside it. The page is preprocessed
+        with the settings the receipt was processed with, so it normally
+        comes from the image cache; only Tesseract runs again, with the
+        given profile's engine settings.
+
+        Args:
+            filepath: Path to the receipt file
+            txt_path: Path to its OCR text file
+            metadata: OCR metadata the receipt was processed with (job.meta)
+            first_line: First text file line to re-OCR (1-based)
+            last_line: Last text file line to re-OCR, defaults to first_line
+            page_number: Page the box is on (1-based)
+            box: [x, y, w, h] rectangle in preprocessed page coordinates
+            profile: Speed profile whose Tesseract settings are used
+
+        Returns:
+            Dictionary with the patched 'text', the 'replaced' lines and the
+            updated 'pages' metadata
+
+        Raises:
+            ValueError: When the region matches no OCR lines, or no text is
+                found in the box
+        """
+        text_lines = Path(txt_path).read_text(encoding='utf-8').split('\n')
+        pages = metadata.get('pages') or []
+        mapping = self.map_text_lines(text_lines, pages)
+
+        if box is not None:
+            page_index = page_number - 1
+            x, y, w, h = box
+            targets = []
+            for i, (line_page, line_index) in sorted(mapping.items()):
+                line_x, line_y, line_w, line_h = pages[line_page]['lines'][line_index]['box']
+                if line_page == page_index and x <= line_x + line_w / 2 < x + w and y <= line_y + line_h / 2 < y + h:
+                    targets.append(i)
+        else:
+            last_line = last_line or first_line
+            targets = [i for i in range(first_line - 1, last_line) if i in mapping]
+        if not targets:
+            raise ValueError("No OCR line positions found for this region")
+
+        # Preprocess the way the receipt was processed, then OCR with the profile
+        self.use_profile(metadata.get('profile') or self.default_profile)
+        if metadata.get('preprocessing'):
+            self.preprocessing = metadata['preprocessing']
+        if metadata.get('psm'):
+            self.psm = metadata['psm']
+        self.source_hash = hash_file(filepath) if self.image_cache is not None else None
+        grays = {}
+        for index in sorted({mapping[i][0] for i in targets}):
+            grays[index], _, _ = self.preprocess_cached_page(self.get_page_loader(filepath, index + 1), index + 1)
+        self.use_profile(profile)
+        custom_config = self.get_tesseract_config()
+
+        replaced = []
+        if box is not None:
+            page_lines = pages[page_index]['lines']
+            new_lines = self.ocr_region(grays[page_index], box, custom_config)
+            if not new_lines:
+                # Keep the old lines rather than deleting everything in the box
+                raise ValueError("No text found in this region")
+            old_indexes = [mapping[i][1] for i in targets]
+            first, last = targets[0], targets[-1]
+            replaced.append({
+                'old': text_lines[first:last + 1],
+                'new': [self.clean_line(line['text']) for line in new_lines],
+            })
+            text_lines[first:last + 1] = replaced[-1]['new']
+            paragraph = page_lines[old_indexes[0]]['paragraph']
+            for line in new_lines:
+                line['paragraph'] = paragraph
+            page_lines[old_indexes[0]:old_indexes[-1] + 1] = new_lines
+        else:
+            line_config = self.get_line_config(custom_config)
+            for i in targets:
+                page_index, line_index = mapping[i]
+                line = pages[page_index]['lines'][line_index]
+                new_lines = self.ocr_region(grays[page_index], line['box'], line_config)
+                if not new_lines:
+                    continue
+                line['text'] = " ".join(new_line['text'] for new_line in new_lines)
+                line['conf'] = round(sum(new_line['conf'] for new_line in new_lines) / len(new_lines), 1)
+                line['reocr'] = 'region'
+                replaced.append({'line': i + 1, 'old': text_lines[i], 'new': self.clean_line(line['text'])})
+                text_lines[i] = replaced[-1]['new']
+
+        text = "\n".join(text_lines)
+        Path(txt_path).write_text(text, encoding='utf-8')
+        logger.info(f"Re-OCR'd region of {txt_path}: {replaced}")
+        return {'text': text, 'replaced': replaced, 'pages': pages}
+
+    def find_paper_contours(self, gray, max_side=600):
+        """
+        Find the bright paper blobs of a photo or scan on a downscaled copy
+
+        Paper is brighter than most backgrounds, so blobs are found with Otsu
+        thresholding of a blurred copy, closed so printed text does not break
+        them up.
+
+        Args:
+            gray: Grayscale OpenCV image
+            max_side: Longest side of the copy the blobs are found on
+
+        Returns:
+            Tuple of the contours, the size of the copy as (height, width),
+            and its scale relative to gray
+        """
+        height, width = gray.shape[:2]
+        scale = min(1.0, max_side / max(height, width))
+        small = cv2.resize(gray, (max(1, int(width * scale)), max(1, int(height * scale))), interpolation=cv2.INTER_AREA)
+        small = cv2.GaussianBlur(small, (5, 5), 0)
+
+        _, mask = cv2.threshold(small, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+        # Close the gaps left by printed text so the paper is one blob
+        mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, np.ones((15, 15), np.uint8))
+
+        contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        return contours, small.shape[:2], scale
+
+    def contour_to_box(self, contour, small_shape, scale, shape):
+        """
+        Convert a contour found on a downscaled copy to a padded box
+
+        Args:
+            contour: Contour from find_paper_contours
+            small_shape: Size of the downscaled copy as (height, width)
+            scale: Scale of the copy relative to the full image
+            shape: Size of the full image
+
+        Returns:
+            (x, y, w, h) box in full-resolution pixels
+        """
+        height, width = shape[:2]
+        x, y, w, h = cv2.boundingRect(contour)
+        # Pad slightly so characters touching the paper edge survive
+        margin = int(0.01 * max(small_shape))
+        x0 = max(0, x - margin)
+        y0 = max(0, y - margin)
+        x1 = min(small_shape[1], x + w + margin)
+        y1 = min(small_shape[0], y + h + margin)
+        return (
+            int(x0 / scale),
+            int(y0 / scale),
+            min(width, int(round(x1 / scale))) - int(x0 / scale),
+            min(height, int(round(y1 / scale))) - int(y0 / scale),
+        )
+
+    def find_receipt_region(self, gray):
+        """
+        Find the bounding box of the receipt paper in a photo
+
+        The largest bright blob is taken as the receipt.
+
+        Args:
+            gray: Grayscale OpenCV image
+
+        Returns:
+            (x, y, w, h) box in full-resolution pixels, or None when no
+            region stands out from the frame
+        """
+        contours, small_shape, scale = self.find_paper_contours(gray)
+        if not contours:
+            return None
+        contour = max(contours, key=cv2.contourArea)
+        _, _, w, h = cv2.boundingRect(contour)
+
+        small_area = small_shape[0] * small_shape[1]
+        if w * h < 0.1 * small_area or w * h > 0.95 * small_area:
+            return None
+        return self.contour_to_box(contour, small_shape, scale, gray.shape)
+
+    def find_receipt_regions(self, gray, min_area=0.03):
+        """
+        Find every receipt on a scan holding several side by side
+
+        Args:
+            gray: Grayscale OpenCV image
+            min_area: Smallest blob kept, as a fraction of the image area;
+                smaller ones are smudges or labels
+
+        Returns:
+            List of (x, y, w, h) boxes in full-resolution pixels, left to
+            right and then top to bottom
+        """
+        contours, small_shape, scale = self.find_paper_contours(gray)
+        small_area = small_shape[0] * small_shape[1]
+        boxes = []
+        for contour in contours:
+            _, _, w, h = cv2.boundingRect(contour)
+            if min_area * small_area <= w * h <= 0.95 * small_area:
+                boxes.append(self.contour_to_box(contour, small_shape, scale, gray.shape))
+        return sorted(boxes)
+
+    def crop_to_receipt(self, gray, metadata=None):
+        """
+        Crop a photo to the receipt paper
+
+        Args:
+            gray: Grayscale OpenCV image
+            metadata: Optional dictionary the crop box and pixel counts are added to
+
+        Returns:
+            Cropped image, or the original image when no receipt region was found
+        """
+        start = time.perf_counter()
+        box = self.find_receipt_region(gray)
+        if box is None:
+            return gray
+
+        x, y, w, h = box
+        cropped = gray[y:y + h, x:x + w]
+        if metadata is not None:
+            pixels_before = gray.shape[0] * gray.shape[1]
+            pixels_after = w * h
+            metadata['crop_box'] = [x, y, w, h]
+            metadata['pixels_before'] = pixels_before
+            metadata['pixels_after'] = pixels_after
+            metadata['pixel_reduction'] = round(1 - pixels_after / pixels_before, 3)
+            metadata['crop_ms'] = round((time.perf_counter() - start) * 1000, 1)
+        return cropped
+
+    def orient_image(self, gray, metadata=None, max_side=1500, min_confidence=2.0):
+        """
+        Turn a sideways or upside-down receipt upright
+
+        Tesseract's orientation detection runs on a copy shrunk to max_side
+        pixels, which is plenty for the OSD model and much cheaper than the
+        full page. EXIF orientation of photos is already applied by OpenCV
+        when the image is decoded.
+
+        Args:
+            gray: Grayscale OpenCV image
+            metadata: Optional dictionary the rotation and timing are added to
+            max_side: Longest side of the copy orientation is detected on
+            min_confidence: Orientation confidence below which the image is
+                left untouched
+
+        Returns:
+            Rotated image, or the original image when it is upright or the
+            orientation is uncertain
+        """
+        start = time.perf_counter()
+        scale = max_side / max(gray.shape[:2])
+        small = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA) if scale < 1 else gray
+        try:
+            rotate, confidence = get_ocr_engine().image_to_osd(small)
+        except (pytesseract.TesseractError, RuntimeError) as e:
+            # Raised when the page has too little text to tell
+            logger.info(f"Orientation detection skipped: {e}")
+            return gray
+        finally:
+            if metadata is not None:
+                metadata['orientation_ms'] = round((time.perf_counter() - start) * 1000, 1)
+
+        if metadata is not None:
+            metadata['orientation_rotate'] = rotate
+            metadata['orientation_confidence'] = round(confidence, 2)
+        if rotate not in ORIENTATION_ROTATIONS or confidence < min_confidence:
+            return gray
+        return cv2.rotate(gray, ORIENTATION_ROTATIONS[rotate])
+
+    def estimate_skew_angle(self, gray, max_angle=10.0):
+        """
+        Estimate how far the text lines of an image are rotated
+
+        Ink pixels of a downsampled, binarized copy are projected onto rows
+        for a range of candidate angles at once; the angle whose row profile
+        is sharpest (highest sum of squared bin counts) lines the text up
+        with the rows. A 1 degree sweep is always refined to 0.1 degrees, so
+        the same page gives the same angle every time it is preprocessed.
+
+        Args:
+            gray: Grayscale OpenCV image
+            max_angle: Largest skew considered, in degrees
+
+        Returns:
+            Angle in degrees, counter-clockwise, that straightens the image
+        """
+        height, width = gray.shape[:2]
+        scale = min(1.0, 800.0 / max(height, width))
+        if scale < 1.0:
+            # Linear sampling is several times cheaper than INTER_AREA on a full photo
+            gray = cv2.resize(gray, (max(1, int(width * scale)), max(1, int(height * scale))), interpolation=cv2.INTER_LINEAR)
+        _, ink = cv2.threshold(gray, 0, 1, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+
+        ys, xs = np.nonzero(ink)
+        if len(ys) < 50:
+            return 0.0
+        # Bound the work per angle regardless of how much ink there is
+        step = -(-len(ys) // 8000)
+        ys = ys[::step].astype(np.float32)
+        xs = xs[::step].astype(np.float32)
+        ys -= ys.mean()
+        xs -= xs.mean()
+
+        def sharpest(angles):
+            radians = np.deg2rad(angles).astype(np.float32)[:, None]
+            rows = np.rint(ys * np.cos(radians) - xs * np.sin(radians)).astype(np.int32)
+            rows -= rows.min()
+            bins = int(rows.max()) + 1
+            rows += np.arange(len(angles), dtype=np.int32)[:, None] * bins
+            profiles = np.bincount(rows.ravel(), minlength=len(angles) * bins).reshape(len(angles), bins)
+            scores = np.square(np.diff(profiles.astype(np.float64), axis=1)).sum(axis=1)
+            return float(angles[int(np.argmax(scores))])
+
+        angle = sharpest(np.arange(-max_angle, max_angle + 0.5, 1.0))
+        angle = sharpest(np.arange(angle - 1.0, angle + 1.05, 0.1))
+        # Adding 0.0 turns a rounded -0.0 into 0.0
+        return round(angle, 2) + 0.0
+
+    def deskew_image(self, gray, metadata=None, min_angle=0.3):
+        """
+        Rotate an image so its text lines are horizontal
+
+        Args:
+            gray: Grayscale OpenCV image
+            metadata: Optional dictionary the skew angle and timing are added to
+            min_angle: Skew below which the image is left untouched, in degrees
+
+        Returns:
+            Straightened image, or the original image when the skew is negligible
+        """
+        start = time.perf_counter()
+        angle = self.estimate_skew_angle(gray)
+        estimate_ms = (time.perf_counter() - start) * 1000
+        if estimate_ms > self.deskew_budget_ms:
+            logger.warning(f"Skew estimate took {estimate_ms:.1f} ms, over the {self.deskew_budget_ms} ms budget")
+        if metadata is not None:
+            metadata['skew_angle'] = angle
+            metadata['deskew_estimate_ms'] = round(estimate_ms, 1)
+        if abs(angle) < min_angle:
+            return gray
+
+        height, width = gray.shape[:2]
+        matrix = cv2.getRotationMatrix2D((width / 2, height / 2), angle, 1.0)
+        # Grow the canvas so the rotated corners are not clipped
+        cos, sin = abs(matrix[0, 0]), abs(matrix[0, 1])
+        new_width = int(height * sin + width * cos)
+        new_height = int(height * cos + width * sin)
+        matrix[0, 2] += new_width / 2 - width / 2
+        matrix[1, 2] += new_height / 2 - height / 2
+        rotated = cv2.warpAffine(gray, matrix, (new_width, new_height), flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+        if metadata is not None:
+            metadata['deskew_ms'] = round((time.perf_counter() - start) * 1000, 1)
+        return rotated
+
+    def estimate_text_height(self, gray):
+        """
+        Estimate the typical glyph height of an image
+
+        Connected components are found on a thumbnail; the median height of
+        the character-sized ones, scaled back up, is the text height.
+
+        Args:
+            gray: Grayscale OpenCV image
+
+        Returns:
+            Median glyph height in full-resolution pixels, or None when no
+            text-like components were found
+        """
+        height, width = gray.shape[:2]
+        scale = min(1.0, 1000.0 / max(height, width))
+        if scale < 1.0:
+            gray = cv2.resize(gray, (max(1, int(width * scale)), max(1, int(height * scale))), interpolation=cv2.INTER_AREA)
+        _, ink = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+
+        _, _, stats, _ = cv2.connectedComponentsWithStats(ink, connectivity=8)
+        widths = stats[1:, cv2.CC_STAT_WIDTH]
+        heights = stats[1:, cv2.CC_STAT_HEIGHT]
+        # Skip specks, rules and blobs that are not single characters
+        glyphs = heights[
+            (heights >= 3)
+            & (heights <= gray.shape[0] / 10)
+            & (widths <= heights * 3)
+            & (widths >= 1)
+        ]
+        if len(glyphs) < 10:
+            return None
+        return float(np.median(glyphs)) / scale
+
+    def normalize_resolution(self, gray, metadata=None, tolerance=0.2, text_height=None):
+        """
+        Resample an image so its glyphs are about text_height pixels tall
+
+        Large photos are shrunk, which makes OCR faster, and small scans are
+        enlarged, which makes it more accurate. Images already within
+        tolerance of the target are left alone.
+
+        Args:
+            gray: Grayscale OpenCV image
+            metadata: Optional dictionary the text height and scale are added to
+            tolerance: Relative size difference that is not worth resampling
+            text_height: Target glyph height, defaults to self.text_height
+
+        Returns:
+            Resampled image, or the original image when no change is needed
+        """
+        start = time.perf_counter()
+        target_height = text_height or self.text_height
+        text_height = self.estimate_text_height(gray)
+        if text_height is None or not target_height:
+            return gray
+
+        scale = min(4.0, max(0.25, target_height / text_height))
+        if metadata is not None:
+            metadata['text_height'] = round(text_height, 1)
+            metadata['resize_scale'] = 1.0
+        if abs(scale - 1.0) <= tolerance:
+            return gray
+
+        height, width = gray.shape[:2]
+        interpolation = cv2.INTER_AREA if scale < 1.0 else cv2.INTER_CUBIC
+        resized = cv2.resize(gray, (max(1, int(round(width * scale))), max(1, int(round(height * scale)))), interpolation=interpolation)
+        if metadata is not None:
+            metadata['resize_scale'] = round(scale, 3)
+            metadata['normalize_ms'] = round((time.perf_counter() - start) * 1000, 1)
+        return resized
+
+    def preprocess_image(self, img, metadata=None):
+        """
+        Preprocess image for better OCR results
         
-        return opening
\ No newline at end of file
+        Args:
+            img: OpenCV image, BGR or already grayscale
+            metadata: Optional dictionary preprocessing details are added to
+            
+        Returns:
+            Processed image
+        """
+        return self.run_preprocessing(img, self.preprocessing, metadata)
+
+    def split_preprocessing(self, stages):
+        """
+        Split a pipeline at its first binarizing stage
+
+        Args:
+            stages: List of stage names or stage dictionaries
+
+        Returns:
+            Tuple of the grayscale stages and the remaining stages
+        """
+        for i, stage in enumerate(stages):
+            name = stage if isinstance(stage, str) else stage.get('name')
+            if PREPROCESSING_STAGES.get(name, (None, False))[1]:
+                return stages[:i], stages[i:]
+        return stages, []
+
+    def run_preprocessing(self, img, stages, metadata=None):
+        """
+        Run an image through a list of preprocessing stages
+
+        Stages are names from PREPROCESSING_STAGES, or dictionaries with a
+        "name" and keyword arguments for the stage, e.g.
+        {"name": "deskew", "min_angle": 0.5}. The wall time and output size of
+        each stage are appended to metadata['stages'].
+
+        Args:
+            img: OpenCV image
+            stages: List of stage names or stage dictionaries
+            metadata: Optional dictionary stage details are added to
+
+        Returns:
+            Processed image
+        """
+        for stage in stages:
+            if isinstance(stage, str):
+                name, params = stage, {}
+            else:
+                params = dict(stage)
+                name = params.pop('name', None)
+            if name not in PREPROCESSING_STAGES:
+                logger.warning(f"Skipping unknown preprocessing stage: {name}")
+                continue
+
+            start = time.perf_counter()
+            img = getattr(self, PREPROCESSING_STAGES[name][0])(img, metadata, **params)
+            if metadata is not None:
+                metadata.setdefault('stages', []).append({
+                    'stage': name,
+                    'ms': round((time.perf_counter() - start) * 1000, 2),
+                    'width': int(img.shape[1]),
+                    'height': int(img.shape[0]),
+                    'bytes': int(img.nbytes),
+                })
+        return img
+
+    def to_grayscale(self, img, metadata=None):
+        """
+        Convert an image to grayscale
+
+        Args:
+            img: OpenCV image, BGR or already grayscale
+            metadata: Unused, accepted for the preprocessing pipeline
+
+        Returns:
+            Grayscale image
+        """
+        if img.ndim == 2:
+            return img
+        return cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+
+    def median_blur(self, gray, metadata=None, ksize=3):
+        """Remove salt-and-pepper noise from a grayscale image"""
+        return cv2.medianBlur(gray, ksize)
+
+    def binarize(self, gray, metadata=None):
+        """
+        Threshold a grayscale image to black text on white with Otsu's method
+
+        Args:
+            gray: Grayscale OpenCV image
+            metadata: Unused, accepted for the preprocessing pipeline
+
+        Returns:
+            Binary image
+        """
+        _, thresh = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+        return thresh
+
+    def adaptive_binarize(self, gray, metadata=None, block_size=31, c=10):
+        """
+        Threshold a grayscale image against its local mean
+
+        Copes better than Otsu with uneven lighting across a photo.
+
+        Args:
+            gray: Grayscale OpenCV image
+            metadata: Unused, accepted for the preprocessing pipeline
+            block_size: Size of the neighbourhood, odd
+            c: Constant subtracted from the local mean
+
+        Returns:
+            Binary image
+        """
+        return cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, block_size, c)
+
+    def morphology_open(self, binary, metadata=None, kernel=2):
+        """Morphological opening of a binary image with a square kernel"""
+        return cv2.morphologyEx(binary, cv2.MORPH_OPEN, np.ones((kernel, kernel), np.uint8))
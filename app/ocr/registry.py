@@ -0,0 +1,390 @@
+import os
+import re
+import sys
+import json
+import threading
+import time
+
+# Add parent directory to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.logger import get_logger
+from ocr.normalizer import DEFAULT_LINE_RULES, LineNormalizer
+
+# Initialize logger
+logger = get_logger('ocr_registry')
+
+
+class RegistrySnapshot:
+    """
+    One consistent, validated load of the receipt processor config files.
+
+    Snapshots are never modified after they are built; a reload builds a new
+    one and swaps it in, so a parse always sees one version of every file.
+    """
+
+    def __init__(self, custom, default, categories, patterns, line_rules, mtimes):
+        self.custom = custom
+        self.default = default
+        self.categories = categories
+        self.patterns = patterns
+        self.line_rules = line_rules
+        self.normalizer = LineNormalizer(DEFAULT_LINE_RULES + line_rules)
+        self.matchers = {id(custom): StoreMatcher(custom), id(default): StoreMatcher(default)}
+        self.category_indexes = {id(mapping): CategoryIndex(mapping) for mapping in categories.values()}
+        self.mtimes = mtimes
+
+
+class CategoryIndex:
+    """
+    Prefix trie over a store's category mapping.
+
+    A receipt line is a category header when it equals a key, or starts
+    with one. Of several keys the line starts with, the one listed first in
+    the mapping wins, the same as scanning the mapping in order; the trie
+    finds it in one walk along the line.
+    """
+
+    # Node key marking the end of a category key; never a line character
+    END = ''
+
+    def __init__(self, mapping):
+        self.mapping = mapping
+        self.root = {}
+        for order, (key, value) in enumerate(mapping.items()):
+            node = self.root
+            for char in key:
+                node = node.setdefault(char, {})
+            # Only the first of duplicate keys can win
+            node.setdefault(self.END, (order, value))
+
+    def __len__(self):
+        return len(self.mapping)
+
+    def match(self, line):
+        """
+        Find the category a header line names
+
+        Args:
+            line: Cleaned receipt line
+
+        Returns:
+            Tuple of whether the line is a category header and the category
+        """
+        value = self.mapping.get(line)
+        if value is not None:
+            return True, value
+
+        node = self.root
+        best = node.get(self.END)
+        for char in line:
+            node = node.get(char)
+            if node is None:
+                break
+            end = node.get(self.END)
+            if end is not None and (best is None or end[0] < best[0]):
+                best = end
+        if best is None:
+            return False, None
+        return True, best[1]
+
+
+class StoreMatcher:
+    """
+    Finds every store whose search string occurs in a receipt in one pass.
+
+    The lowercased search strings are combined into one regex, tried at
+    every position through a lookahead so overlapping names are all seen.
+    Stores are scored by where their search string first occurs: the store
+    named at the top of a receipt beats one only mentioned further down.
+    Stores with an empty search string match any receipt, so they are only
+    candidates when no named store is found.
+    """
+
+    def __init__(self, stores, header_lines=10):
+        self.header_lines = header_lines
+        self.stores_by_search = {}
+        for store in stores:
+            search_string = store.get('search_string')
+            if search_string is None:
+                search_string = store.get('name', "")
+            self.stores_by_search.setdefault(search_string.lower(), []).append(store)
+        # Longest first; shorter strings matching at the same position are
+        # its prefixes, recorded along with it
+        searches = sorted((s for s in self.stores_by_search if s), key=len, reverse=True)
+        self.pattern = re.compile('(?=(' + '|'.join(map(re.escape, searches)) + '))') if searches else None
+        self.prefixes = {
+            search: [other for other in searches if other != search and search.startswith(other)]
+            for search in searches
+        }
+
+    def scan(self, text):
+        """
+        Find the first position of each search string in lowercased text
+
+        Args:
+            text: Lowercased text
+
+        Returns:
+            Dictionary of search string to position
+        """
+        positions = {}
+        if self.pattern is not None:
+            for match in self.pattern.finditer(text):
+                search = match.group(1)
+                positions.setdefault(search, match.start())
+                for prefix in self.prefixes[search]:
+                    positions.setdefault(prefix, match.start())
+        return positions
+
+    def candidates(self, text):
+        """
+        Score every store found in a receipt
+
+        The first header_lines lines are searched first; the full text only
+        when none of the stores is named there. Stores with an empty search
+        string are the only candidates, with a score of 0, when neither names
+        a store.
+
+        Args:
+            text: Receipt text
+
+        Returns:
+            List of dictionaries with the 'store', the 'position' of its
+            search string and a 'score' between 0 and 1, best first
+        """
+        header = '\n'.join(text.split('\n', self.header_lines)[:self.header_lines]).lower()
+        positions = self.scan(header)
+        length = len(header)
+        if not positions and len(header) < len(text):
+            positions = self.scan(text.lower())
+            length = len(text)
+
+        candidates = []
+        for search, position in sorted(positions.items(), key=lambda item: (item[1], -len(item[0]))):
+            for store in self.stores_by_search[search]:
+                candidates.append({
+                    'store': store,
+                    'position': position,
+                    'score': round(1 - position / max(1, length), 4),
+                })
+        if not candidates:
+            for store in self.stores_by_search.get('', []):
+                candidates.append({'store': store, 'position': None, 'score': 0.0})
+        return candidates
+
+
+class ProcessorRegistry:
+    """
+    Process-wide registry of receipt processors, category mappings and
+    extra line normalization rules.
+
+    The JSON files are read, validated and every processor pattern compiled
+    once. The files' modification times are checked at most every
+    check_interval seconds, and the registry reloads only when one changed,
+    so parsing a receipt does no config I/O.
+    """
+
+    def __init__(self, custom_path='/config/receipt_processors.json',
+                 default_path='/config/receipt_processors_default.json',
+                 categories_path='/config/category_mappings.json',
+                 check_interval=1.0, line_rules_path='/config/line_rules.json'):
+        self.custom_path = custom_path
+        self.default_path = default_path
+        self.categories_path = categories_path
+        self.line_rules_path = line_rules_path
+        self.check_interval = check_interval
+        self.lock = threading.Lock()
+        self.snapshot = None
+        self.checked_at = 0.0
+
+    def get_mtimes(self):
+        mtimes = []
+        for path in (self.custom_path, self.default_path, self.categories_path, self.line_rules_path):
+            try:
+                mtimes.append(os.stat(path).st_mtime_ns)
+            except FileNotFoundError:
+                mtimes.append(None)
+        return tuple(mtimes)
+
+    def current(self):
+        """
+        Get the current snapshot, reloading it if a config file changed
+
+        Returns:
+            RegistrySnapshot
+        """
+        snapshot = self.snapshot
+        now = time.monotonic()
+        if snapshot is not None and now - self.checked_at < self.check_interval:
+            return snapshot
+
+        with self.lock:
+            self.checked_at = now
+            mtimes = self.get_mtimes()
+            if self.snapshot is None or self.snapshot.mtimes != mtimes:
+                self.snapshot = self.load(mtimes)
+            return self.snapshot
+
+    def load(self, mtimes):
+        """
+        Read, validate and compile every config file
+
+        A file that cannot be read keeps its previous contents, so a config
+        caught half-written is picked up on the next change instead.
+
+        Args:
+            mtimes: Modification times the snapshot is built from
+
+        Returns:
+            RegistrySnapshot
+        """
+        previous = self.snapshot
+        patterns = {}
+        custom = self.load_stores(self.custom_path, patterns, previous.custom if previous else [])
+        default = self.load_stores(self.default_path, patterns, previous.default if previous else [])
+        categories = self.load_categories(previous.categories if previous else {})
+        line_rules = self.read_json(self.line_rules_path, list, previous.line_rules if previous else [])
+        logger.info(
+            f"Loaded {len(custom)} custom and {len(default)} default receipt processors, "
+            f"{len(patterns)} patterns, category mappings for {len(categories)} stores, "
+            f"{len(line_rules)} extra line rules"
+        )
+        return RegistrySnapshot(custom, default, categories, patterns, line_rules, mtimes)
+
+    def read_json(self, path, expected_type, fallback):
+        try:
+            with open(path, 'r') as f:
+                value = json.load(f)
+        except FileNotFoundError:
+            logger.info(f"No config file {path}")
+            return expected_type()
+        except (OSError, ValueError) as e:
+            logger.error(f"Failed to read {path}, keeping the previous version: {e}")
+            return fallback
+        if not isinstance(value, expected_type):
+            logger.error(f"{path} must contain a JSON {expected_type.__name__}, keeping the previous version")
+            return fallback
+        return value
+
+    def load_stores(self, path, patterns, fallback):
+        """
+        Load a receipt processors file, compiling each store's patterns
+
+        Stores without a name, and patterns that do not compile, are logged
+        and left out.
+
+        Args:
+            path: Path to the JSON file
+            patterns: Dictionary of pattern string to compiled pattern,
+                filled in
+            fallback: Stores kept when the file cannot be read
+
+        Returns:
+            List of store dictionaries
+        """
+        stores = self.read_json(path, list, None)
+        if stores is None:
+            for store in fallback:
+                for processor in store.get('processors', []):
+                    patterns[processor] = re.compile(processor)
+            return fallback
+
+        valid = []
+        for store in stores:
+            if not isinstance(store, dict) or not isinstance(store.get('name'), str):
+                logger.error(f"Skipping receipt processor without a name in {path}: {store}")
+                continue
+            processors = []
+            for processor in store.get('processors', []):
+                try:
+                    patterns[processor] = re.compile(processor)
+                except (TypeError, re.error) as e:
+                    logger.error(f"Skipping invalid pattern for {store['name']} in {path}: {processor!r}: {e}")
+                    continue
+                processors.append(processor)
+            valid.append(dict(store, processors=processors))
+        return valid
+
+    def load_categories(self, fallback):
+        mappings = self.read_json(self.categories_path, dict, fallback)
+        return {
+            store: {str(key): value for key, value in mapping.items()}
+            for store, mapping in mappings.items()
+            if isinstance(mapping, dict)
+        }
+
+    def custom_processors(self):
+        return self.current().custom
+
+    def default_processors(self):
+        return self.current().default
+
+    def category_mappings(self, store_name):
+        return self.current().categories.get(store_name, {})
+
+    def normalizer(self):
+        return self.current().normalizer
+
+    def category_index(self, mapping):
+        """
+        Get the prefix index of a category mapping
+
+        Args:
+            mapping: Mapping from category_mappings, or any other dictionary
+                of header to category
+
+        Returns:
+            CategoryIndex, prebuilt for the registry's own mappings
+        """
+        index = self.current().category_indexes.get(id(mapping))
+        if index is None:
+            index = CategoryIndex(mapping)
+        return index
+
+    def store_matcher(self, stores):
+        """
+        Get the matcher for a list of stores
+
+        Args:
+            stores: Store list from custom_processors or default_processors,
+                or any other list of stores
+
+        Returns:
+            StoreMatcher, prebuilt for the registry's own lists
+        """
+        matcher = self.current().matchers.get(id(stores))
+        if matcher is None:
+            matcher = StoreMatcher(stores)
+        return matcher
+
+    def compile(self, pattern):
+        """
+        Get the compiled form of a processor pattern
+
+        Args:
+            pattern: Regular expression string
+
+        Returns:
+            Compiled pattern, from the registry when it is a configured one
+        """
+        compiled = self.current().patterns.get(pattern)
+        if compiled is None:
+            compiled = re.compile(pattern)
+        return compiled
+
+
+_processor_registry = None
+
+
+def get_processor_registry():
+    """
+    Get the process-wide receipt processor registry
+
+    Returns:
+        ProcessorRegistry instance
+    """
+    global _processor_registry
+    if _processor_registry is None:
+        _processor_registry = ProcessorRegistry()
+    return _processor_registry
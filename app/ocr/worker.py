@@ -10,6 +10,8 @@ import sys
 # Add parent directory to path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
+from ocr.processor import init_ocr_engine
+
 # Configure Redis connection
 redis_conn = redis.Redis(
     host=os.environ.get('REDIS_HOST', 'redis'),
@@ -17,6 +19,9 @@ redis_conn = redis.Redis(
 )
 
 if __name__ == '__main__':
+    # Load the OCR engine once; forked job processes inherit it
+    init_ocr_engine()
+
     # Start worker
     with Connection(redis_conn):
         worker = Worker(Queue('default'))
@@ -1,10 +1,12 @@
 import os
+import copy
 import json
 from flask import Flask, request, render_template, redirect, url_for, flash, jsonify
 from werkzeug.utils import secure_filename
 import redis
 from rq import Queue
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 # Add parent directory to path
@@ -12,7 +14,7 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from grocy.client import GrocyClient
 from utils.logger import get_logger
-from ocr.processor import ReceiptProcessor
+from ocr.processor import ReceiptProcessor, OCR_PROFILES
 
 # Initialize logger
 logger = get_logger(__name__)
@@ -49,13 +51,34 @@ grocy_client = GrocyClient(
 
 receipt_processor = ReceiptProcessor()
 
+# Writes uploaded originals to disk in the background when OCR runs in-process
+upload_writer = ThreadPoolExecutor(max_workers=1)
+
+def save_upload(data, filepath):
+    """
+    Persist an uploaded receipt for auditing, off the request path
+
+    Args:
+        data: Contents of the uploaded file
+        filepath: Where to save it
+    """
+    try:
+        Path(filepath).write_bytes(data)
+        logger.info(f"File saved successfully: {filepath}, size: {len(data)} bytes")
+    except Exception as e:
+        logger.error(f"Error saving file {filepath}: {e}")
+
 # Load category mappings
 with open('/config/category_mappings.json', 'r') as f:
     category_mappings = json.load(f)
 
 @app.route('/')
 def index():
-    return render_template('index.html')
+    stores = []
+    for store in receipt_processor.get_custom_receipt_processors() + receipt_processor.get_default_receipt_processors():
+        if store.get('name') and store['name'] not in stores:
+            stores.append(store['name'])
+    return render_template('index.html', stores=stores, profiles=list(OCR_PROFILES))
 
 @app.route('/upload', methods=['POST'])
 def upload_receipt():
@@ -70,33 +93,44 @@ def upload_receipt():
         logger.warning("Upload attempted with empty filename")
         return redirect(request.url)
     
+    # Optional store and speed profile, selecting OCR settings
+    store = request.form.get('store') or None
+    profile = request.form.get('profile') or None
+    # Unchecked leaves OCR_SPLIT_RECEIPTS in charge
+    split = True if request.form.get('split') else None
+
     if file:
         filename = secure_filename(file.filename)
         filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
         
-        logger.info(f"Saving uploaded file to {filepath}")
         try:
             # Ensure upload directory exists
             os.makedirs(os.path.dirname(filepath), exist_ok=True)
-            file.save(filepath)
-            logger.info(f"File saved successfully: {filepath}")
-            
-            # Check if file exists after saving
-            if os.path.exists(filepath):
-                logger.info(f"File exists at {filepath}, size: {os.path.getsize(filepath)} bytes")
-            else:
-                logger.error(f"File does not exist after saving: {filepath}")
             
             if app.config['USE_QUEUE'] == True:
+                logger.info(f"Saving uploaded file to {filepath}")
+                file.save(filepath)
+                logger.info(f"File saved successfully: {filepath}")
+                
+                # Check if file exists after saving
+                if os.path.exists(filepath):
+                    logger.info(f"File exists at {filepath}, size: {os.path.getsize(filepath)} bytes")
+                else:
+                    logger.error(f"File does not exist after saving: {filepath}")
+                
                 logger.info("Using queue")
                 # Queue OCR processing job
-                job = queue.enqueue(receipt_processor.process_receipt, filepath)
+                job = queue.enqueue(receipt_processor.process_receipt, filepath, store=store, profile=profile, split=split)
                 logger.info(f"OCR job queued with ID: {job.id}")
                 logger.info(queue)
                 return redirect(url_for('processing', job_id=job.id))
             else:
                 logger.info("Not using queue")
-                ocr_file = receipt_processor.process_receipt(filepath)
+                # OCR straight from the upload stream; the original is
+                # written to disk in the background
+                data = file.read()
+                upload_writer.submit(save_upload, data, filepath)
+                ocr_file = receipt_processor.process_receipt(filepath, store=store, data=data, profile=profile, split=split)
                 # products = extract_products_from_ocr_file(ocr_file)
                 logger.info(f"OCR ocr_file: {ocr_file}")
                 # print(products)
@@ -115,6 +149,10 @@ def processing(job_id):
         return redirect(url_for('index'))
     
     if job.is_finished:
+        # Scans holding several receipts continue as one job per receipt
+        receipts = job.meta.get('receipts')
+        if receipts:
+            return render_template('receipts.html', job_id=job_id, receipts=receipts)
         return redirect(url_for('ocr', job_id=job_id))
     
     return render_template('processing.html', job_id=job_id)
@@ -175,6 +213,45 @@ def ocr(job_id):
             return redirect(url_for('index'))
             
 
+@app.route('/ocr/<job_id>/region', methods=['POST'])
+def reocr_region(job_id):
+    """Re-OCR a line range or rectangle of a receipt and patch its OCR text"""
+    job = queue.fetch_job(job_id)
+    
+    if job is None or not job.is_finished:
+        return jsonify({'status': 'error', 'message': 'Job not found or still processing'}), 404
+    
+    params = request.get_json(silent=True) or request.form
+    try:
+        first_line = params.get('first_line')
+        last_line = params.get('last_line')
+        box = params.get('box')
+        if isinstance(box, str):
+            box = [int(value) for value in box.split(',')]
+        # reocr_region switches the processor's profile and preprocessing,
+        # so concurrent requests each get their own processor state
+        processor = copy.copy(receipt_processor)
+        result = processor.reocr_region(
+            job.args[0],
+            job.result,
+            job.meta,
+            first_line=int(first_line) if first_line else None,
+            last_line=int(last_line) if last_line else None,
+            page_number=int(params.get('page', 1)),
+            box=box,
+            profile=params.get('profile') or 'accurate'
+        )
+    except FileNotFoundError as e:
+        logger.warning(f"Region re-OCR failed for job {job_id}: {e}")
+        return jsonify({'status': 'error', 'message': 'OCR text file not found'}), 404
+    except (TypeError, ValueError) as e:
+        logger.warning(f"Region re-OCR failed for job {job_id}: {e}")
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    
+    job.meta['pages'] = result['pages']
+    job.save_meta()
+    return jsonify({'status': 'success', 'text': result['text'], 'replaced': result['replaced']})
+
 @app.route('/review/<job_id>')
 def review(job_id):
     job = queue.fetch_job(job_id)
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Measure peak memory and time of decoding receipts to grayscale
+
+Usage:
+    python benchmarks/bench_decode.py receipt1.jpg receipt2.pdf ... [--text-height 30]
+
+Each file is decoded the way extract_text used to (full-size color decode,
+or RGB PDF pages copied to BGR, then converted to gray) and the way it does
+now (grayscale decode, reduced-size for large JPEGs; grayscale PDF pages).
+Peak allocation per image or page is measured with tracemalloc, which sees
+NumPy and OpenCV output arrays.
+"""
+
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+import pdf2image
+
+# Add the app directory to the path
+sys.path.insert(0, os.path.join(os.path.abspath(os.path.dirname(os.path.dirname(__file__))), 'app'))
+
+from ocr.processor import ReceiptProcessor
+
+
+def old_decode(processor, path):
+    if path.lower().endswith('.pdf'):
+        for page in pdf2image.convert_from_path(path, dpi=processor.dpi):
+            bgr = cv2.cvtColor(np.array(page), cv2.COLOR_RGB2BGR)
+            yield cv2.cvtColor(bgr, cv2.COLOR_BGR2GRAY)
+    else:
+        yield cv2.cvtColor(cv2.imread(path), cv2.COLOR_BGR2GRAY)
+
+
+def new_decode(processor, path):
+    if path.lower().endswith('.pdf'):
+        yield from processor.iter_pdf_pages(path)
+    else:
+        yield processor.load_image(path)
+
+
+def measure(decode, processor, path):
+    """Return (peak MiB, ms, shape) for each image or page of a file"""
+    results = []
+    pages = decode(processor, path)
+    while True:
+        tracemalloc.start()
+        start = time.perf_counter()
+        try:
+            gray = next(pages)
+        except StopIteration:
+            tracemalloc.stop()
+            break
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        results.append((peak / (1024 * 1024), elapsed * 1000, gray.shape))
+        del gray
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('files', nargs='+', help='Receipt images and PDFs to decode')
+    parser.add_argument('--text-height', type=int, default=30, help='Target glyph height in pixels')
+    args = parser.parse_args()
+
+    processor = ReceiptProcessor(ocr_cache=None, text_height=args.text_height)
+    for path in args.files:
+        for label, decode in (('before', old_decode), ('after', new_decode)):
+            for page, (peak, ms, shape) in enumerate(measure(decode, processor, path), start=1):
+                print(
+                    f"{os.path.basename(path):30} page={page:3d} {label:6} "
+                    f"peak={peak:8.1f} MiB time={ms:8.1f} ms size={shape[1]}x{shape[0]}"
+                )
+
+
+if __name__ == '__main__':
+    main()
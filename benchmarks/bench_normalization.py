@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+Measure the effect of resolution normalization on OCR latency and parse yield
+
+Usage:
+    python benchmarks/bench_normalization.py corpus/ [--text-height 30]
+
+Every image and PDF in the corpus directory is OCR'd twice, once at native
+size and once normalized to --text-height pixel glyphs. For each run the
+extracted text is parsed with the configured receipt processors; parse yield
+is the number of products found and the number of receipts with at least one
+product.
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+# Add the app directory to the path
+sys.path.insert(0, os.path.join(os.path.abspath(os.path.dirname(os.path.dirname(__file__))), 'app'))
+
+from ocr.processor import ReceiptProcessor
+
+RECEIPT_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.tif', '.tiff', '.pdf')
+
+
+def run(paths, text_height):
+    processor = ReceiptProcessor(ocr_cache=None, text_height=text_height)
+    timings = []
+    products = 0
+    parsed = 0
+    for path in paths:
+        start = time.perf_counter()
+        text = processor.extract_text(path)
+        timings.append(time.perf_counter() - start)
+        found = len(processor.parse_receipt(processor.pre_filter_text(text)))
+        products += found
+        parsed += 1 if found else 0
+    return timings, products, parsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('corpus', help='Directory of receipt images and PDFs')
+    parser.add_argument('--text-height', type=int, default=30, help='Target glyph height in pixels')
+    args = parser.parse_args()
+
+    paths = sorted(
+        os.path.join(args.corpus, name)
+        for name in os.listdir(args.corpus)
+        if name.lower().endswith(RECEIPT_EXTENSIONS)
+    )
+    if not paths:
+        sys.exit(f"No receipts found in {args.corpus}")
+
+    for label, text_height in (('native', 0), (f'{args.text_height}px', args.text_height)):
+        timings, products, parsed = run(paths, text_height)
+        print(
+            f"{label:8} receipts={len(paths):4d} "
+            f"median={statistics.median(timings) * 1000:8.1f} ms "
+            f"total={sum(timings):7.2f} s "
+            f"products={products:5d} "
+            f"parsed={parsed}/{len(paths)}"
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+Compare per-page OCR latency of the pytesseract and tesserocr engines
+
+Usage:
+    python benchmarks/bench_ocr_engines.py receipt1.jpg receipt2.png ... [--repeat 5]
+
+Each image is preprocessed once, then OCR'd --repeat times with each engine.
+The tesserocr pool is warmed before timing starts, the same way the RQ worker
+warms it at startup.
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+import cv2
+
+# Add the app directory to the path
+sys.path.insert(0, os.path.join(os.path.abspath(os.path.dirname(os.path.dirname(__file__))), 'app'))
+
+from ocr.processor import ReceiptProcessor, PytesseractEngine, TesserocrEnginePool, tesserocr
+
+
+def time_engine(engine, images, config, repeat):
+    timings = []
+    for img in images:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            engine.image_to_string(img, config)
+            timings.append(time.perf_counter() - start)
+    return timings
+
+
+def report(name, timings):
+    print(
+        f"{name:12} pages={len(timings):4d} "
+        f"median={statistics.median(timings) * 1000:8.1f} ms "
+        f"mean={statistics.mean(timings) * 1000:8.1f} ms "
+        f"max={max(timings) * 1000:8.1f} ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('images', nargs='+', help='Receipt images to OCR')
+    parser.add_argument('--repeat', type=int, default=3, help='OCR passes per image and engine')
+    args = parser.parse_args()
+
+    processor = ReceiptProcessor(ocr_cache=None)
+    config = processor.get_tesseract_config()
+    images = [processor.preprocess_image(cv2.imread(path)) for path in args.images]
+
+    report('pytesseract', time_engine(PytesseractEngine(), images, config, args.repeat))
+
+    if tesserocr is None:
+        print("tesserocr     not installed, skipping (pip install tesserocr)")
+        return
+
+    pool = TesserocrEnginePool()
+    start = time.perf_counter()
+    pool.warm(config)
+    print(f"tesserocr    warm-up={(time.perf_counter() - start) * 1000:.1f} ms (once per worker)")
+    report('tesserocr', time_engine(pool, images, config, args.repeat))
+
+
+if __name__ == '__main__':
+    main()
@@ -12,6 +12,10 @@ sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
 
 # Import test modules
 from tests.test_ocr_processor import TestOCRProcessor
+from tests.test_receipt_processor import TestReceiptProcessor
+from tests.test_ocr_cache import TestOCRCache
+from tests.test_processor_registry import TestProcessorRegistry
+from tests.test_line_normalizer import TestLineNormalizer
 from tests.test_grocy_client import TestGrocyClient
 from tests.test_web_app import TestWebApp
 from tests.test_api_routes import TestAPIRoutes
@@ -22,6 +26,10 @@ if __name__ == '__main__':
     
     # Add test cases
     test_suite.addTest(unittest.makeSuite(TestOCRProcessor))
+    test_suite.addTest(unittest.makeSuite(TestReceiptProcessor))
+    test_suite.addTest(unittest.makeSuite(TestOCRCache))
+    test_suite.addTest(unittest.makeSuite(TestProcessorRegistry))
+    test_suite.addTest(unittest.makeSuite(TestLineNormalizer))
     test_suite.addTest(unittest.makeSuite(TestGrocyClient))
     test_suite.addTest(unittest.makeSuite(TestWebApp))
     test_suite.addTest(unittest.makeSuite(TestAPIRoutes))
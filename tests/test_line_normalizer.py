@@ -0,0 +1,89 @@
+import unittest
+import os
+import re
+import sys
+import random
+
+# Add parent directory to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.ocr.normalizer import LineNormalizer
+
+
+def legacy_clean_line(line):
+    """ReceiptProcessor.clean_line before the rules were compiled"""
+    line = line.strip()
+    line = line.replace("€", "e")
+    line = line.replace("«", "")
+    line = line.replace("~", "-")
+    line = line.replace("(", "")
+    line = line.replace(")", "")
+    line = line.replace("¥", "Y")
+    line = line.replace("Wenber Savings", "Member Savings")
+    line = re.sub(r'\s§$', ' S', line)
+    line = re.sub(r'\s8$', ' S', line)
+    line = re.sub(r'\s\$$', r' S', line)
+    line = re.sub(r'(\d\d)8$', r'\1 S', line)
+    line = re.sub(r'(\d+)\,(\d{2})\s', r'\1.\2', line)
+    line = re.sub(r'(\d\.\d{2})(\d)', r'\1 \2', line)
+    line = re.sub(r'\s5$', ' S', line)
+    line = re.sub(r'\S{4}er S\Svings -', 'Member Savings -', line)
+    line = re.sub(r'Coup\Sn', 'Coupon', line)
+    line = re.sub(r'Stor\S', 'Store', line)
+    return line
+
+
+class TestLineNormalizer(unittest.TestCase):
+
+    def test_matches_legacy_clean_line(self):
+        """Test that the compiled rules give exactly the old output"""
+        normalizer = LineNormalizer()
+        lines = [
+            "  0001111 BANANAS (ORGANIC) 1,99 2,49 §  ",
+            "4011 APPLES 2.991 8",
+            "GALA APPLES 3.49 5",
+            "MILK 1GAL 3.498",
+            "EGGS 12CT 2,99 5",
+            "Wenber Savings -1.00",
+            "Mxmber Sxvings - 0.50",
+            "Coupxn Stor€ ~ 1.00 ¥ «",
+            "TOTAL $",
+            "",
+        ]
+        # Random lines built from the characters the rules look for
+        alphabet = "0123456789.,$§85S ()~«€¥CoupnStreMmbvigs-xW"
+        rng = random.Random(42)
+        lines += ["".join(rng.choice(alphabet) for _ in range(rng.randint(1, 30))) for _ in range(20000)]
+
+        for line in lines:
+            self.assertEqual(normalizer.normalize(line), legacy_clean_line(line), repr(line))
+
+    def test_extra_rules(self):
+        """Test that configured rules run after the defaults and bad rules are skipped"""
+        normalizer = LineNormalizer([
+            {'translate': {'|': 'I'}},
+            {'translate': {'0': 'O'}},
+            {'replace': 'Mi1k', 'with': 'Milk'},
+            {'pattern': r'(\d)O', 'replacement': r'\g<1>0', 'contains': 'O'},
+            {'pattern': '(unclosed', 'replacement': ''},
+            {'group': [
+                {'pattern': r'^BAL\b', 'replacement': 'BALANCE'},
+                {'pattern': r'\bTX$', 'replacement': 'TAX'},
+            ]},
+        ])
+
+        # The two translate tables merge into one step
+        self.assertEqual(len(normalizer.steps), 4)
+        self.assertEqual(normalizer.normalize(" |Mi1k 3O0 "), "IMilk 30O")
+        self.assertEqual(normalizer.normalize("BAL DUE TX"), "BALANCE DUE TAX")
+
+    def test_translate_tables_merge_only_when_safe(self):
+        """Test that chained single-character replacements keep their order"""
+        normalizer = LineNormalizer([{'translate': {'a': 'b'}}, {'translate': {'b': 'c'}}])
+
+        self.assertEqual(len(normalizer.steps), 2)
+        self.assertEqual(normalizer.normalize("ab"), "cc")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+import unittest
+import os
+import sys
+import tempfile
+import numpy as np
+from unittest.mock import patch
+
+# Add parent directory to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.ocr.cache import OCRCache, DiskCacheBackend, ImageCache, get_ocr_cache
+
+
+class TestOCRCache(unittest.TestCase):
+
+    def setUp(self):
+        # Create a temporary directory for cache entries and receipts
+        self.test_dir = tempfile.TemporaryDirectory()
+        self.cache_dir = os.path.join(self.test_dir.name, 'cache')
+        self.receipt_path = os.path.join(self.test_dir.name, 'receipt.jpg')
+        with open(self.receipt_path, 'wb') as f:
+            f.write(b'fake image data')
+
+    def tearDown(self):
+        # Clean up temporary directory
+        self.test_dir.cleanup()
+
+    def test_make_key_depends_on_content_and_settings(self):
+        """Test that keys change with file bytes and OCR settings, not file name"""
+        cache = OCRCache(DiskCacheBackend(self.cache_dir, 1024))
+        copy_path = os.path.join(self.test_dir.name, 'copy.jpg')
+        with open(copy_path, 'wb') as f:
+            f.write(b'fake image data')
+
+        key = cache.make_key(self.receipt_path, {'tesseract_config': '--psm 6'})
+
+        self.assertEqual(key, cache.make_key(copy_path, {'tesseract_config': '--psm 6'}))
+        self.assertNotEqual(key, cache.make_key(self.receipt_path, {'tesseract_config': '--psm 4'}))
+
+    def test_get_set_counts_hits_and_misses(self):
+        """Test round trip through the disk backend and hit/miss counters"""
+        cache = OCRCache(DiskCacheBackend(self.cache_dir, 1024))
+
+        self.assertIsNone(cache.get('abc'))
+        cache.set('abc', 'SAFEWAY\nApples 2.99')
+
+        self.assertEqual(cache.get('abc'), 'SAFEWAY\nApples 2.99')
+        self.assertEqual(cache.stats(), {'hits': 1, 'misses': 1, 'bytes': 48})
+
+        # Counters are shared with every backend on the same directory,
+        # such as the one unpickled by each queued job
+        other = OCRCache(DiskCacheBackend(self.cache_dir, 1024))
+        other.get('abc')
+        self.assertEqual(cache.stats(), {'hits': 2, 'misses': 1, 'bytes': 48})
+
+        # Metadata is stored and returned with the text
+        cache.set('pages', 'SAFEWAY', {'pages': [{'lines': []}]})
+        self.assertEqual(cache.get_entry('pages'), ('SAFEWAY', {'pages': [{'lines': []}]}))
+
+    def test_disk_backend_evicts_least_recently_used(self):
+        """Test that the oldest accessed entries are dropped over the size cap"""
+        backend = DiskCacheBackend(self.cache_dir, 25)
+        backend.set('first', b'x' * 10)
+        backend.set('second', b'x' * 10)
+        os.utime(os.path.join(self.cache_dir, 'first'), (1, 1))
+        os.utime(os.path.join(self.cache_dir, 'second'), (2, 2))
+
+        # Reading 'first' makes 'second' the least recently used
+        backend.get('first')
+        backend.set('third', b'x' * 10)
+
+        self.assertIsNotNone(backend.get('first'))
+        self.assertIsNone(backend.get('second'))
+        self.assertIsNotNone(backend.get('third'))
+
+    @patch.dict(os.environ, {'OCR_CACHE_BACKEND': 'none'})
+    def test_get_ocr_cache_disabled(self):
+        """Test that caching can be turned off from the environment"""
+        self.assertIsNone(get_ocr_cache())
+
+    def test_image_cache_round_trip_is_memory_mapped(self):
+        """Test that cached images come back read-only and memory-mapped"""
+        cache = ImageCache(self.cache_dir, 1024 * 1024, ttl=60)
+        gray = np.arange(200, dtype=np.uint8).reshape(10, 20)
+
+        self.assertIsNone(cache.get('page'))
+        cache.set('page', gray, gray > 100, {'skew_angle': 1.5})
+        cached_gray, cached_binary, metadata = cache.get('page')
+
+        self.assertIsInstance(cached_gray, np.memmap)
+        self.assertFalse(cached_gray.flags.writeable)
+        np.testing.assert_array_equal(cached_gray, gray)
+        np.testing.assert_array_equal(cached_binary, gray > 100)
+        self.assertEqual(metadata, {'skew_angle': 1.5})
+
+    def test_image_cache_expires_and_evicts(self):
+        """Test that entries expire after the TTL and the oldest go over the size cap"""
+        cache = ImageCache(self.cache_dir, 1024 * 1024, ttl=60)
+        page = np.zeros((10, 10), dtype=np.uint8)
+        cache.set('old', page, page, {})
+        os.utime(os.path.join(self.cache_dir, 'old', 'metadata.json'), (1, 1))
+        self.assertIsNone(cache.get('old'))
+
+        # Each entry is two 228 byte .npy files and a small metadata file
+        cache = ImageCache(self.cache_dir, 1000, ttl=60)
+        cache.set('first', page, page, {})
+        cache.set('second', page, page, {})
+        os.utime(os.path.join(self.cache_dir, 'first'), (1, 1))
+        cache.set('third', page, page, {})
+
+        self.assertIsNone(cache.get('first'))
+        self.assertIsNotNone(cache.get('second'))
+        self.assertIsNotNone(cache.get('third'))
+
+
+if __name__ == '__main__':
+    unittest.main()
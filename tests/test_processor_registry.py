@@ -0,0 +1,154 @@
+import unittest
+import os
+import sys
+import json
+import random
+import tempfile
+from unittest.mock import patch
+
+# Add parent directory to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.ocr.registry import ProcessorRegistry, StoreMatcher, CategoryIndex
+
+
+class TestProcessorRegistry(unittest.TestCase):
+
+    def setUp(self):
+        # Create a temporary config directory
+        self.test_dir = tempfile.TemporaryDirectory()
+        self.custom_path = os.path.join(self.test_dir.name, 'receipt_processors.json')
+        self.default_path = os.path.join(self.test_dir.name, 'receipt_processors_default.json')
+        self.categories_path = os.path.join(self.test_dir.name, 'category_mappings.json')
+        self.write(self.default_path, [
+            {'name': 'Safeway', 'search_string': 'SAFEWAY', 'processors': [r'^(?P<title>.*)\s+(?P<price>\d+\.\d{2})$']},
+        ])
+        self.write(self.categories_path, {'Safeway': {'PRODUCE': 'Fruits & Vegetables'}})
+
+    def tearDown(self):
+        # Clean up temporary directory
+        self.test_dir.cleanup()
+
+    def write(self, path, value, mtime=None):
+        with open(path, 'w') as f:
+            f.write(value if isinstance(value, str) else json.dumps(value))
+        if mtime is not None:
+            os.utime(path, (mtime, mtime))
+
+    def make_registry(self, check_interval=0):
+        return ProcessorRegistry(self.custom_path, self.default_path, self.categories_path, check_interval)
+
+    def test_loads_and_compiles_once(self):
+        """Test that files are read once and patterns come precompiled"""
+        registry = self.make_registry(check_interval=60)
+
+        self.assertEqual(registry.custom_processors(), [])
+        self.assertEqual([store['name'] for store in registry.default_processors()], ['Safeway'])
+        self.assertEqual(registry.category_mappings('Safeway'), {'PRODUCE': 'Fruits & Vegetables'})
+        self.assertEqual(registry.category_mappings('Kroger'), {})
+
+        pattern = registry.default_processors()[0]['processors'][0]
+        with patch('builtins.open') as mock_open, patch('os.stat') as mock_stat:
+            compiled = registry.compile(pattern)
+            registry.default_processors()
+        mock_open.assert_not_called()
+        mock_stat.assert_not_called()
+        self.assertIs(compiled, registry.compile(pattern))
+        self.assertEqual(compiled.match('BANANAS 1.49').group('price'), '1.49')
+
+    def test_reloads_when_file_changes(self):
+        """Test that a changed mtime swaps in the new config"""
+        registry = self.make_registry()
+        snapshot = registry.current()
+
+        self.assertIs(registry.current(), snapshot)
+
+        self.write(self.custom_path, [{'name': 'Corner Shop', 'processors': [r'^(?P<title>\w+) (?P<price>\d+\.\d{2})$']}], mtime=1)
+        self.assertIsNot(registry.current(), snapshot)
+        self.assertEqual([store['name'] for store in registry.custom_processors()], ['Corner Shop'])
+
+    def test_invalid_config_is_skipped(self):
+        """Test that bad patterns and stores are dropped and unreadable files keep the last version"""
+        self.write(self.custom_path, [
+            {'name': 'Corner Shop', 'processors': ['(?P<title>unclosed', r'^(?P<title>\w+) (?P<price>\d+\.\d{2})$']},
+            {'processors': ['.*']},
+        ], mtime=1)
+        registry = self.make_registry()
+
+        self.assertEqual(registry.custom_processors(), [
+            {'name': 'Corner Shop', 'processors': [r'^(?P<title>\w+) (?P<price>\d+\.\d{2})$']},
+        ])
+
+        # A half-written file keeps the previous stores
+        self.write(self.custom_path, '[{"name": "Corner', mtime=2)
+        self.assertEqual([store['name'] for store in registry.custom_processors()], ['Corner Shop'])
+
+    def test_store_matcher_scores_by_position(self):
+        """Test that overlapping search strings are all found and the earliest wins"""
+        matcher = StoreMatcher([
+            {'name': 'Safeway', 'search_string': 'SAFEWAY'},
+            {'name': 'Safeway Fuel', 'search_string': 'safeway fuel'},
+            {'name': 'Albertsons'},
+            {'name': 'Costco'},
+        ], header_lines=3)
+        text = "ALBERTSONS\nStore 123\nSafeway Fuel rewards\nBANANAS 1.49"
+
+        candidates = matcher.candidates(text)
+
+        self.assertEqual([c['store']['name'] for c in candidates], ['Albertsons', 'Safeway Fuel', 'Safeway'])
+        self.assertEqual(candidates[0]['score'], 1.0)
+        self.assertEqual(candidates[1]['position'], candidates[2]['position'])
+
+        # Stores only named below the header are found in the full text
+        candidates = matcher.candidates("RECEIPT\n\n\n\nThank you for shopping at Costco")
+        self.assertEqual([c['store']['name'] for c in candidates], ['Costco'])
+        self.assertEqual(matcher.candidates("CORNER SHOP"), [])
+
+    def test_store_matcher_with_shipped_default_config(self):
+        """Test that the catch-all store only wins when no named store is found"""
+        default_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'config', 'receipt_processors_default.json')
+        registry = ProcessorRegistry(self.custom_path, default_path, self.categories_path, 60)
+        stores = registry.default_processors()
+        matcher = registry.store_matcher(stores)
+
+        def detect(text):
+            return matcher.candidates(text)[0]['store']['name']
+
+        self.assertEqual(detect("Welcome to Safeway\nBANANAS 1.49"), 'Safeway')
+        self.assertEqual(detect("~~ logo ~~\nSAFEWAY\nBANANAS 1.49"), 'Safeway')
+        self.assertEqual(detect("  COSTCO WHOLESALE\nBANANAS 1.49"), 'Costco')
+        # Stores named below the header are still found in the full text
+        self.assertEqual(detect("RECEIPT\n" + "\n" * 12 + "Thank you for shopping at Winco"), 'Winco')
+        self.assertEqual(matcher.candidates("CORNER SHOP\nBANANAS 1.49"), [{'store': stores[-1], 'position': None, 'score': 0.0}])
+        self.assertEqual(detect("CORNER SHOP"), 'Unknown')
+
+    def test_category_index_matches_ordered_prefix_scan(self):
+        """Test that the trie gives the same category as scanning the mapping in order"""
+        def scan(mapping, line):
+            if mapping.get(line) is not None:
+                return True, mapping.get(line)
+            for key, value in mapping.items():
+                if line.startswith(key):
+                    return True, value
+            return False, None
+
+        mapping = {'PRODUCE': 'Fruits', 'PROD': 'Short', 'DAIRY': None, 'DAIRY CASE': 'Dairy', 'MEAT': 'Meat'}
+        index = CategoryIndex(mapping)
+        self.assertEqual(index.match('PRODUCE'), (True, 'Fruits'))
+        self.assertEqual(index.match('PRODUCE 2'), (True, 'Fruits'))
+        self.assertEqual(index.match('PRODUCTS'), (True, 'Short'))
+        self.assertEqual(index.match('DAIRY CASE 4'), (True, None))
+        self.assertEqual(index.match('BANANAS 1.49'), (False, None))
+        self.assertEqual(CategoryIndex({'': 'Any'}).match('BANANAS'), (True, 'Any'))
+
+        rng = random.Random(7)
+        for _ in range(200):
+            mapping = {''.join(rng.choice('ABC') for _ in range(rng.randint(1, 4))): rng.choice(['x', 'y', None]) for _ in range(8)}
+            index = CategoryIndex(mapping)
+            for _ in range(50):
+                line = ''.join(rng.choice('ABC ') for _ in range(rng.randint(0, 6)))
+                self.assertEqual(index.match(line), scan(mapping, line), (mapping, line))
+
+
+if __name__ == '__main__':
+    unittest.main()
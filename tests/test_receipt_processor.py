@@ -0,0 +1,985 @@
+import unittest
+import os
+import re
+import sys
+import tempfile
+import time
+from unittest.mock import patch, MagicMock
+import numpy as np
+import cv2
+import pytesseract
+from PIL import Image
+
+# Add parent directory to path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.ocr.processor import ReceiptProcessor, PytesseractEngine, TesserocrEnginePool, get_ocr_engine, init_ocr_engine
+from app.ocr.cache import OCRCache, DiskCacheBackend, ImageCache
+
+
+def make_ocr_data(lines, conf=95.0):
+    """Build pytesseract image_to_data output with one entry per word"""
+    data = {column: [] for column in ('page_num', 'block_num', 'par_num', 'line_num', 'left', 'top', 'width', 'height', 'conf', 'text')}
+    for line_num, line in enumerate(lines, start=1):
+        for word_num, word in enumerate(line.split()):
+            row = {
+                'page_num': 1, 'block_num': 1, 'par_num': 1, 'line_num': line_num,
+                'left': 10 + 50 * word_num, 'top': 20 * line_num, 'width': 40, 'height': 15,
+                'conf': conf, 'text': word,
+            }
+            for column, value in row.items():
+                data[column].append(value)
+    return data
+
+
+def fake_image_to_data(img, config=None, output_type=None):
+    """Return OCR data that identifies the page by its size"""
+    return make_ocr_data([f"page {img.shape[0]}x{img.shape[1]}"])
+
+
+class TestReceiptProcessor(unittest.TestCase):
+
+    def setUp(self):
+        # Create a temporary directory for test files
+        self.test_dir = tempfile.TemporaryDirectory()
+
+        # Preprocessed images are only cached, and orientation only detected,
+        # by tests that ask for it
+        env = patch.dict(os.environ, {'OCR_IMAGE_CACHE': 'False', 'OCR_ORIENTATION': 'False'})
+        env.start()
+        self.addCleanup(env.stop)
+        self.test_pdf_path = os.path.join(self.test_dir.name, 'test_receipt.pdf')
+
+        # Pages of different heights so each one OCRs to a distinct string
+        self.pages = [
+            Image.fromarray(np.full((40 + 10 * i, 30), 255, dtype=np.uint8))
+            for i in range(5)
+        ]
+
+    def tearDown(self):
+        # Clean up temporary directory
+        self.test_dir.cleanup()
+
+    def fake_convert_from_path(self, filepath, dpi=200, first_page=None, last_page=None, grayscale=False):
+        """Rasterize the requested window of the fake PDF"""
+        return self.pages[first_page - 1:last_page]
+
+    @patch('pytesseract.image_to_data', side_effect=fake_image_to_data)
+    @patch('pdf2image.pdfinfo_from_path', return_value={'Pages': 5})
+    @patch('pdf2image.convert_from_path')
+    def test_extract_text_pdf_parallel_matches_serial(self, mock_convert_from_path, mock_pdfinfo, mock_image_to_data):
+        """Test that the process pool returns pages in the same order as the serial path"""
+        mock_convert_from_path.side_effect = self.fake_convert_from_path
+
+        serial = ReceiptProcessor(page_workers=1).extract_text(self.test_pdf_path)
+        parallel = ReceiptProcessor(page_workers=3).extract_text(self.test_pdf_path)
+
+        self.assertEqual(parallel, serial)
+        self.assertEqual(
+            serial,
+            "".join(f"page {40 + 10 * i}x30\n\n" for i in range(5))
+        )
+
+    @patch('app.ocr.processor.ProcessPoolExecutor')
+    @patch('pytesseract.image_to_data', side_effect=fake_image_to_data)
+    @patch('pdf2image.pdfinfo_from_path', return_value={'Pages': 5})
+    @patch('pdf2image.convert_from_path')
+    def test_ocr_pdf_pages_single_worker_skips_pool(self, mock_convert_from_path, mock_pdfinfo, mock_image_to_data, mock_executor):
+        """Test that one worker (the default) never starts a process pool"""
+        mock_convert_from_path.side_effect = self.fake_convert_from_path
+        processor = ReceiptProcessor(page_workers=1)
+
+        result = list(processor.ocr_pdf_pages(self.test_pdf_path, '--psm 6'))
+
+        mock_executor.assert_not_called()
+        self.assertEqual(len(result), 5)
+
+    @patch('pytesseract.image_to_data', side_effect=fake_image_to_data)
+    @patch('pdf2image.pdfinfo_from_bytes', return_value={'Pages': 5})
+    @patch('pdf2image.convert_from_bytes')
+    def test_extract_text_pdf_from_memory(self, mock_convert_from_bytes, mock_pdfinfo, mock_image_to_data):
+        """Test that in-memory PDFs are rasterized from the buffer, not the path"""
+        mock_convert_from_bytes.side_effect = self.fake_convert_from_path
+        processor = ReceiptProcessor(ocr_cache=None, text_height=0)
+
+        text = processor.extract_text(self.test_pdf_path, data=b'%PDF-1.4')
+
+        self.assertEqual(text, "".join(f"page {40 + 10 * i}x30\n\n" for i in range(5)))
+        self.assertEqual(mock_convert_from_bytes.call_args.args[0], b'%PDF-1.4')
+        self.assertFalse(os.path.exists(self.test_pdf_path))
+
+    @patch('pdf2image.convert_from_path')
+    @patch('app.ocr.processor.subprocess.run')
+    def test_extract_text_pdf_uses_text_layer(self, mock_run, mock_convert_from_path):
+        """Test that digital PDFs are read from their text layer without rasterizing"""
+        mock_run.return_value = MagicMock(stdout=b"SAFEWAY STORE 1234\n  APPLES     2.99\n\fBANANAS 1.49   TOTAL 4.48\n\f")
+        processor = ReceiptProcessor(ocr_cache=None)
+
+        text = processor.extract_text(self.test_pdf_path)
+
+        self.assertEqual(text, "SAFEWAY STORE 1234\n  APPLES     2.99\n\nBANANAS 1.49   TOTAL 4.48\n\n")
+        self.assertEqual(mock_run.call_args.args[0][:2], ['pdftotext', '-layout'])
+        mock_convert_from_path.assert_not_called()
+        self.assertEqual(processor.ocr_metadata['text_source'], 'text_layer')
+
+    @patch('pytesseract.image_to_data', side_effect=fake_image_to_data)
+    @patch('pdf2image.convert_from_path')
+    @patch('app.ocr.processor.subprocess.run')
+    def test_extract_text_pdf_ocrs_pages_without_text(self, mock_run, mock_convert_from_path, mock_image_to_data):
+        """Test that only pages without embedded text are OCR'd, in page order"""
+        mock_run.return_value = MagicMock(stdout=b"SAFEWAY STORE 1234 APPLES 2.99\f\n  2\n\fBANANAS 1.49   TOTAL 4.48\n\f")
+        mock_convert_from_path.side_effect = self.fake_convert_from_path
+        processor = ReceiptProcessor(ocr_cache=None, text_height=0)
+
+        text = processor.extract_text(self.test_pdf_path)
+
+        self.assertEqual(text, "SAFEWAY STORE 1234 APPLES 2.99\n\npage 50x30\n\nBANANAS 1.49   TOTAL 4.48\n\n")
+        mock_convert_from_path.assert_called_once()
+        self.assertEqual(mock_convert_from_path.call_args.kwargs['first_page'], 2)
+        self.assertEqual([page['source'] for page in processor.ocr_metadata['pages']], ['text_layer', 'ocr', 'text_layer'])
+        self.assertEqual(processor.ocr_metadata['text_source'], 'mixed')
+
+    @patch('pytesseract.image_to_data', side_effect=fake_image_to_data)
+    @patch('pdf2image.pdfinfo_from_path', return_value={'Pages': 2})
+    @patch('pdf2image.convert_from_path')
+    @patch('app.ocr.processor.subprocess.run', side_effect=FileNotFoundError('pdftotext'))
+    def test_extract_text_pdf_without_pdftotext(self, mock_run, mock_convert_from_path, mock_pdfinfo, mock_image_to_data):
+        """Test that every page is OCR'd when the text layer can't be read"""
+        mock_convert_from_path.side_effect = self.fake_convert_from_path
+        processor = ReceiptProcessor(ocr_cache=None, text_height=0)
+
+        text = processor.extract_text(self.test_pdf_path)
+
+        self.assertEqual(text, "page 40x30\n\npage 50x30\n\n")
+        self.assertEqual(processor.ocr_metadata['text_source'], 'ocr')
+
+    @patch('pytesseract.image_to_data', side_effect=fake_image_to_data)
+    def test_process_receipt_from_memory(self, mock_image_to_data):
+        """Test that an uploaded image is decoded from memory before it is saved"""
+        processor = ReceiptProcessor(ocr_cache=None, auto_crop=False, deskew=False, text_height=0)
+        image_path = os.path.join(self.test_dir.name, 'receipt.png')
+        _, encoded = cv2.imencode('.png', np.full((60, 40, 3), 255, dtype=np.uint8))
+
+        txt_path = processor.process_receipt(image_path, data=encoded.tobytes())
+
+        self.assertFalse(os.path.exists(image_path))
+        with open(txt_path) as f:
+            self.assertEqual(f.read(), "page 60x40")
+
+    @patch('pytesseract.image_to_data', side_effect=fake_image_to_data)
+    @patch('pdf2image.pdfinfo_from_path', return_value={'Pages': 5})
+    @patch('pdf2image.convert_from_path')
+    def test_pdf_pages_are_rasterized_lazily(self, mock_convert_from_path, mock_pdfinfo, mock_image_to_data):
+        """Test that pages are rendered to grayscale one window at a time"""
+        mock_convert_from_path.side_effect = self.fake_convert_from_path
+        processor = ReceiptProcessor(page_workers=1, dpi=150, page_window=2)
+
+        pages = processor.iter_pdf_pages(self.test_pdf_path)
+        next(pages)
+
+        mock_convert_from_path.assert_called_once_with(
+            self.test_pdf_path, dpi=150, first_page=1, last_page=2, grayscale=True
+        )
+
+        self.assertEqual(len(list(pages)), 4)
+        windows = [(c.kwargs['first_page'], c.kwargs['last_page']) for c in mock_convert_from_path.call_args_list]
+        self.assertEqual(windows, [(1, 2), (3, 4), (5, 5)])
+
+    @patch('pytesseract.image_to_data', side_effect=fake_image_to_data)
+    @patch('pdf2image.pdfinfo_from_path', return_value={'Pages': 5})
+    @patch('pdf2image.convert_from_path')
+    @patch('app.ocr.processor.subprocess.run', side_effect=FileNotFoundError('pdftotext'))
+    def test_pdf_pages_are_windowed_with_image_cache(self, mock_run, mock_convert_from_path, mock_pdfinfo, mock_image_to_data):
+        """Test that image-cached OCR rasterizes a window at a time and skips cached pages"""
+        mock_convert_from_path.side_effect = self.fake_convert_from_path
+        with open(self.test_pdf_path, 'wb') as f:
+            f.write(b'%PDF-1.4')
+        image_cache = ImageCache(os.path.join(self.test_dir.name, 'images'), 1024 * 1024, ttl=60)
+        processor = ReceiptProcessor(ocr_cache=None, image_cache=image_cache, page_window=2, text_height=0)
+
+        text = processor.extract_text(self.test_pdf_path)
+
+        self.assertEqual(text, "".join(f"page {40 + 10 * i}x30\n\n" for i in range(5)))
+        windows = [(c.kwargs['first_page'], c.kwargs['last_page']) for c in mock_convert_from_path.call_args_list]
+        self.assertEqual(windows, [(1, 2), (3, 4), (5, 5)])
+
+        mock_convert_from_path.reset_mock()
+        self.assertEqual(processor.extract_text(self.test_pdf_path), text)
+        mock_convert_from_path.assert_not_called()
+
+    @patch.dict(os.environ, {'OCR_PAGE_WORKERS': '4', 'OCR_DPI': '300', 'OCR_PDF_PAGE_WINDOW': '2'})
+    def test_settings_from_environment(self):
+        """Test that page workers, DPI and page window default to the environment"""
+        processor = ReceiptProcessor()
+        self.assertEqual(processor.page_workers, 4)
+        self.assertEqual(processor.dpi, 300)
+        self.assertEqual(processor.page_window, 2)
+        self.assertEqual(ReceiptProcessor(page_workers=0).page_workers, 1)
+
+    @patch('app.ocr.processor.ReceiptProcessor.save_job_metadata')
+    @patch('app.ocr.processor.ReceiptProcessor.extract_text')
+    def test_process_receipt_reuses_cached_text(self, mock_extract_text, mock_save_job_metadata):
+        """Test that a repeat upload of the same file skips OCR and keeps its page metadata"""
+        cache = OCRCache(DiskCacheBackend(os.path.join(self.test_dir.name, 'cache'), 1024 * 1024))
+        processor = ReceiptProcessor(ocr_cache=cache)
+        pages = [{'crop_box': [0, 0, 40, 60], 'lines': [{'box': [1, 2, 30, 10], 'text': 'SAFEWAY', 'conf': 91.0}]}]
+
+        def fake_extract_text(filepath, data=None):
+            processor.ocr_metadata['pages'] = pages
+            return "SAFEWAY\nApples 2.99"
+        mock_extract_text.side_effect = fake_extract_text
+        image_path = os.path.join(self.test_dir.name, 'receipt.jpg')
+        with open(image_path, 'wb') as f:
+            f.write(b'fake image data')
+
+        first = processor.process_receipt(image_path)
+        second = processor.process_receipt(image_path, os.path.join(self.test_dir.name, 'again.txt'))
+
+        mock_extract_text.assert_called_once_with(image_path, None)
+        with open(first) as f1, open(second) as f2:
+            self.assertEqual(f1.read(), f2.read())
+        self.assertEqual(cache.stats()['hits'], 1)
+        # The hit restores the line positions re-OCR needs
+        metadata = mock_save_job_metadata.call_args.args[0]
+        self.assertEqual(metadata['ocr_cache'], 'hit')
+        self.assertEqual(metadata['pages'], pages)
+
+    @patch('app.ocr.processor.tesserocr', None)
+    @patch('app.ocr.processor._ocr_engine', None)
+    def test_get_ocr_engine_falls_back_to_pytesseract(self):
+        """Test that pytesseract is used when tesserocr is not installed"""
+        self.assertIsInstance(get_ocr_engine(), PytesseractEngine)
+
+    @patch('app.ocr.processor.tesserocr')
+    def test_tesserocr_pool_reuses_warm_instances(self, mock_tesserocr):
+        """Test that tesseract instances are loaded once per config and reused"""
+        api = mock_tesserocr.PyTessBaseAPI.return_value
+        api.GetUTF8Text.return_value = "SAFEWAY"
+        pool = TesserocrEnginePool(size=1)
+        img = np.full((20, 20), 255, dtype=np.uint8)
+
+        for _ in range(3):
+            self.assertEqual(pool.image_to_string(img, '--psm 6 --user-words /config/ocr_dict.txt'), "SAFEWAY")
+
+        mock_tesserocr.PyTessBaseAPI.assert_called_once_with(init=False)
+        api.InitFull.assert_called_once_with(lang='eng', variables={'user_words_file': '/config/ocr_dict.txt'})
+        mock_tesserocr.PSM.assert_called_once_with(6)
+        self.assertEqual(api.SetImage.call_count, 3)
+
+    @patch('app.ocr.processor.tesserocr')
+    def test_init_ocr_engine_warms_every_job_config(self, mock_tesserocr):
+        """Test that worker start loads the line, orientation and profile configs jobs use"""
+        processor = ReceiptProcessor(ocr_cache=None, adaptive=True, orientation=True)
+
+        configs = processor.get_warm_configs()
+
+        self.assertEqual(processor.profile, processor.default_profile)
+        self.assertIn(processor.get_tesseract_config(), configs)
+        self.assertIn(processor.get_line_config(processor.get_tesseract_config()), configs)
+        self.assertIn('--psm 0', configs)
+        self.assertTrue(any('--psm 4' in config for config in configs))
+        self.assertTrue(any('--oem 1' in config for config in configs))
+        self.assertEqual(len(configs), len(set(configs)))
+
+        pool = TesserocrEnginePool(size=1)
+        with patch('app.ocr.processor._ocr_engine', pool), patch.object(ReceiptProcessor, 'get_warm_configs', return_value=configs):
+            init_ocr_engine()
+        self.assertEqual(list(pool.pools), configs)
+
+    @patch('pytesseract.image_to_string', return_value="fallback text")
+    @patch('app.ocr.processor.tesserocr')
+    def test_tesserocr_pool_falls_back_when_load_fails(self, mock_tesserocr, mock_image_to_string):
+        """Test that a config tesserocr cannot load is served by pytesseract"""
+        mock_tesserocr.PyTessBaseAPI.return_value.InitFull.side_effect = RuntimeError("no tessdata")
+        pool = TesserocrEnginePool(size=1)
+        img = np.full((20, 20), 255, dtype=np.uint8)
+
+        self.assertEqual(pool.image_to_string(img, '--psm 6'), "fallback text")
+        self.assertEqual(pool.image_to_string(img, '--psm 6'), "fallback text")
+        mock_tesserocr.PyTessBaseAPI.assert_called_once()
+
+    def _create_receipt_photo(self):
+        """Create a dark countertop photo with a bright receipt in it"""
+        img = np.full((1200, 900), 60, dtype=np.uint8)
+        img[200:1000, 300:600] = 240
+        for row in range(260, 960, 40):
+            cv2.putText(img, 'APPLES 2.99', (320, row), cv2.FONT_HERSHEY_SIMPLEX, 0.6, 0, 1)
+        return img
+
+    def test_find_receipt_region(self):
+        """Test that the paper is found and frame-filling images are left alone"""
+        processor = ReceiptProcessor(ocr_cache=None)
+
+        x, y, w, h = processor.find_receipt_region(self._create_receipt_photo())
+
+        self.assertAlmostEqual(x, 300, delta=25)
+        self.assertAlmostEqual(y, 200, delta=25)
+        self.assertAlmostEqual(w, 300, delta=50)
+        self.assertAlmostEqual(h, 800, delta=50)
+        self.assertIsNone(processor.find_receipt_region(np.full((400, 300), 240, dtype=np.uint8)))
+
+    def _create_two_receipt_scan(self):
+        """Create a flatbed scan with two receipts side by side on a dark lid"""
+        img = np.full((1200, 1400), 40, dtype=np.uint8)
+        for left in (150, 800):
+            img[150:1050, left:left + 450] = 240
+            for row in range(210, 1000, 40):
+                cv2.putText(img, 'APPLES 2.99', (left + 20, row), cv2.FONT_HERSHEY_SIMPLEX, 0.6, 0, 1)
+        return img
+
+    def test_find_receipt_regions(self):
+        """Test that every receipt on a scan is found, left to right"""
+        processor = ReceiptProcessor(ocr_cache=None)
+
+        boxes = processor.find_receipt_regions(self._create_two_receipt_scan())
+
+        self.assertEqual(len(boxes), 2)
+        for (x, y, w, h), left in zip(boxes, (150, 800)):
+            self.assertAlmostEqual(x, left, delta=25)
+            self.assertAlmostEqual(y, 150, delta=25)
+            self.assertAlmostEqual(w, 450, delta=50)
+            self.assertAlmostEqual(h, 900, delta=50)
+        self.assertEqual(len(processor.find_receipt_regions(self._create_receipt_photo())), 1)
+
+    def test_process_receipt_splits_scan_into_receipts(self):
+        """Test that each receipt on a scan gets its own text, store and products"""
+        processor = ReceiptProcessor(ocr_cache=None, text_height=0, split_receipts=True)
+        scan_path = os.path.join(self.test_dir.name, 'scan.png')
+        cv2.imwrite(scan_path, self._create_two_receipt_scan())
+        texts = {
+            'scan_receipt1.png': "CORNER SHOP\nAPPLES 2.99",
+            'scan_receipt2.png': "FARM STAND\nEGGS 3.49\nMILK 1.99",
+        }
+        processor.extract_text = lambda filepath, data=None: texts[os.path.basename(filepath)]
+        processor.get_custom_receipt_processors = lambda: []
+        processor.get_default_receipt_processors = lambda: [
+            {'name': 'Corner Shop', 'processors': [r'^(?P<title>[A-Z ]+)\s+(?P<price>\d+\.\d{2})$']},
+            {'name': 'Farm Stand', 'processors': [r'^(?P<title>[A-Z ]+)\s+(?P<price>\d+\.\d{2})$']},
+        ]
+
+        receipts = processor.process_receipt(scan_path)
+
+        self.assertEqual([receipt['store'] for receipt in receipts], ['Corner Shop', 'Farm Stand'])
+        self.assertEqual([len(receipt['products']) for receipt in receipts], [1, 2])
+        for receipt in receipts:
+            self.assertTrue(os.path.exists(receipt['filepath']))
+            self.assertEqual(cv2.imread(receipt['filepath'], cv2.IMREAD_GRAYSCALE).shape, (receipt['box'][3], receipt['box'][2]))
+            with open(receipt['txt_path']) as f:
+                self.assertEqual(f.read(), texts[os.path.basename(receipt['filepath'])])
+
+    @patch('app.ocr.processor.Queue')
+    @patch('app.ocr.processor.get_current_job')
+    def test_process_receipt_queues_job_per_receipt(self, mock_get_current_job, mock_queue):
+        """Test that inside an RQ job each receipt is queued as its own job"""
+        job = MagicMock()
+        job.meta = {}
+        mock_get_current_job.return_value = job
+        mock_queue.return_value.enqueue.side_effect = [MagicMock(id='job-1'), MagicMock(id='job-2')]
+        processor = ReceiptProcessor(ocr_cache=None, text_height=0)
+        scan_path = os.path.join(self.test_dir.name, 'scan.png')
+        cv2.imwrite(scan_path, self._create_two_receipt_scan())
+
+        receipts = processor.process_receipt(scan_path, store='Safeway', split=True)
+
+        self.assertEqual([receipt['job_id'] for receipt in receipts], ['job-1', 'job-2'])
+        self.assertEqual(job.meta['receipts'], receipts)
+        first_call = mock_queue.return_value.enqueue.call_args_list[0]
+        self.assertEqual(first_call.args[1], os.path.join(self.test_dir.name, 'scan_receipt1.png'))
+        self.assertEqual(first_call.kwargs, {'store': 'Safeway', 'profile': None, 'split': False})
+
+    @patch('pytesseract.image_to_data', side_effect=fake_image_to_data)
+    def test_ocr_page_crops_and_records_metadata(self, mock_image_to_data):
+        """Test that OCR sees only the receipt and the crop is reported"""
+        processor = ReceiptProcessor(ocr_cache=None, auto_crop=True, text_height=0)
+
+        text, metadata = processor.ocr_page(self._create_receipt_photo(), '--psm 6')
+
+        x, y, w, h = metadata['crop_box']
+        self.assertEqual(text, f"page {h}x{w}")
+        self.assertEqual(metadata['pixels_before'], 1200 * 900)
+        self.assertEqual(metadata['pixels_after'], w * h)
+        self.assertGreater(metadata['pixel_reduction'], 0.6)
+        self.assertIn('estimated_ocr_ms_saved', metadata)
+
+    @patch('app.ocr.processor.get_current_job')
+    @patch('app.ocr.processor.ReceiptProcessor.extract_text', return_value="SAFEWAY")
+    def test_process_receipt_saves_job_metadata(self, mock_extract_text, mock_get_current_job):
+        """Test that OCR metadata is stored on the running RQ job"""
+        job = MagicMock()
+        job.meta = {}
+        mock_get_current_job.return_value = job
+        processor = ReceiptProcessor(ocr_cache=None)
+        image_path = os.path.join(self.test_dir.name, 'receipt.jpg')
+        with open(image_path, 'wb') as f:
+            f.write(b'fake image data')
+
+        def fake_extract_text(filepath, data=None):
+            processor.ocr_metadata['pages'] = [{'crop_box': [1, 2, 3, 4]}]
+            return "SAFEWAY"
+        mock_extract_text.side_effect = fake_extract_text
+
+        processor.process_receipt(image_path)
+
+        self.assertEqual(job.meta['pages'], [{'crop_box': [1, 2, 3, 4]}])
+        job.save_meta.assert_called_once()
+
+    def _create_skewed_receipt(self, angle):
+        """Create a receipt scan with text lines rotated by angle degrees"""
+        img = np.full((1600, 1200), 235, dtype=np.uint8)
+        for row in range(100, 1500, 50):
+            cv2.putText(img, 'ORGANIC BANANAS 1.99 S', (100, row), cv2.FONT_HERSHEY_SIMPLEX, 1.2, 0, 3)
+        matrix = cv2.getRotationMatrix2D((600, 800), angle, 1.0)
+        return cv2.warpAffine(img, matrix, (1200, 1600), borderValue=235)
+
+    def test_estimate_skew_angle(self):
+        """Test that the estimated angle undoes the rotation"""
+        processor = ReceiptProcessor(ocr_cache=None)
+
+        for angle in (-6, -2.5, 3, 8):
+            self.assertAlmostEqual(processor.estimate_skew_angle(self._create_skewed_receipt(angle)), -angle, delta=0.4)
+
+        # The fine sweep does not depend on how long the coarse one took
+        skewed = self._create_skewed_receipt(2.5)
+        angle = processor.estimate_skew_angle(skewed)
+        processor.deskew_budget_ms = 0
+        self.assertEqual(processor.estimate_skew_angle(skewed), angle)
+        self.assertNotEqual(angle, round(angle))
+
+    def test_deskew_image(self):
+        """Test that skewed images are rotated and straight ones left alone"""
+        processor = ReceiptProcessor(ocr_cache=None)
+        straight = self._create_skewed_receipt(0)
+        metadata = {}
+
+        self.assertIs(processor.deskew_image(straight, metadata), straight)
+        self.assertLess(abs(metadata['skew_angle']), 0.3)
+
+        skewed = self._create_skewed_receipt(5)
+        deskewed = processor.deskew_image(skewed, metadata)
+        self.assertAlmostEqual(metadata['skew_angle'], -5, delta=0.4)
+        self.assertIn('deskew_ms', metadata)
+        self.assertAlmostEqual(processor.estimate_skew_angle(deskewed), 0, delta=0.4)
+
+    @patch('pytesseract.image_to_osd')
+    def test_orient_image_on_downscaled_copy(self, mock_image_to_osd):
+        """Test that sideways pages are rotated upright and uncertain ones left alone"""
+        processor = ReceiptProcessor(ocr_cache=None)
+        upright = self._create_skewed_receipt(0)
+        sideways = cv2.rotate(upright, cv2.ROTATE_90_COUNTERCLOCKWISE)
+        mock_image_to_osd.return_value = {'rotate': 90, 'orientation_conf': 5.3}
+        metadata = {}
+
+        oriented = processor.orient_image(sideways, metadata, max_side=800)
+
+        np.testing.assert_array_equal(oriented, upright)
+        self.assertEqual(max(mock_image_to_osd.call_args[0][0].shape), 800)
+        self.assertEqual(metadata['orientation_rotate'], 90)
+        self.assertIn('orientation_ms', metadata)
+
+        mock_image_to_osd.return_value = {'rotate': 180, 'orientation_conf': 0.4}
+        self.assertIs(processor.orient_image(upright), upright)
+
+        # Too little text for orientation detection
+        mock_image_to_osd.side_effect = pytesseract.TesseractError(1, 'Too few characters')
+        self.assertIs(processor.orient_image(upright), upright)
+
+    def test_load_image_applies_exif_orientation(self):
+        """Test that photos with an EXIF rotation are decoded upright"""
+        processor = ReceiptProcessor(ocr_cache=None, text_height=0)
+        path = os.path.join(self.test_dir.name, 'rotated.jpg')
+        exif = Image.Exif()
+        exif[0x0112] = 6  # Rotate 90 degrees clockwise to display
+        Image.fromarray(np.full((100, 300), 255, dtype=np.uint8)).save(path, exif=exif)
+
+        self.assertEqual(processor.load_image(path).shape, (300, 100))
+
+    def _create_text_image(self, font_scale, thickness):
+        """Create a receipt scan with text of the given size"""
+        height = int(1200 * font_scale)
+        img = np.full((height, int(700 * font_scale)), 235, dtype=np.uint8)
+        for row in range(int(40 * font_scale), height - 10, int(40 * font_scale)):
+            cv2.putText(img, 'ORGANIC BANANAS 1.99', (10, row), cv2.FONT_HERSHEY_SIMPLEX, font_scale, 0, thickness)
+        return img
+
+    def test_normalize_resolution(self):
+        """Test that small text is enlarged, large text shrunk, and the target size is kept"""
+        processor = ReceiptProcessor(ocr_cache=None, text_height=30)
+
+        for font_scale, thickness in ((0.6, 1), (1.5, 3), (4.0, 8)):
+            metadata = {}
+            normalized = processor.normalize_resolution(self._create_text_image(font_scale, thickness), metadata)
+            self.assertAlmostEqual(processor.estimate_text_height(normalized), 30, delta=6)
+            if font_scale < 1:
+                self.assertGreater(metadata['resize_scale'], 1)
+            elif font_scale > 2:
+                self.assertLess(metadata['resize_scale'], 1)
+                self.assertIn('normalize_ms', metadata)
+
+    def test_normalize_resolution_without_text(self):
+        """Test that blank images are not resampled"""
+        processor = ReceiptProcessor(ocr_cache=None, text_height=30)
+        blank = np.full((300, 200), 255, dtype=np.uint8)
+
+        self.assertIs(processor.normalize_resolution(blank), blank)
+
+    def test_find_line_strips(self):
+        """Test that each printed line becomes one strip, top to bottom"""
+        processor = ReceiptProcessor(ocr_cache=None)
+        binary = np.full((300, 400), 255, dtype=np.uint8)
+        for row in (40, 100, 160, 220):
+            cv2.putText(binary, 'APPLES 2.99', (10, row), cv2.FONT_HERSHEY_SIMPLEX, 0.8, 0, 2)
+        binary[280, 5] = 0  # a speck of noise
+
+        strips = processor.find_line_strips(binary)
+
+        self.assertEqual(len(strips), 4)
+        for (top, bottom), row in zip(strips, (40, 100, 160, 220)):
+            self.assertLess(top, row - 15)
+            self.assertGreaterEqual(bottom, row)
+        for (_, bottom), (top, _) in zip(strips, strips[1:]):
+            self.assertLessEqual(bottom, top)
+
+    @patch('pytesseract.image_to_data')
+    def test_ocr_line_strips_keeps_line_order(self, mock_image_to_data):
+        """Test that line strips are OCR'd in single-line mode and joined in order"""
+        mock_image_to_data.side_effect = lambda img, config=None, output_type=None: make_ocr_data([f"{config.split()[1]}:{img.shape[0]}"])
+        processor = ReceiptProcessor(ocr_cache=None, line_workers=4)
+        binary = np.full((300, 400), 255, dtype=np.uint8)
+        for i, row in enumerate((40, 110, 180, 260)):
+            cv2.putText(binary, 'APPLES 2.99', (10, row), cv2.FONT_HERSHEY_SIMPLEX, 0.5 + 0.3 * i, 0, 2)
+
+        lines = processor.ocr_line_strips(binary, '--psm 6 --user-words /config/ocr_dict.txt')
+
+        heights = [line['box'][3] for line in lines]
+        self.assertEqual([line['text'] for line in lines], [f"7:{h}" for h in heights])
+        self.assertEqual(heights, sorted(heights))
+        self.assertEqual([line['box'][1] for line in lines], sorted(line['box'][1] for line in lines))
+
+    def test_data_to_lines(self):
+        """Test that words are grouped into lines with boxes and mean confidence"""
+        processor = ReceiptProcessor(ocr_cache=None)
+        data = make_ocr_data(["SAFEWAY", "APPLES 2.99"])
+        data['conf'][1] = 45.0
+        data['text'].append('')
+        data['conf'].append(-1)
+        for column in ('page_num', 'block_num', 'par_num', 'line_num', 'left', 'top', 'width', 'height'):
+            data[column].append(1)
+
+        lines = processor.data_to_lines(data)
+
+        self.assertEqual([line['text'] for line in lines], ["SAFEWAY", "APPLES 2.99"])
+        self.assertEqual(lines[1]['box'], [10, 40, 90, 15])
+        self.assertEqual(lines[1]['conf'], 70.0)
+        self.assertEqual(processor.lines_to_text(lines), "SAFEWAY\nAPPLES 2.99")
+
+    @patch('pytesseract.image_to_data')
+    def test_reocr_low_confidence_lines(self, mock_image_to_data):
+        """Test that only low-confidence lines are re-OCR'd, keeping the better reading"""
+        mock_image_to_data.return_value = make_ocr_data(["BANANAS 1.49"], conf=88.0)
+        processor = ReceiptProcessor(ocr_cache=None, reocr_confidence=60)
+        gray = np.full((100, 200), 235, dtype=np.uint8)
+        lines = [
+            {'box': [10, 10, 100, 20], 'text': 'SAFEWAY', 'conf': 93.0, 'paragraph': [1, 1, 1]},
+            {'box': [10, 50, 100, 20], 'text': 'BANANA5 l.49', 'conf': 41.0, 'paragraph': [1, 1, 1]},
+        ]
+        metadata = {}
+
+        processor.reocr_low_confidence_lines(gray, lines, '--psm 6', metadata)
+
+        self.assertEqual(mock_image_to_data.call_count, 1)
+        self.assertIn('--psm 7', mock_image_to_data.call_args.kwargs['config'])
+        self.assertEqual(lines[0]['text'], 'SAFEWAY')
+        self.assertEqual(lines[1]['text'], 'BANANAS 1.49')
+        self.assertEqual(lines[1]['reocr'], 'upscale_otsu')
+        self.assertEqual(metadata['low_confidence_lines'], 1)
+        self.assertEqual(metadata['reocr_improved_lines'], 1)
+
+    def test_default_preprocessing_follows_flags(self):
+        """Test that the default pipeline is built from the stage flags and env override"""
+        self.assertEqual(
+            ReceiptProcessor(ocr_cache=None, auto_crop=True, orientation=True, deskew=True, text_height=30).preprocessing,
+            ['grayscale', 'crop', 'orient', 'deskew', 'normalize', 'threshold']
+        )
+        self.assertEqual(
+            ReceiptProcessor(ocr_cache=None, auto_crop=False, orientation=False, deskew=False, text_height=0).preprocessing,
+            ['grayscale', 'threshold']
+        )
+        # Orientation detection costs a Tesseract pass per page, so it is opt-in
+        with patch.dict(os.environ):
+            del os.environ['OCR_ORIENTATION']
+            self.assertNotIn('orient', ReceiptProcessor(ocr_cache=None).preprocessing)
+        with patch.dict(os.environ, {'OCR_PREPROCESSING': 'grayscale, median_blur,adaptive_threshold'}):
+            self.assertEqual(
+                ReceiptProcessor(ocr_cache=None).preprocessing,
+                ['grayscale', 'median_blur', 'adaptive_threshold']
+            )
+
+    def test_run_preprocessing_records_stage_timings(self):
+        """Test that stages run in order with parameters and unknown stages are skipped"""
+        processor = ReceiptProcessor(ocr_cache=None)
+        img = cv2.cvtColor(self._create_text_image(1.0, 2), cv2.COLOR_GRAY2BGR)
+        metadata = {}
+
+        binary = processor.run_preprocessing(
+            img, ['grayscale', {'name': 'median_blur', 'ksize': 5}, 'sharpen', 'threshold'], metadata
+        )
+
+        self.assertEqual(binary.ndim, 2)
+        self.assertEqual(set(np.unique(binary)), {0, 255})
+        self.assertEqual([stage['stage'] for stage in metadata['stages']], ['grayscale', 'median_blur', 'threshold'])
+        self.assertEqual(metadata['stages'][0]['bytes'], img.nbytes // 3)
+        for stage in metadata['stages']:
+            self.assertIn('ms', stage)
+
+    def test_split_preprocessing_at_first_binarizing_stage(self):
+        """Test that re-OCR gets the image from before thresholding"""
+        processor = ReceiptProcessor(ocr_cache=None)
+        stages = ['grayscale', {'name': 'deskew'}, {'name': 'adaptive_threshold', 'c': 5}, 'open']
+
+        self.assertEqual(
+            processor.split_preprocessing(stages),
+            (['grayscale', {'name': 'deskew'}], [{'name': 'adaptive_threshold', 'c': 5}, 'open'])
+        )
+
+    @patch('app.ocr.processor.ReceiptProcessor.extract_text', return_value="SAFEWAY")
+    @patch('app.ocr.processor.ReceiptProcessor.get_default_receipt_processors', return_value=[])
+    @patch('app.ocr.processor.ReceiptProcessor.get_custom_receipt_processors')
+    def test_process_receipt_uses_store_settings(self, mock_custom_processors, mock_default_processors, mock_extract_text):
+        """Test that a store's profile and pipeline are used and other stores get the defaults"""
+        mock_custom_processors.return_value = [
+            {'name': 'Safeway', 'profile': 'fast', 'preprocessing': ['grayscale', 'adaptive_threshold']},
+            {'name': 'Costco'},
+        ]
+        processor = ReceiptProcessor(ocr_cache=None, dpi=200, preprocessing=['grayscale', 'threshold'])
+        image_path = os.path.join(self.test_dir.name, 'receipt.jpg')
+        with open(image_path, 'wb') as f:
+            f.write(b'fake image data')
+
+        processor.process_receipt(image_path, store='Safeway')
+        self.assertEqual(processor.profile, 'fast')
+        self.assertEqual(processor.dpi, 150)
+        self.assertEqual(processor.preprocessing, ['grayscale', 'adaptive_threshold'])
+
+        processor.process_receipt(image_path, store='Costco')
+        self.assertEqual(processor.profile, 'balanced')
+        self.assertEqual(processor.dpi, 200)
+        self.assertEqual(processor.preprocessing, ['grayscale', 'threshold'])
+
+        # A profile picked for the upload wins over the store's
+        processor.process_receipt(image_path, store='Safeway', profile='accurate')
+        self.assertEqual(processor.profile, 'accurate')
+        self.assertEqual(processor.ocr_metadata['profile'], 'accurate')
+
+    @patch.dict(os.environ, {'OCR_PROFILE': 'fast', 'OCR_TESSDATA_FAST_DIR': '/usr/share/tessdata_fast'})
+    def test_profile_from_environment(self):
+        """Test that the default profile sets the engine mode, model, DPI and stages"""
+        processor = ReceiptProcessor(ocr_cache=None, dpi=200, reocr_confidence=60)
+
+        self.assertEqual(processor.profile, 'fast')
+        self.assertEqual(processor.dpi, 150)
+        self.assertEqual(processor.reocr_confidence, 0)
+        self.assertEqual(processor.preprocessing, ['grayscale', 'normalize', 'threshold'])
+        self.assertEqual(
+            processor.get_tesseract_config(),
+            '--oem 1 --psm 6 --user-words /config/ocr_dict.txt --tessdata-dir /usr/share/tessdata_fast'
+        )
+
+        processor.use_profile('turbo')
+        self.assertEqual(processor.profile, 'balanced')
+        self.assertEqual(processor.get_tesseract_config(), '--psm 6 --user-words /config/ocr_dict.txt')
+        self.assertEqual(processor.reocr_confidence, 60)
+
+    def test_detect_store_prefers_store_named_first(self):
+        """Test that a store named in the header beats one listed earlier in the config"""
+        processor = ReceiptProcessor(ocr_cache=None)
+        stores = [
+            {'name': 'Safeway', 'search_string': 'SAFEWAY'},
+            {'name': 'Albertsons', 'search_string': 'Albertsons'},
+        ]
+
+        store = processor.detect_store("ALBERTSONS #4321\nBANANAS 1.49\nSave with your Safeway for U card", stores)
+
+        self.assertEqual(store['name'], 'Albertsons')
+        self.assertIs(processor.get_store(), store)
+        self.assertIsNone(processor.detect_store("CORNER SHOP", stores))
+
+    def test_processors_evaluated_in_one_pass(self):
+        """Test that every processor sees each cleaned line once and the best one wins"""
+        processor = ReceiptProcessor(ocr_cache=None)
+        store = {'name': 'Corner Shop', 'processors': [
+            # Only fits lines without a barcode
+            r'^(?P<title>[A-Z]+)\s+(?P<price>\d+\.\d{2})$',
+            r'^(?P<barcode>\d+)?\s*(?P<title>[A-Z]+)\s+(?P<price>\d+\.\d{2})$',
+        ]}
+        text = "CORNER SHOP\nAPPLES 2.99\n4011 BANANAS 1.49\nTOTAL 4.48"
+
+        with patch.object(processor, 'clean_line', wraps=processor.clean_line) as mock_clean_line:
+            results = processor.match_products(text, [re.compile(pattern) for pattern in store['processors']])
+        self.assertEqual(mock_clean_line.call_count, 4)
+        self.assertEqual([len(products) for products in results], [2, 3])
+
+        # The first processor's partial match no longer wins
+        products = processor.cycle_processors_get_products(text, store)
+        self.assertEqual([product['name'] for product in products], ['APPLES', 'BANANAS', 'TOTAL'])
+        self.assertEqual(products[1]['barcode'], '4011')
+
+    def test_products_reconcile_with_total(self):
+        """Test that product prices are checked against subtotal, total and balance lines"""
+        processor = ReceiptProcessor(ocr_cache=None)
+        text = "APPLES 2.99\nBANANAS 1.49\nTOTAL SAVINGS 0.50\nSUBTOTAL 4.48\nTAX 0.36\n**** BALANCE $4,84"
+        products = [{'price': 2.99}, {'price': 1.49}]
+
+        self.assertEqual(processor.find_receipt_totals(text), [4.48, 4.84])
+        self.assertTrue(processor.products_reconcile(products, text))
+        self.assertFalse(processor.products_reconcile(products[:1], text))
+        self.assertTrue(processor.products_reconcile(products + [{'name': 'SUBTOTAL', 'price': 4.48}], text))
+        self.assertFalse(processor.products_reconcile([], "TOTAL 0.00"))
+
+    def _adaptive_processor(self, texts_by_psm):
+        """Create an adaptive processor whose OCR text depends on the psm"""
+        processor = ReceiptProcessor(ocr_cache=None, adaptive=True)
+        self.extract_calls = []
+
+        def fake_extract_text(filepath, data=None):
+            self.extract_calls.append((processor.psm, processor.preprocessing[-1], processor.profile))
+            return texts_by_psm.get(processor.psm, texts_by_psm[6])
+        processor.extract_text = fake_extract_text
+        processor.get_custom_receipt_processors = lambda: []
+        processor.get_default_receipt_processors = lambda: [
+            {'name': 'Corner Shop', 'search_string': 'CORNER SHOP', 'processors': [r'^(?P<title>[A-Z ]+)\s+(?P<price>\d+\.\d{2})$']}
+        ]
+        return processor
+
+    @patch('app.ocr.processor.ReceiptProcessor.save_job_metadata')
+    def test_adaptive_ocr_stops_at_reconciled_pass(self, mock_save_job_metadata):
+        """Test that passes stop once the products add up to the total"""
+        processor = self._adaptive_processor({
+            6: "CORNER SHOP\nAPPLES 2.99\nBANANA5 l.49\nTOTAL 4.48",
+            4: "CORNER SHOP\nAPPLES 2.99\nBANANAS 1.49\nTOTAL 4.48",
+        })
+        image_path = os.path.join(self.test_dir.name, 'receipt.jpg')
+        with open(image_path, 'wb') as f:
+            f.write(b'fake image data')
+
+        txt_path = processor.process_receipt(image_path)
+
+        self.assertEqual([call[0] for call in self.extract_calls], [6, 4])
+        with open(txt_path) as f:
+            self.assertIn("BANANAS 1.49", f.read())
+        metadata = mock_save_job_metadata.call_args.args[0]
+        self.assertEqual(metadata['ocr_pass'], 1)
+        self.assertEqual([p['reconciled'] for p in metadata['ocr_passes']], [False, True])
+
+    def test_adaptive_ocr_keeps_pass_with_most_products(self):
+        """Test that every pass runs when none reconciles, keeping the best one"""
+        processor = self._adaptive_processor({
+            6: "CORNER SHOP\nAPPLES 2.99\nBANANA5 l.49\nTOTAL 9.99",
+            4: "CORNER SHOP\nAPPLES 2.99\nBANANAS 1.49\nTOTAL 9.99",
+        })
+
+        text = processor.extract_text_adaptive(self.test_pdf_path, profile='balanced')
+
+        self.assertEqual(
+            self.extract_calls,
+            [(6, 'threshold', 'balanced'), (4, 'threshold', 'balanced'),
+             (6, 'adaptive_threshold', 'balanced'), (6, 'threshold', 'accurate')]
+        )
+        self.assertIn("BANANAS 1.49", text)
+        self.assertEqual(processor.ocr_metadata['ocr_pass'], 1)
+
+    def test_adaptive_ocr_records_winning_pass_settings(self):
+        """Test that the metadata names the profile and pipeline of the pass that won"""
+        processor = self._adaptive_processor({6: "CORNER SHOP\nAPPLES 2.99\nBANANA5 l.49\nTOTAL 4.48"})
+        extract_text = processor.extract_text
+
+        def fake_extract_text(filepath, data=None):
+            text = extract_text(filepath, data)
+            return text.replace("BANANA5 l.49", "BANANAS 1.49") if processor.profile == 'accurate' else text
+        processor.extract_text = fake_extract_text
+        store_preprocessing = ['grayscale', 'adaptive_threshold']
+        processor.ocr_metadata = {'profile': 'balanced', 'preprocessing': store_preprocessing, 'psm': 6}
+
+        processor.extract_text_adaptive(self.test_pdf_path, profile='balanced', store_preprocessing=store_preprocessing)
+
+        self.assertEqual(processor.ocr_metadata['ocr_pass'], 3)
+        self.assertEqual(processor.ocr_metadata['profile'], 'accurate')
+        self.assertEqual(processor.ocr_metadata['preprocessing'], processor.default_preprocessing)
+        self.assertEqual(processor.ocr_metadata['psm'], 6)
+
+    def test_find_tiles_cover_page_once(self):
+        """Test that tiles overlap but every row is owned by exactly one tile"""
+        processor = ReceiptProcessor(ocr_cache=None, tile_height=4000, tile_overlap=200)
+
+        self.assertEqual(
+            processor.find_tiles(10000),
+            [(0, 3900, 0, 3800), (3700, 7700, 3800, 7600), (7500, 10000, 7600, 10000)]
+        )
+        # A sliver at the bottom is folded into the last full tile
+        self.assertEqual(processor.find_tiles(7650)[-1], (3700, 7650, 3800, 7650))
+
+        # Tiling settings change the text, so they are part of the cache key
+        self.assertEqual(processor.get_ocr_settings()['tile_height'], 4000)
+        self.assertEqual(processor.get_ocr_settings()['tile_overlap'], 200)
+
+        # An overlap as tall as the tiles is clamped instead of tiling row by row
+        processor = ReceiptProcessor(ocr_cache=None, tile_height=4000, tile_overlap=4000)
+        self.assertEqual(processor.tile_overlap, 2000)
+        self.assertEqual(len(processor.find_tiles(10000)), 5)
+
+    @patch('pytesseract.image_to_data')
+    def test_ocr_tiles_deduplicates_overlaps_in_order(self, mock_image_to_data):
+        """Test that tiled OCR reads every line once, in page order, whatever order tiles finish in"""
+        # Twenty 20px lines, each identified by the width of its ink
+        binary = np.full((1000, 200), 255, dtype=np.uint8)
+        for i in range(20):
+            binary[10 + 50 * i:30 + 50 * i, :10 + 5 * i] = 0
+
+        # Tiles started first finish last
+        delays = [0.04, 0.03, 0.02, 0.01, 0.0]
+
+        def fake_image_to_data(img, config=None, output_type=None):
+            time.sleep(delays.pop(0))
+            inked = np.concatenate(([0], (img < 128).any(axis=1).astype(np.int8), [0]))
+            edges = np.flatnonzero(np.diff(inked))
+            data = {column: [] for column in ('page_num', 'block_num', 'par_num', 'line_num', 'left', 'top', 'width', 'height', 'conf', 'text')}
+            for line_num, (top, bottom) in enumerate(zip(edges[::2], edges[1::2]), start=1):
+                width = int(np.count_nonzero(img[top] < 128))
+                row = {
+                    'page_num': 1, 'block_num': 1, 'par_num': 1, 'line_num': line_num,
+                    'left': 0, 'top': int(top), 'width': width, 'height': int(bottom - top),
+                    'conf': 90.0, 'text': f"LINE{(width - 10) // 5}",
+                }
+                for column, value in row.items():
+                    data[column].append(value)
+            return data
+        mock_image_to_data.side_effect = fake_image_to_data
+        processor = ReceiptProcessor(ocr_cache=None, tile_height=300, tile_overlap=60, line_workers=4)
+        metadata = {}
+
+        lines = processor.ocr_tiles(binary, '--psm 6', metadata)
+
+        self.assertEqual([line['text'] for line in lines], [f"LINE{i}" for i in range(20)])
+        self.assertEqual([line['box'][1] for line in lines], [10 + 50 * i for i in range(20)])
+        self.assertEqual(len(metadata['tiles']), 5)
+        self.assertEqual(mock_image_to_data.call_count, 5)
+
+    def test_load_image_decodes_large_jpeg_reduced(self):
+        """Test that large text is decoded at reduced size, straight to grayscale"""
+        processor = ReceiptProcessor(ocr_cache=None, text_height=30)
+        large_path = os.path.join(self.test_dir.name, 'large.jpg')
+        cv2.imwrite(large_path, cv2.cvtColor(self._create_text_image(4.0, 8), cv2.COLOR_GRAY2BGR))
+        metadata = {}
+
+        img = processor.load_image(large_path, metadata=metadata)
+
+        self.assertEqual(img.ndim, 2)
+        self.assertEqual(metadata['decode_factor'], 2)
+        self.assertEqual(img.shape, (2400, 1400))
+        self.assertGreaterEqual(processor.estimate_text_height(img), 30)
+
+        # Without normalization the full image is needed
+        processor = ReceiptProcessor(ocr_cache=None, text_height=0)
+        with open(large_path, 'rb') as f:
+            img = processor.load_image(large_path, data=f.read(), metadata=metadata)
+        self.assertEqual(metadata['decode_factor'], 1)
+        self.assertEqual(img.shape, (4800, 2800))
+
+    def test_load_image_keeps_small_text_full_size(self):
+        """Test that images whose text is near the target size are decoded in full"""
+        processor = ReceiptProcessor(ocr_cache=None, text_height=30)
+        path = os.path.join(self.test_dir.name, 'small.jpg')
+        cv2.imwrite(path, self._create_text_image(1.5, 3))
+        metadata = {}
+
+        img = processor.load_image(path, metadata=metadata)
+
+        self.assertEqual(metadata['decode_factor'], 1)
+        self.assertEqual(img.shape, (1800, 1050))
+
+    @patch('pytesseract.image_to_data', side_effect=fake_image_to_data)
+    def test_repeat_ocr_reuses_preprocessed_image(self, mock_image_to_data):
+        """Test that OCR with other Tesseract settings skips decoding and preprocessing"""
+        image_cache = ImageCache(os.path.join(self.test_dir.name, 'images'), 1024 * 1024, ttl=60)
+        processor = ReceiptProcessor(ocr_cache=None, image_cache=image_cache, auto_crop=False, deskew=False, text_height=0)
+        image_path = os.path.join(self.test_dir.name, 'receipt.png')
+        cv2.imwrite(image_path, np.full((60, 40), 255, dtype=np.uint8))
+
+        with patch.object(processor, 'load_image', wraps=processor.load_image) as mock_load_image:
+            first = processor.extract_text(image_path)
+            self.assertEqual(processor.ocr_metadata['pages'][0]['image_cache'], 'miss')
+            processor.psm = 4
+            second = processor.extract_text(image_path)
+
+        self.assertEqual(first, second)
+        mock_load_image.assert_called_once()
+        self.assertEqual(processor.ocr_metadata['pages'][0]['image_cache'], 'hit')
+        self.assertIn('--psm 4', mock_image_to_data.call_args.kwargs['config'])
+
+    def _processed_receipt(self):
+        """Write a receipt image, its OCR text and the metadata it was processed with"""
+        image_path = os.path.join(self.test_dir.name, 'receipt.png')
+        cv2.imwrite(image_path, np.full((120, 200), 235, dtype=np.uint8))
+        txt_path = os.path.join(self.test_dir.name, 'receipt.txt')
+        lines = [
+            {'box': [10, 10, 100, 20], 'text': 'SAFEWAY', 'conf': 93.0, 'paragraph': [1, 1, 1]},
+            {'box': [10, 50, 100, 20], 'text': 'BANANA5 l.49', 'conf': 41.0, 'paragraph': [1, 1, 2]},
+            {'box': [10, 80, 100, 20], 'text': 'APPLE5 2.99', 'conf': 45.0, 'paragraph': [1, 1, 2]},
+        ]
+        processor = ReceiptProcessor(ocr_cache=None)
+        with open(txt_path, 'w') as f:
+            f.write(processor.pre_filter_text(processor.lines_to_text(lines)))
+        metadata = {'profile': 'balanced', 'preprocessing': ['grayscale', 'threshold'], 'pages': [{'lines': lines}]}
+        return image_path, txt_path, metadata
+
+    @patch('pytesseract.image_to_data')
+    def test_reocr_region_line_range(self, mock_image_to_data):
+        """Test that re-OCR of a line range patches only those lines of the text file"""
+        mock_image_to_data.return_value = make_ocr_data(["BANANAS 1.49"], conf=91.0)
+        image_path, txt_path, metadata = self._processed_receipt()
+        processor = ReceiptProcessor(ocr_cache=None)
+
+        result = processor.reocr_region(image_path, txt_path, metadata, first_line=3)
+
+        with open(txt_path) as f:
+            self.assertEqual(f.read(), "SAFEWAY\n\nBANANAS 1.49\nAPPLE5 2.99")
+        self.assertEqual(result['replaced'], [{'line': 3, 'old': 'BANANA5 l.49', 'new': 'BANANAS 1.49'}])
+        # One pass per re-OCR variant, with the accurate profile in single-line mode
+        self.assertEqual(mock_image_to_data.call_count, 2)
+        self.assertIn('--psm 7', mock_image_to_data.call_args.kwargs['config'])
+        self.assertIn('--oem 1', mock_image_to_data.call_args.kwargs['config'])
+        self.assertEqual(result['pages'][0]['lines'][1]['text'], 'BANANAS 1.49')
+
+    @patch('pytesseract.image_to_data')
+    def test_reocr_region_box(self, mock_image_to_data):
+        """Test that the text read from a rectangle replaces the lines inside it"""
+        mock_image_to_data.return_value = make_ocr_data(["BANANAS 1.49", "APPLES 2.99"], conf=91.0)
+        image_path, txt_path, metadata = self._processed_receipt()
+        processor = ReceiptProcessor(ocr_cache=None)
+
+        result = processor.reocr_region(image_path, txt_path, metadata, box=[0, 40, 200, 70])
+
+        with open(txt_path) as f:
+            self.assertEqual(f.read(), "SAFEWAY\n\nBANANAS 1.49\nAPPLES 2.99")
+        self.assertEqual([line['text'] for line in result['pages'][0]['lines']], ['SAFEWAY', 'BANANAS 1.49', 'APPLES 2.99'])
+
+        with self.assertRaises(ValueError):
+            processor.reocr_region(image_path, txt_path, {'pages': []}, first_line=1)
+
+    @patch('pytesseract.image_to_data', return_value=make_ocr_data([]))
+    def test_reocr_region_box_without_text_keeps_lines(self, mock_image_to_data):
+        """Test that a rectangle that reads as empty leaves the text file alone"""
+        image_path, txt_path, metadata = self._processed_receipt()
+        with open(txt_path) as f:
+            original = f.read()
+        processor = ReceiptProcessor(ocr_cache=None)
+
+        with self.assertRaises(ValueError):
+            processor.reocr_region(image_path, txt_path, metadata, box=[0, 40, 200, 70])
+
+        with open(txt_path) as f:
+            self.assertEqual(f.read(), original)
+        self.assertEqual(len(metadata['pages'][0]['lines']), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -115,6 +115,27 @@ class TestWebApp(unittest.TestCase):
         self.assertEqual(response.status_code, 302)  # Redirect to review
         self.assertIn('/review/test-job-id', response.location)
     
+    @patch('app.web.app.queue')
+    def test_processing_route_lists_split_receipts(self, mock_queue):
+        """Test processing route with a scan split into one job per receipt"""
+        # Setup mock
+        mock_job = MagicMock()
+        mock_job.is_finished = True
+        mock_job.meta = {'receipts': [
+            {'filepath': '/uploads/scan_receipt1.png', 'box': [10, 20, 300, 900], 'job_id': 'job-1'},
+            {'filepath': '/uploads/scan_receipt2.png', 'box': [400, 20, 300, 900], 'job_id': 'job-2'},
+        ]}
+        mock_queue.fetch_job.return_value = mock_job
+        
+        # Access processing page
+        response = self.client.get('/processing/test-job-id')
+        
+        # Assertions
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'2 Receipts Found', response.data)
+        self.assertIn(b'/processing/job-1', response.data)
+        self.assertIn(b'/processing/job-2', response.data)
+    
     @patch('app.web.app.queue')
     def test_job_status_route(self, mock_queue):
         """Test job status API endpoint"""
@@ -162,6 +183,50 @@ class TestWebApp(unittest.TestCase):
         data = json.loads(response.data)
         self.assertEqual(data['status'], 'error')
     
+    @patch('app.web.app.copy')
+    @patch('app.web.app.receipt_processor')
+    @patch('app.web.app.queue')
+    def test_reocr_region_route(self, mock_queue, mock_shared_processor, mock_copy):
+        """Test re-OCR of a line range patches the job's OCR text"""
+        # Setup mocks
+        mock_receipt_processor = mock_copy.copy.return_value
+        mock_job = MagicMock()
+        mock_job.is_finished = True
+        mock_job.args = ['/uploads/receipt.jpg']
+        mock_job.result = '/uploads/receipt.txt'
+        mock_job.meta = {'pages': []}
+        mock_queue.fetch_job.return_value = mock_job
+        mock_receipt_processor.reocr_region.return_value = {
+            'text': 'SAFEWAY\nBANANAS 1.49',
+            'replaced': [{'line': 2, 'old': 'BANANA5 l.49', 'new': 'BANANAS 1.49'}],
+            'pages': [{'lines': []}],
+        }
+        
+        # Re-OCR line 2
+        response = self.client.post('/ocr/test-job-id/region', json={'first_line': 2, 'last_line': 2})
+        
+        # Assertions
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data)
+        self.assertEqual(data['text'], 'SAFEWAY\nBANANAS 1.49')
+        self.assertEqual(mock_receipt_processor.reocr_region.call_args.kwargs['first_line'], 2)
+        self.assertEqual(mock_job.meta['pages'], [{'lines': []}])
+        mock_job.save_meta.assert_called_once()
+        # The request works on its own copy of the shared processor
+        mock_copy.copy.assert_called_once_with(mock_shared_processor)
+        mock_shared_processor.reocr_region.assert_not_called()
+        
+        # Regions without stored line positions are rejected
+        mock_receipt_processor.reocr_region.side_effect = ValueError('No OCR line positions found for this region')
+        response = self.client.post('/ocr/test-job-id/region', json={'first_line': 9})
+        self.assertEqual(response.status_code, 400)
+        
+        # A missing OCR text file is a JSON error, not a server error
+        mock_receipt_processor.reocr_region.side_effect = FileNotFoundError('/uploads/receipt.txt')
+        response = self.client.post('/ocr/test-job-id/region', json={'first_line': 2})
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(json.loads(response.data)['status'], 'error')
+    
     @patch('app.web.app.queue')
     @patch('app.web.app.grocy_client')
     def test_review_route(self, mock_grocy_client, mock_queue):